@@ -0,0 +1,94 @@
+''' peak memory of decoding a pickled catalog payload from a response stream
+
+Compares the ways catalog_query can turn the records chunks of a
+FindCatalog/Gaia3Search stream into the (rows, columns) object:
+
+    bytesio   collect the chunks in a BytesIO, then pickle.loads(getvalue())
+    grown     collect them in a bytearray, then pickle.loads(memoryview)
+    streamed  common.stream.read_catalog, unpickled straight from the chunks
+
+Run each mode in its own process, so one doesn't skew the next:
+
+    python benchmarks/catalog_decode_memory.py streamed --rows 2000000
+
+tracemalloc reports the memory held by the result and the peak on top of
+it; --rss reports the growth of the peak RSS of the process instead.
+'''
+import io
+import gc
+import sys
+import time
+import pickle
+import argparse
+import resource
+import tracemalloc
+
+from csst_dfs_api_cluster.common.stream import read_catalog
+
+class Resp(object):
+    ''' the fields of a catalog stream response that read_catalog uses '''
+    __slots__ = ('records', 'success', 'totalCount')
+
+    def __init__(self, records, totalCount):
+        self.records = records
+        self.success = True
+        self.totalCount = totalCount
+
+def make_payload(n):
+    rows = [(i, i * 1e-6, i * 2e-6, 15.0) for i in range(n)]
+    return pickle.dumps((rows, ['source_id', 'ra', 'dec', 'phot_g_mean_mag']))
+
+def responses(payload, chunk_size, n):
+    # a fresh bytes object per chunk, as the gRPC runtime hands them out
+    for i in range(0, len(payload), chunk_size):
+        yield Resp(bytes(payload[i:i + chunk_size]), n)
+
+def decode_bytesio(resps):
+    buf = io.BytesIO()
+    for resp in resps:
+        buf.write(resp.records)
+    return pickle.loads(buf.getvalue())
+
+def decode_grown(resps):
+    buf = bytearray()
+    for resp in resps:
+        buf += resp.records
+    with memoryview(buf) as view:
+        return pickle.loads(view)
+
+def decode_streamed(resps):
+    return read_catalog(resps)[0]
+
+MODES = {"bytesio": decode_bytesio, "grown": decode_grown, "streamed": decode_streamed}
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__.splitlines()[0])
+    parser.add_argument("mode", choices = sorted(MODES))
+    parser.add_argument("--rows", type = int, default = 2000000, help = "rows of the catalog, default 2000000")
+    parser.add_argument("--chunk-size", type = int, default = 4 * 1024 * 1024, help = "bytes per response, default 4 MB")
+    parser.add_argument("--rss", action = "store_true", help = "measure the peak RSS instead of tracemalloc")
+    args = parser.parse_args()
+
+    payload = make_payload(args.rows)
+    decode = MODES[args.mode]
+    gc.collect()
+    if args.rss:
+        before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        t = time.time()
+        obj = decode(responses(payload, args.chunk_size, args.rows))
+        elapsed = time.time() - t
+        growth = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before
+        print("%-9s payload %4d MB  peak RSS growth %5d MB  %.2fs" % (args.mode, len(payload) >> 20, growth >> 10, elapsed))
+    else:
+        tracemalloc.start()
+        base = tracemalloc.get_traced_memory()[0]
+        t = time.time()
+        obj = decode(responses(payload, args.chunk_size, args.rows))
+        elapsed = time.time() - t
+        current, peak = tracemalloc.get_traced_memory()
+        print("%-9s payload %4d MB  result %5d MB  peak %5d MB  overhead %5d MB  %.2fs" % (args.mode,
+            len(payload) >> 20, (current - base) >> 20, (peak - base) >> 20, (peak - current) >> 20, elapsed))
+    assert len(obj[0]) == args.rows
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,92 @@
+''' throughput and allocations of reading an upload file into request messages
+
+Compares the ways a write() can read the file it streams to the Write RPC,
+building and serializing one WriteLevel1Req per chunk as the stub does:
+
+    read      common.upload.file_chunks, buffered f.read into a new bytes per chunk
+    mmap      slices of an mmap of the file
+    readinto  f.readinto one reused bytearray, then bytes() of it
+
+Run each mode on the same file, once before to warm the page cache:
+
+    python benchmarks/upload_chunk_read.py read /data/big.fits
+
+--allocs traces the first chunks with tracemalloc instead and reports how
+many chunk-sized blocks are alive while a message is built and serialized;
+the copies protobuf makes in its own arena are not traced.
+'''
+import os
+import sys
+import mmap
+import time
+import argparse
+import tracemalloc
+
+from csst_dfs_proto.facility.level1 import level1_pb2
+
+from csst_dfs_api_cluster.common.upload import file_chunks, upload_requests
+
+def read_chunks(path, chunk_size):
+    return file_chunks(path, chunk_size)
+
+def mmap_chunks(path, chunk_size):
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ) as mm:
+            for offset in range(0, size, chunk_size):
+                yield mm[offset:offset + chunk_size]
+
+def readinto_chunks(path, chunk_size):
+    buf = bytearray(chunk_size)
+    with open(path, 'rb', buffering = 0) as f:
+        while True:
+            n = f.readinto(buf)
+            if not n:
+                break
+            # protobuf bytes fields take bytes only, not a memoryview of buf
+            yield bytes(memoryview(buf)[:n])
+
+MODES = {"read": read_chunks, "mmap": mmap_chunks, "readinto": readinto_chunks}
+
+def requests(mode, path, chunk_size):
+    rec = level1_pb2.Level1Record(filename = os.path.basename(path), file_path = path)
+    return upload_requests(level1_pb2.WriteLevel1Req, rec, MODES[mode](path, chunk_size), False)
+
+def throughput(mode, path, chunk_size):
+    n = 0
+    t = time.time()
+    for req in requests(mode, path, chunk_size):
+        n += len(req.SerializeToString())
+    elapsed = time.time() - t
+    print("%-8s %6d MB  %6.0f MB/s" % (mode, n >> 20, n / elapsed / 1e6))
+
+def allocations(mode, path, chunk_size, chunks = 8):
+    tracemalloc.start()
+    counts = []
+    for i, req in enumerate(requests(mode, path, chunk_size)):
+        if i >= chunks:
+            break
+        data = req.SerializeToString()
+        snapshot = tracemalloc.take_snapshot()
+        counts.append(sum(1 for trace in snapshot.traces if trace.size >= chunk_size // 2))
+        del data, req
+    tracemalloc.stop()
+    print("%-8s chunk-sized blocks alive per message: %s" % (mode, max(counts) if counts else 0))
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__.splitlines()[0])
+    parser.add_argument("mode", choices = sorted(MODES))
+    parser.add_argument("path", help = "the file to read, a few GB to measure the throughput")
+    parser.add_argument("--chunk-size", type = int, default = 4 * 1024 * 1024, help = "bytes per chunk, default 4 MB")
+    parser.add_argument("--allocs", action = "store_true", help = "count the allocations instead of the throughput")
+    args = parser.parse_args()
+
+    if args.allocs:
+        allocations(args.mode, args.path, args.chunk_size)
+    else:
+        throughput(args.mode, args.path, args.chunk_size)
+
+if __name__ == "__main__":
+    sys.exit(main())
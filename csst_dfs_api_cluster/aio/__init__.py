@@ -0,0 +1,2 @@
+from .facility import AsyncLevel0DataApi, AsyncLevel0PrcApi, AsyncLevel1DataApi, AsyncLevel1PrcApi, AsyncLevel2DataApi, AsyncObservationApi, AsyncOtherDataApi
+from .catalog import AsyncCatalogApi
\ No newline at end of file
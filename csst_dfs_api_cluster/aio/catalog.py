@@ -0,0 +1,29 @@
+import asyncio
+import logging
+import functools
+
+from csst_dfs_proto.common.ephem import ephem_pb2_grpc
+from ..common.service import ServiceProxy
+from ..common.catalog import CatalogApi
+from ..common.stream import AioStreamStub
+
+log = logging.getLogger('csst')
+class AsyncCatalogApi(object):
+    """
+    Catalog Operation Class on grpc.aio, mirrors common.CatalogApi
+
+    :param cache: same as common.CatalogApi
+    """
+    def __init__(self, cache = None):
+        self.stub = ephem_pb2_grpc.EphemSearchSrvStub(ServiceProxy().aio_channel())
+        self._catalog = CatalogApi(cache = cache, stub = AioStreamStub(self.stub))
+
+    async def gaia3_query(self, ra: float, dec: float, radius: float, columns: tuple, min_mag: float,  max_mag: float,  obstime: int, limit: int, **kwargs):
+        ''' retrieval GAIA DR 3
+            args: same as common.CatalogApi.gaia3_query, as_table, format and the
+                other optional ones as keywords; the stream is decoded on the
+                default executor instead of the event loop
+            return: csst_dfs_common.models.Result
+        '''
+        return await asyncio.get_running_loop().run_in_executor(None, functools.partial(self._catalog.gaia3_query,
+            ra, dec, radius, columns, min_mag, max_mag, obstime, limit, **kwargs))
@@ -0,0 +1,523 @@
+import grpc
+import asyncio
+import functools
+
+from csst_dfs_commons.models import Result
+from csst_dfs_commons.models.facility import Level0Record, Level0PrcRecord, Level1Record, Level1PrcRecord, Observation, OtherDataRecord
+from csst_dfs_commons.models.level2 import Level2Record
+from csst_dfs_proto.facility.level0 import level0_pb2, level0_pb2_grpc
+from csst_dfs_proto.facility.level0prc import level0prc_pb2, level0prc_pb2_grpc
+from csst_dfs_proto.facility.level1 import level1_pb2, level1_pb2_grpc
+from csst_dfs_proto.facility.level1prc import level1prc_pb2, level1prc_pb2_grpc
+from csst_dfs_proto.facility.level2 import level2_pb2, level2_pb2_grpc
+from csst_dfs_proto.facility.observation import observation_pb2, observation_pb2_grpc
+from csst_dfs_proto.facility.otherdata import otherdata_pb2, otherdata_pb2_grpc
+
+from ..common.service import ServiceProxy
+from ..common.utils import *
+from ..common.upload import aio_write_upload
+from ..common.stream import AioStreamStub
+from ..facility import level0, level0prc, level1, level1prc, level2, observation, otherdata
+
+@with_update_many
+class AsyncLevel0DataApi(object):
+    """
+    Level0 Data Operation Class on grpc.aio, mirrors facility.Level0DataApi
+    """
+    def __init__(self):
+        self.stub = level0_pb2_grpc.Level0SrvStub(ServiceProxy().aio_channel())
+
+    async def find(self, **kwargs):
+        ''' retrieve level0 records from database
+
+        parameter kwargs: same as facility.Level0DataApi.find
+
+        return: csst_dfs_common.models.Result
+        '''
+        try:
+            resp = await self.stub.Find(level0.find_req(kwargs),metadata = get_auth_headers())
+            return records_result(Level0Record, resp)
+        except grpc.RpcError as e:
+            return Result.error(message="%s:%s" % (e.code().value, e.details()))
+
+    async def find_by_brick_ids(self, **kwargs):
+        ''' retrieve level0 records by brick_ids like [1,2,3,4]
+
+        parameter kwargs:
+            brick_ids: [list]
+
+        return: csst_dfs_common.models.Result
+        '''
+        try:
+            resp = await self.stub.FindByBrickIds(level0.find_by_brick_ids_req(kwargs),metadata = get_auth_headers())
+            return records_result(Level0Record, resp, total = False)
+        except grpc.RpcError as e:
+            return Result.error(message="%s:%s" % (e.code().value, e.details()))
+
+    async def get(self, **kwargs):
+        '''  fetch a record from database
+
+        parameter kwargs:
+            id : [int],
+            level0_id: [str],
+            obs_type: [str]
+
+        return csst_dfs_common.models.Result
+        '''
+        try:
+            resp = await self.stub.Get(level0.get_req(kwargs),metadata = get_auth_headers())
+            return record_result(Level0Record, resp.record, "not found")
+        except grpc.RpcError as e:
+            return Result.error(message="%s:%s" % (e.code().value, e.details()))
+
+    async def update_proc_status(self, **kwargs):
+        ''' update the status of reduction
+
+        parameter kwargs:
+            id : [int],
+            level0_id: [str],
+            obs_type: [str],
+            status : [int]
+
+        return csst_dfs_common.models.Result
+        '''
+        try:
+            resp = await self.stub.UpdateProcStatus(level0.update_req(level0_pb2.UpdateProcStatusReq, kwargs), metadata = get_auth_headers())
+            return status_result(resp)
+        except grpc.RpcError as e:
+            return Result.error(message="%s:%s" % (e.code().value, e.details()))
+
+    async def update_qc0_status(self, **kwargs):
+        ''' update the status of QC0
+
+        parameter kwargs:
+            id : [int],
+            level0_id: [str],
+            obs_type: [str],
+            status : [int]
+        '''
+        try:
+            resp = await self.stub.UpdateQc0Status(level0.update_req(level0_pb2.UpdateQc0StatusReq, kwargs), metadata = get_auth_headers())
+            return status_result(resp)
+        except grpc.RpcError as e:
+            return Result.error(message="%s:%s" % (e.code().value, e.details()))
+
+    async def write(self, **kwargs):
+        ''' insert a level0 data record into database
+
+        parameter kwargs: same as facility.Level0DataApi.write
+
+        return: csst_dfs_common.models.Result
+        '''
+        try:
+            resp = await self.stub.Write(level0.write_req(kwargs), metadata = get_auth_headers())
+            return written_result(Level0Record, resp)
+        except grpc.RpcError as e:
+            return Result.error(message="%s:%s" % (e.code().value, e.details()))
+
+@with_update_many
+class AsyncLevel0PrcApi(object):
+    """
+    Level0 Procedure Operation Class on grpc.aio, mirrors facility.Level0PrcApi
+    """
+    def __init__(self):
+        self.stub = level0prc_pb2_grpc.Level0PrcSrvStub(ServiceProxy().aio_channel())
+
+    async def find(self, **kwargs):
+        ''' retrieve level0 procedure records from database
+
+        parameter kwargs:
+            level0_id: [str]
+            pipeline_id: [str]
+            prc_module: [str]
+            prc_status : [int]
+
+        return: csst_dfs_common.models.Result
+        '''
+        try:
+            resp = await self.stub.Find(level0prc.find_req(kwargs),metadata = get_auth_headers())
+            return records_result(Level0PrcRecord, resp)
+        except grpc.RpcError as e:
+            return Result.error(message="%s:%s" % (e.code().value, e.details()))
+
+    async def update_proc_status(self, **kwargs):
+        ''' update the status of reduction
+
+        parameter kwargs:
+            id : [int],
+            status : [int]
+
+        return csst_dfs_common.models.Result
+        '''
+        try:
+            resp = await self.stub.UpdateProcStatus(status_req(level0prc_pb2.UpdateProcStatusReq, kwargs), metadata = get_auth_headers())
+            return status_result(resp)
+        except grpc.RpcError as e:
+            return Result.error(message="%s:%s" % (e.code().value, e.details()))
+
+    async def write(self, **kwargs):
+        ''' insert a level0 procedure record into database
+
+        parameter kwargs: same as facility.Level0PrcApi.write
+
+        return csst_dfs_common.models.Result
+        '''
+        try:
+            resp = await self.stub.Write(level0prc.write_req(kwargs), metadata = get_auth_headers())
+            return written_result(Level0PrcRecord, resp)
+        except grpc.RpcError as e:
+            return Result.error(message="%s:%s" % (e.code().value, e.details()))
+
+@with_update_many
+class AsyncLevel1DataApi(object):
+    """
+    Level1 Data Operation Class on grpc.aio, mirrors facility.Level1DataApi
+    """
+    def __init__(self):
+        self.stub = level1_pb2_grpc.Level1SrvStub(ServiceProxy().aio_channel())
+
+    async def find(self, **kwargs):
+        ''' retrieve level1 records from database
+
+        parameter kwargs: same as facility.Level1DataApi.find
+
+        return: csst_dfs_common.models.Result
+        '''
+        try:
+            resp = await self.stub.Find(level1.find_req(kwargs),metadata = get_auth_headers())
+            return records_result(Level1Record, resp)
+        except grpc.RpcError as e:
+            return Result.error(message="%s:%s" % (e.code().value, e.details()))
+
+    async def find_by_brick_ids(self, **kwargs):
+        ''' retrieve level1 records by brick_ids like [1,2,3,4]
+
+        parameter kwargs:
+            brick_ids: [list]
+
+        return: csst_dfs_common.models.Result
+        '''
+        try:
+            resp = await self.stub.FindByBrickIds(level1.find_by_brick_ids_req(kwargs),metadata = get_auth_headers())
+            return records_result(Level1Record, resp, total = False)
+        except grpc.RpcError as e:
+            return Result.error(message="%s:%s" % (e.code().value, e.details()))
+
+    async def find_by_ids(self, **kwargs):
+        ''' retrieve level1 records by internal level1 ids like [1,2,3,4]
+
+        parameter kwargs:
+            ids: [list]
+
+        return: csst_dfs_common.models.Result
+        '''
+        try:
+            resp = await self.stub.FindByIds(level1.find_by_ids_req(kwargs),metadata = get_auth_headers())
+            return records_result(Level1Record, resp, total = False)
+        except grpc.RpcError as e:
+            return Result.error(message="%s:%s" % (e.code().value, e.details()))
+
+    async def get(self, **kwargs):
+        '''  fetch a record from database
+
+        parameter kwargs:
+            id : [int]
+
+        return csst_dfs_common.models.Result
+        '''
+        try:
+            resp = await self.stub.Get(level1.get_req(kwargs),metadata = get_auth_headers())
+            return record_result(Level1Record, resp.record)
+        except grpc.RpcError as e:
+            return Result.error(message="%s:%s" % (e.code().value, e.details()))
+
+    async def update_proc_status(self, **kwargs):
+        ''' update the status of reduction
+
+        parameter kwargs:
+            id : [int],
+            status : [int]
+
+        return csst_dfs_common.models.Result
+        '''
+        try:
+            resp = await self.stub.UpdateProcStatus(status_req(level1_pb2.UpdateProcStatusReq, kwargs), metadata = get_auth_headers())
+            return status_result(resp)
+        except grpc.RpcError as e:
+            return Result.error(message="%s:%s" % (e.code().value, e.details()))
+
+    async def update_qc1_status(self, **kwargs):
+        ''' update the status of QC1
+
+        parameter kwargs:
+            id : [int],
+            status : [int]
+        '''
+        try:
+            resp = await self.stub.UpdateQc1Status(status_req(level1_pb2.UpdateQc1StatusReq, kwargs), metadata = get_auth_headers())
+            return status_result(resp)
+        except grpc.RpcError as e:
+            return Result.error(message="%s:%s" % (e.code().value, e.details()))
+
+    async def write(self, **kwargs):
+        ''' insert a level1 record into database
+
+        parameter kwargs: same as facility.Level1DataApi.write
+
+        return csst_dfs_common.models.Result
+        '''
+        rec = level1.write_record(kwargs)
+        return await aio_write_upload(self.stub.Write, kwargs, rec, level1_pb2.WriteLevel1Req, Level1Record,
+            get = lambda id: self.get(id = id), kind = "level1", dedup_key = (rec.level0_id, rec.data_type))
+
+@with_update_many
+class AsyncLevel1PrcApi(object):
+    """
+    Level1 Procedure Operation Class on grpc.aio, mirrors facility.Level1PrcApi
+    """
+    def __init__(self):
+        self.stub = level1prc_pb2_grpc.Level1PrcSrvStub(ServiceProxy().aio_channel())
+
+    async def find(self, **kwargs):
+        ''' retrieve level1 procedure records from database
+
+        parameter kwargs:
+            level1_id: [str]
+            pipeline_id: [str]
+            prc_module: [str]
+            prc_status : [int]
+
+        return: csst_dfs_common.models.Result
+        '''
+        try:
+            resp = await self.stub.Find(level1prc.find_req(kwargs),metadata = get_auth_headers())
+            return records_result(Level1PrcRecord, resp)
+        except grpc.RpcError as e:
+            return Result.error(message="%s:%s" % (e.code().value, e.details()))
+
+    async def update_proc_status(self, **kwargs):
+        ''' update the status of reduction
+
+        parameter kwargs:
+            id : [int],
+            status : [int]
+
+        return csst_dfs_common.models.Result
+        '''
+        try:
+            resp = await self.stub.UpdateProcStatus(status_req(level1prc_pb2.UpdateProcStatusReq, kwargs), metadata = get_auth_headers())
+            return status_result(resp)
+        except grpc.RpcError as e:
+            return Result.error(message="%s:%s" % (e.code().value, e.details()))
+
+    async def write(self, **kwargs):
+        ''' insert a level1 procedure record into database
+
+        parameter kwargs: same as facility.Level1PrcApi.write
+
+        return csst_dfs_common.models.Result
+        '''
+        try:
+            resp = await self.stub.Write(level1prc.write_req(kwargs), metadata = get_auth_headers())
+            return written_result(Level1PrcRecord, resp)
+        except grpc.RpcError as e:
+            return Result.error(message="%s:%s" % (e.code().value, e.details()))
+
+@with_update_many
+class AsyncLevel2DataApi(object):
+    """
+    Level2 Data Operation Class on grpc.aio, mirrors facility.Level2DataApi
+    """
+    def __init__(self):
+        self.stub = level2_pb2_grpc.Level2SrvStub(ServiceProxy().aio_channel())
+        self._catalog = level2.Level2DataApi(stub = AioStreamStub(self.stub))
+
+    async def find(self, **kwargs):
+        ''' retrieve level2 records from database
+
+        parameter kwargs: same as facility.Level2DataApi.find
+
+        return: csst_dfs_common.models.Result
+        '''
+        try:
+            resp = await self.stub.Find(level2.find_req(kwargs),metadata = get_auth_headers())
+            return records_result(Level2Record, resp)
+        except grpc.RpcError as e:
+            return Result.error(message="%s:%s" % (e.code().value, e.details()))
+
+    async def catalog_query(self, **kwargs):
+        ''' retrieve level2catalog records from database
+
+        parameter kwargs: same as facility.Level2DataApi.catalog_query, the stream is
+            decoded on the default executor instead of the event loop
+
+        return: csst_dfs_common.models.Result
+        '''
+        return await asyncio.get_running_loop().run_in_executor(None, functools.partial(self._catalog.catalog_query, **kwargs))
+
+    async def get(self, **kwargs):
+        '''  fetch a record from database
+
+        parameter kwargs:
+            id : [int]
+
+        return csst_dfs_common.models.Result
+        '''
+        try:
+            resp = await self.stub.Get(level2.get_req(kwargs),metadata = get_auth_headers())
+            return record_result(Level2Record, resp.record)
+        except grpc.RpcError as e:
+            return Result.error(message="%s:%s" % (e.code().value, e.details()))
+
+    async def update_proc_status(self, **kwargs):
+        ''' update the status of reduction
+
+        parameter kwargs:
+            id : [int],
+            status : [int]
+
+        return csst_dfs_common.models.Result
+        '''
+        try:
+            resp = await self.stub.UpdateProcStatus(status_req(level2_pb2.UpdateProcStatusReq, kwargs), metadata = get_auth_headers())
+            return status_result(resp)
+        except grpc.RpcError as e:
+            return Result.error(message="%s:%s" % (e.code().value, e.details()))
+
+    async def update_qc2_status(self, **kwargs):
+        ''' update the status of QC2
+
+        parameter kwargs:
+            id : [int],
+            status : [int]
+        '''
+        try:
+            resp = await self.stub.UpdateQc2Status(status_req(level2_pb2.UpdateQc2StatusReq, kwargs), metadata = get_auth_headers())
+            return status_result(resp)
+        except grpc.RpcError as e:
+            return Result.error(message="%s:%s" % (e.code().value, e.details()))
+
+    async def write(self, **kwargs):
+        ''' insert a level2 record into database
+
+        parameter kwargs: same as facility.Level2DataApi.write
+
+        return csst_dfs_common.models.Result
+        '''
+        rec = level2.write_record(kwargs)
+        if not rec.module_id:
+            return Result.error(message="module_id is blank")
+        if not rec.data_type:
+            return Result.error(message="data_type is blank")
+        return await aio_write_upload(self.stub.Write, kwargs, rec, level2_pb2.WriteLevel2Req, Level2Record,
+            get = lambda id: self.get(id = id), kind = "level2", dedup_key = (rec.level1_id, rec.brick_id, rec.data_type))
+
+@with_update_many
+class AsyncObservationApi(object):
+    """
+    Observation Operation Class on grpc.aio, mirrors facility.ObservationApi
+    """
+    def __init__(self):
+        self.stub = observation_pb2_grpc.ObservationSrvStub(ServiceProxy().aio_channel())
+
+    async def find(self, **kwargs):
+        ''' retrieve exposure records from database
+
+        parameter kwargs: same as facility.ObservationApi.find
+
+        return: csst_dfs_common.models.Result
+        '''
+        try:
+            resp = await self.stub.Find(observation.find_req(kwargs),metadata = get_auth_headers())
+            return records_result(Observation, resp)
+        except grpc.RpcError as e:
+            return Result.error(message="%s:%s" % (e.code().value, e.details()))
+
+    async def get(self, **kwargs):
+        '''  fetch a record from database
+
+        parameter kwargs:
+            id : [int],
+            obs_id = [str]
+
+        return csst_dfs_common.models.Result
+        '''
+        try:
+            resp = await self.stub.Get(observation.get_req(kwargs),metadata = get_auth_headers())
+            return record_result(Observation, resp.observation, "not found")
+        except grpc.RpcError as e:
+            return Result.error(message="%s:%s" % (e.code().value, e.details()))
+
+    async def update_proc_status(self, **kwargs):
+        ''' update the status of reduction
+
+        parameter kwargs:
+            id : [int],
+            obs_id = [str],
+            status : [int]
+
+        return csst_dfs_common.models.Result
+        '''
+        try:
+            resp = await self.stub.UpdateProcStatus(observation.update_req(observation_pb2.UpdateProcStatusReq, kwargs), metadata = get_auth_headers())
+            return status_result(resp)
+        except grpc.RpcError as e:
+            return Result.error(message="%s:%s" % (e.code().value, e.details()))
+
+    async def update_qc0_status(self, **kwargs):
+        ''' update the status of QC0
+
+        parameter kwargs:
+            id : [int],
+            obs_id = [str],
+            status : [int]
+        '''
+        try:
+            resp = await self.stub.UpdateQc0Status(observation.update_req(observation_pb2.UpdateQc0StatusReq, kwargs), metadata = get_auth_headers())
+            return status_result(resp)
+        except grpc.RpcError as e:
+            return Result.error(message="%s:%s" % (e.code().value, e.details()))
+
+class AsyncOtherDataApi(object):
+    """
+    OtherData Data Operation Class on grpc.aio, mirrors facility.OtherDataApi
+    """
+    def __init__(self):
+        self.stub = otherdata_pb2_grpc.OtherDataSrvStub(ServiceProxy().aio_channel())
+
+    async def find(self, **kwargs):
+        ''' retrieve otherdata records from database
+
+        parameter kwargs: same as facility.OtherDataApi.find
+
+        return: csst_dfs_common.models.Result
+        '''
+        try:
+            resp = await self.stub.Find(otherdata.find_req(kwargs),metadata = get_auth_headers())
+            return records_result(OtherDataRecord, resp)
+        except grpc.RpcError as e:
+            return Result.error(message="%s:%s" % (e.code().value, e.details()))
+
+    async def get(self, **kwargs):
+        '''  fetch a record from database
+
+        parameter kwargs:
+            id : [int]
+
+        return csst_dfs_common.models.Result
+        '''
+        try:
+            resp = await self.stub.Get(otherdata.get_req(kwargs),metadata = get_auth_headers())
+            return record_result(OtherDataRecord, resp.record)
+        except grpc.RpcError as e:
+            return Result.error(message="%s:%s" % (e.code().value, e.details()))
+
+    async def write(self, **kwargs):
+        ''' insert a otherdata record into database
+
+        parameter kwargs: same as facility.OtherDataApi.write
+
+        return csst_dfs_common.models.Result
+        '''
+        rec = otherdata.write_record(kwargs)
+        return await aio_write_upload(self.stub.Write, kwargs, rec, otherdata_pb2.WriteOtherDataReq, OtherDataRecord)
@@ -0,0 +1,98 @@
+import grpc
+import asyncio
+import functools
+
+from csst_dfs_commons.models import Result
+from csst_dfs_commons.models.msc import Level2Record
+from csst_dfs_proto.msc.level2 import level2_pb2, level2_pb2_grpc
+
+from ..common.service import ServiceProxy
+from ..common.utils import *
+from ..common.upload import aio_write_upload
+from ..common.stream import AioStreamStub
+from ..mbi import level2
+
+@with_update_many
+class AsyncLevel2DataApi(object):
+    """
+    Level2 Data Operation Class on grpc.aio, mirrors mbi.Level2DataApi
+    """
+    def __init__(self):
+        self.stub = level2_pb2_grpc.Level2SrvStub(ServiceProxy().aio_channel())
+        self._catalog = level2.Level2DataApi(stub = AioStreamStub(self.stub))
+
+    async def find(self, **kwargs):
+        ''' retrieve level2 records from database
+
+        parameter kwargs: same as mbi.Level2DataApi.find
+
+        return: csst_dfs_common.models.Result
+        '''
+        try:
+            resp = await self.stub.Find(level2.find_req(kwargs),metadata = get_auth_headers())
+            return records_result(Level2Record, resp)
+        except grpc.RpcError as e:
+            return Result.error(message="%s:%s" % (e.code().value, e.details()))
+
+    async def catalog_query(self, **kwargs):
+        ''' retrieve level2catalog records from database
+
+        parameter kwargs: same as mbi.Level2DataApi.catalog_query, the stream is
+            decoded on the default executor instead of the event loop
+
+        return: csst_dfs_common.models.Result
+        '''
+        return await asyncio.get_running_loop().run_in_executor(None, functools.partial(self._catalog.catalog_query, **kwargs))
+
+    async def get(self, **kwargs):
+        '''  fetch a record from database
+
+        parameter kwargs:
+            id : [int]
+
+        return csst_dfs_common.models.Result
+        '''
+        try:
+            resp = await self.stub.Get(level2.get_req(kwargs),metadata = get_auth_headers())
+            return record_result(Level2Record, resp.record)
+        except grpc.RpcError as e:
+            return Result.error(message="%s:%s" % (e.code().value, e.details()))
+
+    async def update_proc_status(self, **kwargs):
+        ''' update the status of reduction
+
+        parameter kwargs:
+            id : [int],
+            status : [int]
+
+        return csst_dfs_common.models.Result
+        '''
+        try:
+            resp = await self.stub.UpdateProcStatus(status_req(level2_pb2.UpdateProcStatusReq, kwargs), metadata = get_auth_headers())
+            return status_result(resp)
+        except grpc.RpcError as e:
+            return Result.error(message="%s:%s" % (e.code().value, e.details()))
+
+    async def update_qc2_status(self, **kwargs):
+        ''' update the status of QC2
+
+        parameter kwargs:
+            id : [int],
+            status : [int]
+        '''
+        try:
+            resp = await self.stub.UpdateQc2Status(status_req(level2_pb2.UpdateQc2StatusReq, kwargs), metadata = get_auth_headers())
+            return status_result(resp)
+        except grpc.RpcError as e:
+            return Result.error(message="%s:%s" % (e.code().value, e.details()))
+
+    async def write(self, **kwargs):
+        ''' insert a level2 record into database
+
+        parameter kwargs: same as mbi.Level2DataApi.write
+
+        return csst_dfs_common.models.Result
+        '''
+        rec = level2.write_record(kwargs)
+        return await aio_write_upload(self.stub.Write, kwargs, rec, level2_pb2.WriteLevel2Req, Level2Record,
+            get = lambda id: self.get(id = id), kind = "mbi.level2", dedup_key = (rec.level1_id, rec.data_type))
@@ -0,0 +1,83 @@
+import grpc
+
+from csst_dfs_commons.models import Result
+from csst_dfs_commons.models.sls import Level2Spectra
+from csst_dfs_proto.sls.level2spectra import level2spectra_pb2, level2spectra_pb2_grpc
+
+from ..common.service import ServiceProxy
+from ..common.utils import *
+from ..common.upload import aio_write_upload
+from ..sls import level2spectra
+
+@with_update_many
+class AsyncLevel2SpectraApi(object):
+    """
+    Level2spectra Data Operation Class on grpc.aio, mirrors sls.Level2SpectraApi
+    """
+    def __init__(self):
+        self.stub = level2spectra_pb2_grpc.Level2spectraSrvStub(ServiceProxy().aio_channel())
+
+    async def find(self, **kwargs):
+        ''' retrieve level2spectra records from database
+
+        :param kwargs: same as sls.Level2SpectraApi.find
+
+        :returns: csst_dfs_common.models.Result
+        '''
+        try:
+            resp = await self.stub.Find(level2spectra.find_req(kwargs),metadata = get_auth_headers())
+            return records_result(Level2Spectra, resp)
+        except grpc.RpcError as e:
+            return Result.error(message="%s:%s" % (e.code().value, e.details()))
+
+    async def get(self, **kwargs):
+        '''  fetch a record from database
+
+        parameter kwargs:
+            id : [int]
+
+        return csst_dfs_common.models.Result
+        '''
+        try:
+            resp = await self.stub.Get(level2spectra.get_req(kwargs),metadata = get_auth_headers())
+            return record_result(Level2Spectra, resp.record, "id:%s not found" % (get_parameter(kwargs, "id"), ))
+        except grpc.RpcError as e:
+            return Result.error(message="%s:%s" % (e.code().value, e.details()))
+
+    async def update_proc_status(self, **kwargs):
+        ''' update the status of reduction
+
+        parameter kwargs:
+            id : [int],
+            status : [int]
+
+        return csst_dfs_common.models.Result
+        '''
+        try:
+            resp = await self.stub.UpdateProcStatus(status_req(level2spectra_pb2.UpdateProcStatusReq, kwargs), metadata = get_auth_headers())
+            return status_result(resp)
+        except grpc.RpcError as e:
+            return Result.error(message="%s:%s" % (e.code().value, e.details()))
+
+    async def update_qc2_status(self, **kwargs):
+        ''' update the status of QC2
+
+        parameter kwargs:
+            id : [int],
+            status : [int]
+        '''
+        try:
+            resp = await self.stub.UpdateQc2Status(status_req(level2spectra_pb2.UpdateQc2StatusReq, kwargs), metadata = get_auth_headers())
+            return status_result(resp)
+        except grpc.RpcError as e:
+            return Result.error(message="%s:%s" % (e.code().value, e.details()))
+
+    async def write(self, **kwargs):
+        ''' insert a level2spectra record into database
+
+        parameter kwargs: same as sls.Level2SpectraApi.write
+
+        return csst_dfs_common.models.Result
+        '''
+        rec = level2spectra.write_record(kwargs)
+        return await aio_write_upload(self.stub.Write, kwargs, rec, level2spectra_pb2.WriteLevel2spectraReq, Level2Spectra)
@@ -1 +1,3 @@
-from .catalog import CatalogApi
\ No newline at end of file
+from .catalog import CatalogApi
+from .upload import UploadManager
+from .writebehind import StatusBuffer
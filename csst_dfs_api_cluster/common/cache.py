@@ -0,0 +1,109 @@
+import os
+import time
+import json
+import pickle
+import sqlite3
+import hashlib
+import logging
+import threading
+from contextlib import contextmanager
+
+log = logging.getLogger('csst')
+
+class CatalogCache(object):
+    ''' persistent LRU cache of catalog query results on local disk
+
+    Each entry is a pickle file in cache_dir, an SQLite index keeps the size and
+    last access time of every entry. When the total size grows beyond max_bytes
+    the least recently used entries are evicted. Several processes of a node
+    can share one cache_dir.
+
+    :param cache_dir: directory of the cache files
+    :param max_bytes: size limit of all entries, default 10 GB
+    '''
+    def __init__(self, cache_dir, max_bytes = 10 * 1024 ** 3):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok = True)
+        with self._index() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, size INTEGER, atime REAL)")
+
+    @contextmanager
+    def _index(self):
+        db = sqlite3.connect(os.path.join(self.cache_dir, "index.db"), timeout = 30)
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + ".pkl")
+
+    @staticmethod
+    def make_key(**params):
+        ''' a stable key of the normalized query parameters '''
+        return hashlib.sha1(json.dumps(params, sort_keys = True).encode()).hexdigest()
+
+    def get(self, key):
+        ''' the cached value of key, None on a miss '''
+        try:
+            with open(self._path(key), 'rb') as f:
+                value = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._index() as db:
+            db.execute("UPDATE entries SET atime = ? WHERE key = ?", (time.time(), key))
+        with self._lock:
+            self.hits += 1
+        return value
+
+    def put(self, key, value):
+        ''' store value under key and evict the least recently used entries beyond max_bytes '''
+        path = self._path(key)
+        tmp = "%s.%d.tmp" % (path, os.getpid())
+        with open(tmp, 'wb') as f:
+            pickle.dump(value, f, protocol = pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+        size = os.path.getsize(path)
+        with self._index() as db:
+            db.execute("INSERT OR REPLACE INTO entries (key, size, atime) VALUES (?, ?, ?)", (key, size, time.time()))
+            self._evict(db)
+
+    def _evict(self, db):
+        total = db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in db.execute("SELECT key, size FROM entries ORDER BY atime").fetchall():
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+            db.execute("DELETE FROM entries WHERE key = ?", (key, ))
+            total -= size
+            log.debug("catalog cache evicted %s", key)
+
+    def clear(self):
+        ''' remove all entries '''
+        with self._index() as db:
+            for (key, ) in db.execute("SELECT key FROM entries").fetchall():
+                try:
+                    os.remove(self._path(key))
+                except OSError:
+                    pass
+            db.execute("DELETE FROM entries")
+
+    def stats(self):
+        ''' hit/miss counters of this process and the current size of the cache '''
+        with self._index() as db:
+            entries, size = db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": entries, "bytes": size, "max_bytes": self.max_bytes}
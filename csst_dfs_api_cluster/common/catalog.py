@@ -1,7 +1,12 @@
+import os
 import grpc
 import pickle
+import sqlite3
 import logging
 import io
+import threading
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 
 from csst_dfs_commons.models import Result
 
@@ -9,13 +14,47 @@ from csst_dfs_proto.common.ephem import ephem_pb2, ephem_pb2_grpc
 from .service import ServiceProxy
 from .constants import *
 from .utils import get_auth_headers
+from .stream import CatalogStream, CatalogStreamError, read_catalog
+from .table import catalog_format, format_catalog, select_arrays, project_rows
+from .sky import angular_distance, cone_contains, cone_tiles, group_positions, enclosing_cone, propagate_positions
+from .cache import CatalogCache
+from .crossmatch import crossmatch
 
 log = logging.getLogger('csst')
+
+GAIA3_MAG_COLUMN = "phot_g_mean_mag"
+MAX_SUPERCONES = 8
+GAIA3_ID_COLUMN = "source_id"
+# reference epoch of Gaia DR3 astrometry, J2016.0 as obstime (Unix seconds)
+GAIA3_EPOCH_OBSTIME = 1451649600
+# upper bound of the proper motion in Gaia DR3, in mas/yr
+GAIA3_MAX_PM = 11000
+SECONDS_PER_YEAR = 365.25 * 86400
+# the epoch difference is rounded up to this for the fetch margin, so nearby obstimes share cache entries
+PM_MARGIN_YEARS = 10
+
 class CatalogApi(object):
-    def __init__(self):
-        self.stub = ephem_pb2_grpc.EphemSearchSrvStub(ServiceProxy().channel())
-    
-    def gaia3_query(self, ra: float, dec: float, radius: float, columns: tuple, min_mag: float,  max_mag: float,  obstime: int, limit: int):
+    """
+    Catalog Operation Class
+
+    :param cache: a CatalogCache for gaia3_query results, by default one is
+        opened in CSST_DFS_CATALOG_CACHE_DIR if that is set, none if it can't be
+    :param stub: the EphemSearchSrv stub to call, by default one on the shared channel
+    """
+    def __init__(self, cache = None, stub = None):
+        self.stub = stub or ephem_pb2_grpc.EphemSearchSrvStub(ServiceProxy().channel())
+        if cache is None and os.getenv("CSST_DFS_CATALOG_CACHE_DIR"):
+            try:
+                cache = CatalogCache(os.getenv("CSST_DFS_CATALOG_CACHE_DIR"),
+                    int(os.getenv("CSST_DFS_CATALOG_CACHE_MAX_BYTES", 10 * 1024 ** 3)))
+            except (OSError, sqlite3.Error) as e:
+                log.warning("can't open the catalog cache, gaia3_query results are not cached: %s", e)
+        self.cache = cache
+        self._supercones = []
+        self._supercones_lock = threading.Lock()
+
+    def gaia3_query(self, ra: float, dec: float, radius: float, columns: tuple, min_mag: float,  max_mag: float,  obstime: int, limit: int, as_table: bool = False, format: str = None, prefetch_radius: float = None,
+            tile_radius: float = None, max_workers: int = 8, propagate: bool = False):
         ''' retrieval GAIA DR 3
             args:
                 ra:  in deg
@@ -26,30 +65,286 @@ class CatalogApi(object):
                 max_mag: maximal magnitude
                 obstime: seconds  
                 limit: limits returns the number of records
-            return: csst_dfs_common.models.Result
+                as_table: return the data as an astropy Table
+                format: "table" for an astropy Table, "numpy" for a structured array
+                prefetch_radius: in deg, fetch a super-cone of this radius once and
+                    answer this and later queries inside it by local filtering
+                tile_radius: in deg, split a cone larger than this into tiles that are
+                    fetched concurrently and merged, duplicates removed by source_id
+                max_workers: number of concurrent tile queries, default 8
+                propagate: fetch at the Gaia DR3 epoch and move ra, dec to obstime by the
+                    proper motion on the client, so cached and prefetched rows serve every obstime
+            return: csst_dfs_common.models.Result, without totalCount if a tiled search
+                with a limit doesn't know the total of the cone
         ''' 
+        fmt = catalog_format({"as_table": as_table, "format": format})
+        columns = tuple(columns)
+        if propagate:
+            result = self._gaia3_propagated(ra, dec, radius, columns, min_mag, max_mag, obstime, limit, prefetch_radius, tile_radius, max_workers)
+        else:
+            result = self._gaia3_rows(ra, dec, radius, columns, min_mag, max_mag, obstime, limit, prefetch_radius, tile_radius, max_workers)
+        if not result.success:
+            return result
+        records, totalCount = result.data
+        result = Result.ok_data(data = format_catalog(records, columns, fmt))
+        if totalCount is not None:
+            result.append("totalCount", totalCount)
+        return result.append("columns", columns)
+
+    def _gaia3_rows(self, ra, dec, radius, columns, min_mag, max_mag, obstime, limit, prefetch_radius, tile_radius, max_workers):
+        ''' the rows and totalCount of a cone from a super-cone, the cache or the server
+        '''
+        served = self._from_supercone(ra, dec, radius, columns, min_mag, max_mag, obstime, limit)
+        if served is None and prefetch_radius is not None and prefetch_radius > radius:
+            result = self._prefetch(ra, dec, prefetch_radius, columns, min_mag, max_mag, obstime, tile_radius, max_workers)
+            if not result.success:
+                return result
+            served = self._from_supercone(ra, dec, radius, columns, min_mag, max_mag, obstime, limit)
+        if served is None:
+            result = self._gaia3_fetch(ra, dec, radius, columns, min_mag, max_mag, obstime, limit, tile_radius, max_workers)
+            if not result.success:
+                return result
+            served = result.data
+        return Result.ok_data(data = served)
+
+    def _gaia3_propagated(self, ra, dec, radius, columns, min_mag, max_mag, obstime, limit, prefetch_radius, tile_radius, max_workers):
+        ''' a cone at obstime from rows fetched at the Gaia DR3 epoch
+
+        The cone is widened by the largest possible motion between the epochs and
+        cut again after the positions are propagated.
+        '''
+        margin = _pm_margin(obstime)
+        fetch_columns = _with_columns(columns, ("ra", "dec", "pmra", "pmdec"))
+        result = self._gaia3_rows(ra, dec, radius + margin, fetch_columns, min_mag, max_mag, GAIA3_EPOCH_OBSTIME, 0,
+            prefetch_radius + margin if prefetch_radius is not None else None, tile_radius, max_workers)
+        if not result.success:
+            return result
+        rows, src_ra, src_dec = _propagate_rows(result.data[0], fetch_columns, obstime)
+        idx = np.flatnonzero(angular_distance(ra, dec, src_ra, src_dec) <= radius)
+        totalCount = len(idx)
+        if limit:
+            idx = idx[:limit]
+        return Result.ok_data(data = (project_rows([rows[i] for i in idx], fetch_columns, columns), totalCount))
+
+    def _gaia3_records(self, ra, dec, radius, columns, min_mag, max_mag, obstime, limit):
+        ''' the rows and totalCount of a remote cone search, through the cache if there is one
+        '''
+        key = None
+        if self.cache is not None:
+            key = CatalogCache.make_key(catalog = "gaia3", ra = round(float(ra) % 360, 8), dec = round(float(dec), 8),
+                radius = round(float(radius), 8), columns = list(columns), min_mag = float(min_mag),
+                max_mag = float(max_mag), obstime = int(obstime), limit = int(limit))
+            try:
+                cached = self.cache.get(key)
+            except (OSError, sqlite3.Error) as e:
+                log.warning("catalog cache lookup failed: %s", e)
+                cached = None
+            if cached is not None:
+                return Result.ok_data(data = cached)
         try:
-            datas = io.BytesIO()
-            totalCount = 0
-            resps = self.stub.Gaia3Search(ephem_pb2.EphemSearchRequest(
-                ra = ra,
-                dec = dec,
-                radius = radius,
-                columns = ",".join(columns),
-                minMag = min_mag,
-                maxMag = max_mag,
-                obstime = obstime,
-                limit = limit
-            ),metadata = get_auth_headers())
-            for resp in resps:
-                if resp.success:
-                    datas.write(resp.records)
-                    totalCount = resp.totalCount
-                else:
-                    return Result.error(message = str(resp.error.detail))
-            datas.flush()
-            records = pickle.loads(datas.getvalue())
-
-            return Result.ok_data(data = records).append("totalCount", totalCount).append("columns", columns)
+            resps = self.stub.Gaia3Search(self._gaia3_req(ra, dec, radius, columns, min_mag, max_mag, obstime, limit),
+                metadata = get_auth_headers())
+            records, totalCount = read_catalog(resps)
+            if key is not None:
+                try:
+                    self.cache.put(key, (records, totalCount))
+                except (OSError, sqlite3.Error) as e:
+                    # a full or read-only cache directory must not fail the query
+                    log.warning("catalog cache update failed: %s", e)
+
+            return Result.ok_data(data = (records, totalCount))
+        except CatalogStreamError as e:
+            return Result.error(message = str(e))
         except grpc.RpcError as e:
             return Result.error(message="%s:%s" % (e.code().value, e.details()))
+
+    def _gaia3_fetch(self, ra, dec, radius, columns, min_mag, max_mag, obstime, limit, tile_radius, max_workers):
+        if tile_radius is not None and radius > tile_radius:
+            return self._gaia3_tiled(ra, dec, radius, columns, min_mag, max_mag, obstime, limit, tile_radius, max_workers)
+        return self._gaia3_records(ra, dec, radius, columns, min_mag, max_mag, obstime, limit)
+
+    def _gaia3_tiled(self, ra, dec, radius, columns, min_mag, max_mag, obstime, limit, tile_radius, max_workers):
+        ''' one cone search as concurrent tile searches over the shared channel
+
+        The tiles are fetched with source_id, ra and dec added to the columns,
+        the merged rows are deduplicated on source_id, cut to the original cone
+        and then to limit. With a limit every tile is fetched with it too; only
+        if that leaves fewer than limit rows in the cone are the tiles that hit
+        the limit fetched again completely. totalCount is the number of rows of
+        the cone if every tile was fetched completely; if a tile stopped at the
+        limit, its rows left out may or may not be in the cone, and totalCount
+        is None.
+        '''
+        tile_columns = _with_columns(columns, (GAIA3_ID_COLUMN, "ra", "dec"))
+        tiles = cone_tiles(ra, dec, radius, tile_radius)
+        log.debug("gaia3 cone of %s deg in %d tiles", radius, len(tiles))
+        def fetch(tiles, limit):
+            with ThreadPoolExecutor(max_workers = max(1, min(max_workers, len(tiles)))) as pool:
+                return list(pool.map(lambda t: self._gaia3_records(t[0], t[1], t[2], tile_columns, min_mag, max_mag, obstime, limit), tiles))
+        results = fetch(tiles, limit)
+        limits = [limit] * len(tiles)
+        for result in results:
+            if not result.success:
+                return result
+        records, idx = self._tiled_rows(ra, dec, radius, tile_columns, results)
+        if limit and len(idx) < limit:
+            full = [i for i, result in enumerate(results) if len(result.data[0]) >= limit]
+            if full:
+                for i, result in zip(full, fetch([tiles[i] for i in full], 0)):
+                    if not result.success:
+                        return result
+                    results[i], limits[i] = result, 0
+                records, idx = self._tiled_rows(ra, dec, radius, tile_columns, results)
+        complete = all(not l or len(result.data[0]) < l for l, result in zip(limits, results))
+        totalCount = len(idx) if complete else None
+        if limit:
+            idx = idx[:limit]
+        return Result.ok_data(data = (project_rows([records[i] for i in idx], tile_columns, columns), totalCount))
+
+    @staticmethod
+    def _tiled_rows(ra, dec, radius, tile_columns, results):
+        ''' the merged rows of tile results and the indices of the distinct ones in the cone '''
+        records = [row for result in results for row in result.data[0]]
+        ids, ra_arr, dec_arr = select_arrays(records, tile_columns, (GAIA3_ID_COLUMN, "ra", "dec"))
+        _, first = np.unique(ids, return_index = True)
+        first.sort()
+        return records, first[angular_distance(ra, dec, ra_arr[first], dec_arr[first]) <= radius]
+
+    def _prefetch(self, ra, dec, radius, columns, min_mag, max_mag, obstime, tile_radius, max_workers):
+        columns = _with_columns(columns, ("ra", "dec", GAIA3_MAG_COLUMN))
+        result = self._gaia3_fetch(ra, dec, radius, columns, min_mag, max_mag, obstime, 0, tile_radius, max_workers)
+        if result.success:
+            supercone = _SuperCone(ra, dec, radius, columns, min_mag, max_mag, obstime, result.data[0])
+            with self._supercones_lock:
+                self._supercones.insert(0, supercone)
+                del self._supercones[MAX_SUPERCONES:]
+        return result
+
+    def _from_supercone(self, ra, dec, radius, columns, min_mag, max_mag, obstime, limit):
+        with self._supercones_lock:
+            supercone = next((sc for sc in self._supercones if sc.covers(ra, dec, radius, columns, min_mag, max_mag, obstime)), None)
+        if supercone is None:
+            return None
+        return supercone.select(ra, dec, radius, columns, min_mag, max_mag, limit)
+
+    def gaia3_query_many(self, positions, radius: float, columns: tuple, min_mag: float,  max_mag: float,  obstime: int, group_size: float = 0.5, max_workers: int = 8, as_table: bool = False, format: str = None, propagate: bool = False):
+        ''' retrieval GAIA DR 3 around many positions at once
+            args:
+                positions: sequence of (ra, dec) in deg
+                radius:  in deg, around every position
+                columns, min_mag, max_mag, obstime: same as gaia3_query
+                group_size: in deg, positions in a cell of this size share one merged cone
+                max_workers: number of concurrent group queries, default 8
+                as_table: return the data as an astropy Table
+                format: "table" for an astropy Table, "numpy" for a structured array
+                propagate: same as gaia3_query
+            return: csst_dfs_common.models.Result, data has one row per (position, source) pair,
+                the first column input_index is the index of the position in positions
+        '''
+        fmt = catalog_format({"as_table": as_table, "format": format})
+        columns = tuple(columns)
+        out_columns = ("input_index", ) + columns
+        positions = np.asarray(positions, dtype = float).reshape(-1, 2)
+        if len(positions) == 0:
+            return Result.ok_data(data = format_catalog([], out_columns, fmt)).append("totalCount", 0).append("columns", out_columns)
+        fetch_columns = _with_columns(columns, ("ra", "dec", "pmra", "pmdec") if propagate else ("ra", "dec"))
+        fetch_obstime, margin = (GAIA3_EPOCH_OBSTIME, _pm_margin(obstime)) if propagate else (obstime, 0)
+        groups = group_positions(positions[:, 0], positions[:, 1], group_size)
+
+        def query(group):
+            g_ra, g_dec, g_radius = enclosing_cone(positions[group, 0], positions[group, 1])
+            return self._gaia3_records(g_ra, g_dec, g_radius + radius + margin, fetch_columns, min_mag, max_mag, fetch_obstime, 0)
+
+        with ThreadPoolExecutor(max_workers = max(1, min(max_workers, len(groups)))) as pool:
+            results = list(pool.map(query, groups))
+        records = []
+        for group, result in zip(groups, results):
+            if not result.success:
+                return result
+            rows = result.data[0]
+            if len(rows) == 0:
+                continue
+            if propagate:
+                rows, src_ra, src_dec = _propagate_rows(rows, fetch_columns, obstime)
+            else:
+                src_ra, src_dec = select_arrays(rows, fetch_columns, ("ra", "dec"))
+            pos_idx, src_idx, _ = crossmatch((positions[group, 0], positions[group, 1]), (src_ra, src_dec), radius, mode = "all")
+            projected = project_rows(rows, fetch_columns, columns)
+            records.extend((int(group[p]), ) + tuple(projected[s]) for p, s in zip(pos_idx, src_idx))
+        records.sort(key = lambda r: r[0])
+        return Result.ok_data(data = format_catalog(records, out_columns, fmt)).append("totalCount", len(records)).append("columns", out_columns)
+
+    def gaia3_query_iter(self, ra: float, dec: float, radius: float, columns: tuple, min_mag: float,  max_mag: float,  obstime: int, limit: int, batch_size: int = 10000):
+        ''' retrieval GAIA DR 3 in batches while the stream is still arriving
+            args: same as gaia3_query
+                batch_size: number of rows per batch, default 10000
+            return: CatalogStream, iterate it for lists of rows;
+                raises CatalogStreamError or grpc.RpcError while iterating;
+                use it in a with block or call cancel() to stop the call early
+        '''
+        resps = self.stub.Gaia3Search(self._gaia3_req(ra, dec, radius, columns, min_mag, max_mag, obstime, limit),
+            metadata = get_auth_headers())
+        return CatalogStream(resps, batch_size, columns = columns)
+
+    def _gaia3_req(self, ra, dec, radius, columns, min_mag, max_mag, obstime, limit):
+        return ephem_pb2.EphemSearchRequest(
+            ra = ra,
+            dec = dec,
+            radius = radius,
+            columns = ",".join(columns),
+            minMag = min_mag,
+            maxMag = max_mag,
+            obstime = obstime,
+            limit = limit
+        )
+
+def _with_columns(columns, required):
+    return columns + tuple(c for c in required if c not in columns)
+
+def _pm_margin(obstime):
+    ''' the largest distance in deg a star moves between the Gaia DR3 epoch and obstime '''
+    years = np.ceil(abs(obstime - GAIA3_EPOCH_OBSTIME) / SECONDS_PER_YEAR / PM_MARGIN_YEARS) * PM_MARGIN_YEARS
+    return float(years * GAIA3_MAX_PM / 3.6e6)
+
+def _propagate_rows(rows, columns, obstime):
+    ''' rows with ra, dec moved from the Gaia DR3 epoch to obstime, and the new ra, dec arrays '''
+    ra, dec, pmra, pmdec = select_arrays(rows, columns, ("ra", "dec", "pmra", "pmdec"))
+    new_ra, new_dec = propagate_positions(ra, dec, pmra, pmdec, (obstime - GAIA3_EPOCH_OBSTIME) / SECONDS_PER_YEAR)
+    i_ra, i_dec = list(columns).index("ra"), list(columns).index("dec")
+    moved = []
+    for row, r, d in zip(rows, new_ra.tolist(), new_dec.tolist()):
+        row = list(row)
+        row[i_ra], row[i_dec] = r, d
+        moved.append(tuple(row))
+    return moved, new_ra, new_dec
+
+class _SuperCone(object):
+    ''' the rows of one prefetched gaia3 cone, with the columns needed to filter sub-cones
+    '''
+    def __init__(self, ra, dec, radius, columns, min_mag, max_mag, obstime, records):
+        self.ra = ra
+        self.dec = dec
+        self.radius = radius
+        self.columns = columns
+        self.min_mag = min_mag
+        self.max_mag = max_mag
+        self.obstime = obstime
+        self.records = records
+        self.ra_arr, self.dec_arr, self.mag_arr = select_arrays(records, columns, ("ra", "dec", GAIA3_MAG_COLUMN))
+
+    def covers(self, ra, dec, radius, columns, min_mag, max_mag, obstime):
+        return obstime == self.obstime and set(columns) <= set(self.columns) \
+            and self.min_mag <= min_mag and max_mag <= self.max_mag \
+            and cone_contains(self.ra, self.dec, self.radius, ra, dec, radius)
+
+    def select(self, ra, dec, radius, columns, min_mag, max_mag, limit):
+        mask = angular_distance(ra, dec, self.ra_arr, self.dec_arr) <= radius
+        if min_mag > self.min_mag:
+            mask &= self.mag_arr >= min_mag
+        if max_mag < self.max_mag:
+            mask &= self.mag_arr <= max_mag
+        idx = np.flatnonzero(mask)
+        totalCount = len(idx)
+        if limit:
+            idx = idx[:limit]
+        return project_rows([self.records[i] for i in idx], self.columns, columns), totalCount
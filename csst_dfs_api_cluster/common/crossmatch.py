@@ -0,0 +1,110 @@
+import numpy as np
+
+from .table import select_arrays
+from .sky import angular_distance
+
+CROSSMATCH_MODES = ("nearest", "all")
+# positions of the first catalog matched per pass, bounds the candidate arrays
+CROSSMATCH_CHUNK = 100000
+
+def crossmatch(cat1, cat2, radius, mode = "nearest", columns1 = ("ra", "dec"), columns2 = ("ra", "dec")):
+    ''' match two catalogs by position
+
+    The second catalog is sorted once by declination zone and RA; every
+    position of the first one then only looks at the RA window of its own and
+    the two neighbouring zones, so the work grows with the number of
+    candidates instead of the product of the catalog sizes.
+
+    :param cat1: a catalog Result with rows and columns, an astropy Table, a
+        numpy structured array or a tuple of (ra, dec) arrays in deg
+    :param cat2: the catalog to search in, same forms as cat1
+    :param radius: match radius in deg
+    :param mode: "nearest" for the closest source of cat2 per position of cat1,
+        "all" for every pair within radius
+    :param columns1: the names of the ra and dec columns of cat1
+    :param columns2: the names of the ra and dec columns of cat2
+    :returns: (idx1, idx2, sep), the row indices of the pairs in both catalogs
+        and their separation in deg, ordered by idx1 then sep
+    '''
+    if mode not in CROSSMATCH_MODES:
+        raise ValueError("mode must be one of %s" % (CROSSMATCH_MODES, ))
+    ra1, dec1 = catalog_positions(cat1, columns1)
+    ra2, dec2 = catalog_positions(cat2, columns2)
+    if len(ra1) == 0 or len(ra2) == 0:
+        return np.array([], dtype=np.int64), np.array([], dtype=np.int64), np.array([], dtype=float)
+
+    height = max(float(radius), 1 / 3600)
+    key2 = _zone(dec2, height) * 1000 + ra2
+    order = np.argsort(key2, kind="stable")
+    key2 = key2[order]
+
+    # walking cat1 in the same order keeps the searches local in key2
+    order1 = np.argsort(_zone(dec1, height) * 1000 + ra1, kind="stable")
+    parts = []
+    for start in range(0, len(ra1), CROSSMATCH_CHUNK):
+        chunk = order1[start:start + CROSSMATCH_CHUNK]
+        i1, i2 = _candidates(ra1[chunk], dec1[chunk], key2, height, radius)
+        i1 = chunk[i1]
+        i2 = order[i2]
+        sep = angular_distance(ra1[i1], dec1[i1], ra2[i2], dec2[i2])
+        keep = sep <= radius
+        parts.append((i1[keep], i2[keep], sep[keep]))
+    idx1, idx2, sep = (np.concatenate(p) for p in zip(*parts))
+
+    srt = np.lexsort((sep, idx1))
+    idx1, idx2, sep = idx1[srt], idx2[srt], sep[srt]
+    if mode == "nearest":
+        first = np.flatnonzero(np.r_[True, idx1[1:] != idx1[:-1]]) if len(idx1) else np.array([], dtype=np.int64)
+        idx1, idx2, sep = idx1[first], idx2[first], sep[first]
+    return idx1, idx2, sep
+
+def catalog_positions(cat, columns = ("ra", "dec")):
+    ''' the ra and dec arrays in deg of a catalog in any of the forms crossmatch accepts '''
+    ra_col, dec_col = columns
+    if isinstance(cat, tuple) and len(cat) == 2:
+        ra, dec = cat
+    elif isinstance(cat, dict) and "data" in cat:
+        data = cat["data"]
+        if isinstance(data, (list, tuple)):
+            if "columns" not in cat and not (len(data) > 0 and isinstance(data[0], dict)):
+                raise ValueError("a Result with rows needs its columns")
+            ra, dec = select_arrays(data, cat.get("columns", ()), (ra_col, dec_col))
+        else:
+            ra, dec = data[ra_col], data[dec_col]
+    else:
+        ra, dec = cat[ra_col], cat[dec_col]
+    return np.asarray(ra, dtype=float) % 360, np.asarray(dec, dtype=float)
+
+def _zone(dec, height):
+    return np.floor((dec + 90) / height)
+
+def _candidates(ra1, dec1, key2, height, radius):
+    ''' index pairs into the positions and the sorted keys of the neighbouring RA windows '''
+    zone1 = _zone(dec1, height)
+    top = np.minimum(np.abs(dec1) + radius, 90)
+    with np.errstate(divide="ignore"):
+        dra = np.where(top < 90, radius / np.cos(np.radians(top)), 180)
+    dra = np.minimum(dra, 180)
+    # the windows shifted by 360 deg pick up the sources across RA = 0
+    windows = [(np.arange(len(ra1)), 0),
+        (np.flatnonzero(ra1 - dra < 0), 360),
+        (np.flatnonzero(ra1 + dra >= 360), -360)]
+    i1s, i2s = [], []
+    for dz in (-1, 0, 1):
+        base = (zone1 + dz) * 1000 + ra1
+        for sel, shift in windows:
+            if len(sel) == 0:
+                continue
+            lo = np.searchsorted(key2, base[sel] + shift - dra[sel], side="left")
+            hi = np.searchsorted(key2, base[sel] + shift + dra[sel], side="left")
+            counts = hi - lo
+            total = int(counts.sum())
+            if total == 0:
+                continue
+            rep = np.repeat(np.arange(len(sel)), counts)
+            within = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+            i1s.append(sel[rep])
+            i2s.append(lo[rep] + within)
+    if not i1s:
+        return np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+    return np.concatenate(i1s), np.concatenate(i2s)
@@ -0,0 +1,114 @@
+import os
+import hashlib
+import logging
+import sqlite3
+
+log = logging.getLogger('csst')
+
+HASH_BLOCK_SIZE = 4 * 1024 * 1024
+
+class UploadIndex(object):
+    ''' content hashes of the files write() uploaded, in a local SQLite file
+
+    Stands in for a lookup by hash on the gateway, which the Write RPCs don't
+    offer yet. An entry maps (kind, sha256, filename, key) to the id of the
+    record the upload created; the record is fetched again before it is
+    trusted, so entries of deleted records only cost one get().
+
+    :param path: default CSST_DFS_UPLOAD_INDEX or ~/.csst_dfs/uploads.db
+    '''
+    def __init__(self, path = None):
+        self.path = path or os.getenv("CSST_DFS_UPLOAD_INDEX", os.path.expanduser("~/.csst_dfs/uploads.db"))
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok = True)
+        with self._connect() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS uploads (kind TEXT, digest TEXT, filename TEXT, key TEXT, "
+                "record_id INTEGER, PRIMARY KEY (kind, digest, filename, key))")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout = 30)
+
+    def lookup(self, kind, digest, filename, key):
+        ''' the record id of an earlier upload, or None '''
+        with self._connect() as conn:
+            row = conn.execute("SELECT record_id FROM uploads WHERE kind = ? AND digest = ? AND filename = ? AND key = ?",
+                (kind, digest, filename, str(key))).fetchone()
+        return row[0] if row else None
+
+    def add(self, kind, digest, filename, key, record_id):
+        with self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO uploads VALUES (?, ?, ?, ?, ?)", (kind, digest, filename, str(key), record_id))
+
+    def remove(self, kind, digest, filename, key):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM uploads WHERE kind = ? AND digest = ? AND filename = ? AND key = ?",
+                (kind, digest, filename, str(key)))
+
+# the message of the get() methods of the data APIs when there is no such record
+NOT_FOUND_MESSAGE = "data not found"
+
+_index = None
+_index_failed = False
+
+def default_index():
+    ''' the shared UploadIndex, None if it can't be opened, which disables dedup '''
+    global _index, _index_failed
+    if _index is None and not _index_failed:
+        try:
+            _index = UploadIndex()
+        except (OSError, sqlite3.Error) as e:
+            log.warning("can't open the upload index, uploads are not deduplicated: %s", e)
+            _index_failed = True
+    return _index
+
+def content_digest(file_path = None, data = None):
+    ''' sha256 hex digest of data if it is bytes, otherwise of the file at file_path;
+    None for file-like objects and HDULists, which can only be read once '''
+    h = hashlib.sha256()
+    if data is not None:
+        if not isinstance(data, (bytes, bytearray, memoryview)):
+            return None
+        h.update(data)
+        return h.hexdigest()
+    with open(file_path, 'rb') as f:
+        while True:
+            block = f.read(HASH_BLOCK_SIZE)
+            if not block:
+                break
+            h.update(block)
+    return h.hexdigest()
+
+def find_uploaded(kind, digest, filename, key, get, index = None):
+    ''' the Result of get(id) for the record of an identical earlier upload, or None
+
+    :param kind: the data API, like "level1"
+    :param digest: content_digest of the file
+    :param key: the record fields that identify the product, like (level0_id, data_type)
+    :param get: get(id) of the data API
+    '''
+    index = index or default_index()
+    if digest is None or index is None:
+        return None
+    try:
+        record_id = index.lookup(kind, digest, filename, key)
+        if record_id is None:
+            return None
+        result = get(record_id)
+        if result.success and getattr(result.data, "filename", filename) == filename:
+            log.debug("%s is already uploaded as %s record %d", filename, kind, record_id)
+            return result.append("deduplicated", True)
+        if result.success or result.message == NOT_FOUND_MESSAGE:
+            # the record is gone or now holds another file, keep the entry on transient errors
+            index.remove(kind, digest, filename, key)
+    except sqlite3.Error as e:
+        log.warning("upload index lookup failed: %s", e)
+    return None
+
+def remember_upload(kind, digest, filename, key, record_id, index = None):
+    ''' add a finished upload to the index, see find_uploaded '''
+    index = index or default_index()
+    if digest is None or not record_id or index is None:
+        return
+    try:
+        index.add(kind, digest, filename, key, record_id)
+    except sqlite3.Error as e:
+        log.warning("upload index update failed: %s", e)
@@ -0,0 +1,72 @@
+import time
+import asyncio
+import logging
+import grpc
+
+from . import upload
+
+log = logging.getLogger('csst')
+
+RETRYABLE_CODES = (grpc.StatusCode.UNAVAILABLE, grpc.StatusCode.DEADLINE_EXCEEDED,
+    grpc.StatusCode.RESOURCE_EXHAUSTED, grpc.StatusCode.ABORTED)
+RETRY_BACKOFF = 1.0
+
+def retry_write(send, make_requests, file_path, retries = 3, chunk_size = None):
+    ''' upload file_path as a client stream, retrying attempts that broke off before the last chunk
+
+    The Write RPCs take no offset, every stream starts a new file on the
+    server, so each retry sends the file from the start. Write is not
+    idempotent: once the last chunk has gone out the server may have stored
+    the record even though the call failed, so such an attempt is never
+    retried and its error is raised.
+
+    :param send: send(requests) makes the client-streaming call and returns its response
+    :param make_requests: make_requests(chunks) builds the request messages of the data chunks
+    :param file_path: the file to upload
+    :param retries: number of retries after a transient gRPC error
+    :param chunk_size: bytes per chunk, by default those of file_chunks, adaptive
+        if CSST_DFS_UPLOAD_ADAPTIVE=1
+    :returns: the response of send; raises grpc.RpcError of the last attempt
+    '''
+    for attempt in range(retries + 1):
+        chunks = _SentChunks(file_path, chunk_size)
+        try:
+            return send(make_requests(chunks))
+        except grpc.RpcError as e:
+            delay = _retry_delay(e, chunks, attempt, retries)
+            if delay is None:
+                raise
+            time.sleep(delay)
+
+async def aio_retry_write(send, make_requests, file_path, retries = 3, chunk_size = None):
+    ''' retry_write for the grpc.aio stubs, send(requests) returns an awaitable of the response '''
+    for attempt in range(retries + 1):
+        chunks = _SentChunks(file_path, chunk_size)
+        try:
+            return await send(make_requests(chunks))
+        except grpc.RpcError as e:
+            delay = _retry_delay(e, chunks, attempt, retries)
+            if delay is None:
+                raise
+            await asyncio.sleep(delay)
+
+class _SentChunks(object):
+    ''' the chunks of an attempt, counting the ones handed out '''
+    def __init__(self, file_path, chunk_size):
+        self.file_path = file_path
+        self.chunks = upload.file_chunks(file_path, chunk_size)
+        self.sent = 0
+        self.all = False
+
+    def __iter__(self):
+        for data in self.chunks:
+            self.sent += 1
+            yield data
+        self.all = True
+
+def _retry_delay(e, chunks, attempt, retries):
+    ''' seconds to wait before the next attempt, None if the error is final '''
+    if chunks.all or e.code() not in RETRYABLE_CODES or attempt == retries:
+        return None
+    log.warning("upload of %s failed after %d chunks (%s), retrying", chunks.file_path, chunks.sent, e.code())
+    return RETRY_BACKOFF * 2 ** attempt
@@ -1,18 +1,186 @@
 import os
+import atexit
+import itertools
+import threading
+import weakref
+import asyncio
 import grpc
 from csst_dfs_commons.models.errors import CSSTFatalException
+
+_channels = {}
+_channels_lock = threading.Lock()
+_aio_channels = weakref.WeakKeyDictionary()
+
 class ServiceProxy:
     def __init__(self):
         self.gateway = os.getenv("CSST_DFS_GATEWAY",'172.31.248.218:30880')
+        self.pool_size = max(1, int(os.getenv("CSST_DFS_CHANNEL_POOL_SIZE", 1)))
+        self.lazy = os.getenv("CSST_DFS_LAZY_CONNECT", "0").lower() in ("1", "true", "yes")
+        self.connect_timeout = float(os.getenv("CSST_DFS_CONNECT_TIMEOUT", 10))
+        self.options = (('grpc.max_send_message_length', 1024 * 1024 * 1024),
+                    ('grpc.max_receive_message_length', 1024 * 1024 * 1024))
 
     def channel(self):
-        options = (('grpc.max_send_message_length', 1024 * 1024 * 1024),
-                    ('grpc.max_receive_message_length', 1024 * 1024 * 1024))     
+        ''' return a channel shared by every stub of this process
+
+        Channels are registered per (gateway, options), so all API objects
+        multiplex their calls over the same HTTP/2 connection. With
+        CSST_DFS_CHANNEL_POOL_SIZE > 1 a small fixed pool is opened instead
+        and handed out round-robin. A forked child starts with an empty
+        registry, it never uses the channels of its parent.
+
+        With CSST_DFS_LAZY_CONNECT=1 the connect only starts in the background
+        and the first RPC waits for it, up to CSST_DFS_CONNECT_TIMEOUT seconds,
+        then fails with ConnectTimeoutError, a grpc.RpcError.
+        '''
+        key = (self.gateway, self.options, self.lazy)
+        with _channels_lock:
+            pool = _channels.get(key)
+            if pool is None:
+                pool = _ChannelPool([])
+                try:
+                    for _ in range(self.pool_size):
+                        pool.channels.append(self._connect())
+                except CSSTFatalException:
+                    pool.close()
+                    raise
+                _channels[key] = pool
+        return pool.next()
+
+    def aio_channel(self):
+        ''' return the grpc.aio channel shared by the async APIs of the running event loop
+
+        grpc.aio channels are bound to the loop they are created in, so one
+        channel is kept per loop and per (gateway, options).
+        '''
+        loop = asyncio.get_running_loop()
+        key = (self.gateway, self.options)
+        with _channels_lock:
+            channels = _aio_channels.setdefault(loop, {})
+            channel = channels.get(key)
+            if channel is None:
+                channel = grpc.aio.insecure_channel(self.gateway, options = self.options)
+                channels[key] = channel
+        return channel
+
+    def _connect(self):
+        options = self.options
+        if self.pool_size > 1:
+            # keep the subchannels of pooled channels apart, otherwise grpc
+            # reuses one connection for all of them
+            options = options + (('grpc.use_local_subchannel_pool', 1),)
         # channel = grpc.insecure_channel(self.gateway, options = options, compression = grpc.Compression.Gzip)
         channel = grpc.insecure_channel(self.gateway, options = options)
+        ready = grpc.channel_ready_future(channel)
+        if self.lazy:
+            return grpc.intercept_channel(channel, _ReadyInterceptor(self.gateway, ready, self.connect_timeout))
         try:
-            grpc.channel_ready_future(channel).result(timeout=10)
+            ready.result(timeout=self.connect_timeout)
         except grpc.FutureTimeoutError:
+            channel.close()
             raise CSSTFatalException('Error connecting to server {}'.format(self.gateway))
         else:
-            return channel
\ No newline at end of file
+            return channel
+
+class ConnectTimeoutError(grpc.RpcError):
+    ''' a call on a lazily connected channel that gave up waiting for the connection
+
+    A grpc.RpcError with code() UNAVAILABLE, so the API methods return it as
+    Result.error like any failed call.
+    '''
+    def __init__(self, gateway):
+        super().__init__('Error connecting to server {}'.format(gateway))
+        self.gateway = gateway
+
+    def code(self):
+        return grpc.StatusCode.UNAVAILABLE
+
+    def details(self):
+        return 'Error connecting to server {}'.format(self.gateway)
+
+class _ReadyInterceptor(grpc.UnaryUnaryClientInterceptor,
+                        grpc.UnaryStreamClientInterceptor,
+                        grpc.StreamUnaryClientInterceptor,
+                        grpc.StreamStreamClientInterceptor):
+    ''' hold back the calls of a lazily connected channel until it is ready
+    '''
+    def __init__(self, gateway, ready, timeout):
+        self.gateway = gateway
+        self.ready = ready
+        self.timeout = timeout
+        self.connected = False
+
+    def _wait(self):
+        if self.connected:
+            return
+        try:
+            self.ready.result(timeout=self.timeout)
+        except grpc.FutureTimeoutError:
+            raise ConnectTimeoutError(self.gateway)
+        self.connected = True
+
+    def intercept_unary_unary(self, continuation, client_call_details, request):
+        self._wait()
+        return continuation(client_call_details, request)
+
+    def intercept_unary_stream(self, continuation, client_call_details, request):
+        self._wait()
+        return continuation(client_call_details, request)
+
+    def intercept_stream_unary(self, continuation, client_call_details, request_iterator):
+        self._wait()
+        return continuation(client_call_details, request_iterator)
+
+    def intercept_stream_stream(self, continuation, client_call_details, request_iterator):
+        self._wait()
+        return continuation(client_call_details, request_iterator)
+
+class _ChannelPool:
+    def __init__(self, channels):
+        self.channels = channels
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+
+    def next(self):
+        with self._lock:
+            return self.channels[next(self._counter) % len(self.channels)]
+
+    def close(self):
+        for channel in self.channels:
+            channel.close()
+
+def channel_count():
+    ''' the number of gRPC channels currently open in this process
+    '''
+    with _channels_lock:
+        return sum(len(pool.channels) for pool in _channels.values()) + \
+            sum(len(channels) for channels in _aio_channels.values())
+
+def close_channels():
+    ''' close all shared channels, later calls of ServiceProxy().channel() reconnect
+    '''
+    with _channels_lock:
+        pools = list(_channels.values())
+        _channels.clear()
+    for pool in pools:
+        pool.close()
+
+async def close_aio_channels():
+    ''' close the grpc.aio channels of the running event loop
+    '''
+    with _channels_lock:
+        channels = _aio_channels.pop(asyncio.get_running_loop(), {})
+    for channel in channels.values():
+        await channel.close()
+
+def _forget_channels():
+    # gRPC channels don't survive a fork: the child drops the inherited ones,
+    # without closing them under the parent, and connects anew
+    global _channels_lock, _aio_channels
+    _channels_lock = threading.Lock()
+    _channels.clear()
+    _aio_channels = weakref.WeakKeyDictionary()
+
+atexit.register(close_channels)
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child = _forget_channels)
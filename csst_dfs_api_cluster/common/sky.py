@@ -0,0 +1,111 @@
+import numpy as np
+
+def angular_distance(ra1, dec1, ra2, dec2):
+    ''' great-circle distance in deg between positions in deg, numpy-broadcast
+
+    Uses the haversine formula, which stays accurate for small separations.
+    '''
+    ra1, dec1, ra2, dec2 = (np.radians(np.asarray(v, dtype=float)) for v in (ra1, dec1, ra2, dec2))
+    sin_ddec = np.sin((dec2 - dec1) / 2)
+    sin_dra = np.sin((ra2 - ra1) / 2)
+    a = sin_ddec ** 2 + np.cos(dec1) * np.cos(dec2) * sin_dra ** 2
+    return np.degrees(2 * np.arcsin(np.sqrt(np.clip(a, 0, 1))))
+
+def cone_contains(ra, dec, radius, inner_ra, inner_dec, inner_radius):
+    ''' whether the cone (inner_ra, inner_dec, inner_radius) lies inside the cone (ra, dec, radius) '''
+    return angular_distance(ra, dec, inner_ra, inner_dec) + inner_radius <= radius + 1e-9
+
+def cone_tiles(ra, dec, radius, tile_radius):
+    ''' split a cone into declination-zone tiles, each covered by a cone of at most about tile_radius
+
+    The zones are tile_radius * sqrt(2) high and cut in RA into boxes of about
+    the same width, a zone reaching a pole becomes one polar cap. Tiles whose
+    covering cone can't overlap the input cone are dropped.
+
+    :returns: list of (ra, dec, radius) in deg
+    '''
+    height = tile_radius * np.sqrt(2)
+    n_zones = max(1, int(np.ceil(2 * radius / height)))
+    height = 2 * radius / n_zones
+    tiles = []
+    for i in range(n_zones):
+        lo = dec - radius + i * height
+        hi = lo + height
+        if hi >= 90 or lo <= -90:
+            pole = 90.0 if hi >= 90 else -90.0
+            cap = pole - lo if pole > 0 else hi - pole
+            tiles.append((0.0, pole, cap))
+            continue
+        zone_dec = (lo + hi) / 2
+        cos_edge = np.cos(np.radians(max(abs(lo), abs(hi))))
+        width = min(360.0, height / cos_edge)
+        # the RA boxes cover the whole RA extent of the cone within the zone
+        span = min(360.0, 2 * cone_ra_half_width(dec, radius, lo, hi) + 1e-9)
+        n_ra = max(1, int(np.ceil(span / width)))
+        width = span / n_ra
+        for j in range(n_ra):
+            tile_ra = (ra - span / 2 + (j + 0.5) * width) % 360
+            corners = angular_distance(tile_ra, zone_dec, [tile_ra - width / 2, tile_ra + width / 2] * 2, [lo, lo, hi, hi])
+            tile_r = float(np.max(corners))
+            if angular_distance(ra, dec, tile_ra, zone_dec) <= radius + tile_r:
+                tiles.append((tile_ra, zone_dec, tile_r))
+    return tiles
+
+def cone_ra_half_width(dec, radius, lo, hi):
+    ''' the largest RA offset in deg from the centre of a cone at dec of the
+    points of the cone with declination between lo and hi, 180 if the cone
+    reaches round the pole there '''
+    lo, hi = max(lo, dec - radius), min(hi, dec + radius)
+    if lo > hi:
+        return 0.0
+    if dec + radius >= 90 or dec - radius <= -90:
+        return 180.0
+    d0, r = np.radians(dec), np.radians(radius)
+    # the offset grows from the zone edges towards sin(d) = sin(d0) / cos(r),
+    # the declination of the widest point of the cone
+    peak = np.degrees(np.arcsin(np.clip(np.sin(d0) / np.cos(r), -1, 1)))
+    d = np.radians(np.array([lo, hi, min(max(peak, lo), hi)]))
+    cos_dra = (np.cos(r) - np.sin(d) * np.sin(d0)) / np.maximum(np.cos(d) * np.cos(d0), 1e-15)
+    return float(np.degrees(np.max(np.arccos(np.clip(cos_dra, -1, 1)))))
+
+def group_positions(ra, dec, size):
+    ''' group positions into cells about size deg wide in declination zones
+
+    :returns: list of index arrays, one per non-empty cell
+    '''
+    ra = np.asarray(ra, dtype=float) % 360
+    dec = np.asarray(dec, dtype=float)
+    zone = np.floor((dec + 90) / size).astype(np.int64)
+    lo = zone * size - 90
+    cos_edge = np.maximum(np.cos(np.radians(np.maximum(np.abs(lo), np.abs(lo + size)))), size / 360)
+    cell = np.floor(ra * cos_edge / size).astype(np.int64)
+    keys = zone * (int(360 / size) + 2) + cell
+    order = np.argsort(keys, kind="stable")
+    return np.split(order, np.flatnonzero(np.diff(keys[order])) + 1)
+
+def enclosing_cone(ra, dec):
+    ''' a cone around positions in deg, centred on their mean direction
+
+    :returns: (ra, dec, radius) in deg
+    '''
+    ra_r, dec_r = np.radians(np.asarray(ra, dtype=float)), np.radians(np.asarray(dec, dtype=float))
+    x = np.mean(np.cos(dec_r) * np.cos(ra_r))
+    y = np.mean(np.cos(dec_r) * np.sin(ra_r))
+    z = np.mean(np.sin(dec_r))
+    c_ra = float(np.degrees(np.arctan2(y, x)) % 360)
+    c_dec = float(np.degrees(np.arctan2(z, np.hypot(x, y))))
+    return c_ra, c_dec, float(np.max(angular_distance(c_ra, c_dec, ra, dec)))
+
+def propagate_positions(ra, dec, pmra, pmdec, years):
+    ''' move positions in deg linearly by their proper motion over years
+
+    pmra includes the cos(dec) factor, both proper motions in mas/yr; a
+    missing (nan) proper motion leaves the position unchanged.
+    '''
+    dec = np.asarray(dec, dtype=float)
+    pmra = np.nan_to_num(np.asarray(pmra, dtype=float))
+    pmdec = np.nan_to_num(np.asarray(pmdec, dtype=float))
+    new_dec = dec + pmdec * years / 3.6e6
+    cos_dec = np.maximum(np.cos(np.radians(dec)), 1e-12)
+    new_ra = (np.asarray(ra, dtype=float) + pmra * years / 3.6e6 / cos_dec) % 360
+    return new_ra, np.clip(new_dec, -90, 90)
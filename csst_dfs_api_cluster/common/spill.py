@@ -0,0 +1,191 @@
+import io
+import os
+import pickle
+import shutil
+import tempfile
+import numpy as np
+
+from .stream import ChunkReader, CatalogStreamError, READ_BUFFER_SIZE
+from .table import rows_to_arrays
+
+SPILL_BATCH_SIZE = 100000
+# least width of the text column a mixed text/number column is stored as, wide enough for any number
+SPILL_TEXT_WIDTH = 32
+
+def spill_catalog(resps, spill_dir, columns = None, batch_size = SPILL_BATCH_SIZE):
+    ''' decode a pickled catalog stream into a memory-mapped .npy file in spill_dir
+
+    The rows are taken out of the unpickler in batches while the stream is
+    arriving and written per column to disk, so only one batch of rows is held
+    in memory however large the catalog is. The columns are then joined into
+    one structured .npy file, which is opened memory-mapped and left in
+    spill_dir for the caller.
+
+    Decoding runs in the pure-Python unpickler, many times slower than the
+    default path, so this is meant for results that don't fit in memory.
+
+    :param resps: response iterator of FindCatalog or Gaia3Search
+    :param spill_dir: directory of the result file and the temporary column chunks
+    :param columns: the column names if the payload carries rows only,
+        otherwise each object is (rows, columns)
+    :param batch_size: number of rows per column chunk
+    :returns: (memory-mapped structured array, columns, totalCount);
+        raises CatalogStreamError, also for a payload that refers back to a
+        row, or grpc.RpcError
+    '''
+    os.makedirs(spill_dir, exist_ok = True)
+    chunk_dir = tempfile.mkdtemp(prefix = "catalog-", dir = spill_dir)
+    try:
+        writer = _ColumnChunks(chunk_dir)
+        reader = ChunkReader(resps)
+        unpickler = _SpillUnpickler(io.BufferedReader(reader, READ_BUFFER_SIZE), lambda: _RowSink(writer.write, batch_size))
+        while True:
+            try:
+                obj = unpickler.load()
+            except EOFError:
+                break
+            except pickle.UnpicklingError as e:
+                raise CatalogStreamError("can't decode the catalog in spill mode (%s), the payload may refer back to a row; query without spill_dir" % (e, ))
+            unpickler.sink.flush_rows()
+            if isinstance(obj, tuple):
+                columns = obj[1]
+        reader.drain()
+        fd, path = tempfile.mkstemp(prefix = "catalog-", suffix = ".npy", dir = spill_dir)
+        os.close(fd)
+        return writer.join(columns or [], path), list(columns or []), reader.totalCount
+    finally:
+        shutil.rmtree(chunk_dir, ignore_errors = True)
+
+class _RowSink(object):
+    ''' stands in for the rows list of a payload and passes the rows on in batches '''
+    def __init__(self, flush, batch_size):
+        self.flush = flush
+        self.batch_size = batch_size
+        self.rows = []
+
+    def append(self, row):
+        self.rows.append(row)
+        if len(self.rows) >= self.batch_size:
+            self.flush_rows()
+
+    def extend(self, rows):
+        self.rows.extend(rows)
+        if len(self.rows) >= self.batch_size:
+            self.flush_rows()
+
+    def flush_rows(self):
+        if self.rows:
+            self.flush(self.rows)
+            self.rows = []
+
+class _SpillUnpickler(pickle._Unpickler):
+    ''' unpickler that builds the first list of every object as a _RowSink
+
+    The rows appended to the sink are not memoized, a catalog never refers
+    back to a row, so nothing keeps them alive after their batch is written.
+    Everything else is memoized as usual; a payload that does refer back to a
+    row fails with UnpicklingError instead of being decoded wrongly.
+    '''
+    dispatch = dict(pickle._Unpickler.dispatch)
+
+    def __init__(self, file, new_sink):
+        super().__init__(file)
+        self.new_sink = new_sink
+        self.sink = None
+
+    def load(self):
+        self.sink = None
+        self.memo = {}
+        self._memo_count = 0
+        return super().load()
+
+    def _list(self, items):
+        if self.sink is None and not items:
+            self.sink = self.new_sink()
+            self.append(self.sink)
+        else:
+            self.append(items)
+
+    def load_empty_list(self):
+        self._list([])
+    dispatch[pickle.EMPTY_LIST[0]] = load_empty_list
+
+    def load_list(self):
+        self._list(self.pop_mark())
+    dispatch[pickle.LIST[0]] = load_list
+
+    def _is_row(self, obj):
+        ''' whether obj is about to be appended to the sink, by APPENDS after a MARK or by APPEND '''
+        if self.sink is None or not isinstance(obj, tuple):
+            return False
+        if self.metastack and self.metastack[-1] and self.metastack[-1][-1] is self.sink:
+            return True
+        return len(self.stack) >= 2 and self.stack[-2] is self.sink
+
+    def _put(self, i):
+        if not self._is_row(self.stack[-1]):
+            self.memo[i] = self.stack[-1]
+
+    def load_memoize(self):
+        self._put(self._memo_count)
+        self._memo_count += 1
+    dispatch[pickle.MEMOIZE[0]] = load_memoize
+
+    def load_binput(self):
+        self._put(self.read(1)[0])
+    dispatch[pickle.BINPUT[0]] = load_binput
+
+    def load_long_binput(self):
+        self._put(int.from_bytes(self.read(4), 'little'))
+    dispatch[pickle.LONG_BINPUT[0]] = load_long_binput
+
+    def load_put(self):
+        self._put(int(self.readline()[:-1]))
+    dispatch[pickle.PUT[0]] = load_put
+
+class _ColumnChunks(object):
+    ''' numpy chunk files per column, joined into one structured .npy at the end '''
+    def __init__(self, chunk_dir):
+        self.chunk_dir = chunk_dir
+        self.keys = None
+        self.chunks = []
+
+    def write(self, rows):
+        if self.keys is None and isinstance(rows[0], dict):
+            self.keys = list(rows[0])
+        arrays = rows_to_arrays(rows, self.keys)
+        if not self.chunks:
+            self.chunks = [[] for _ in arrays]
+        for i, arr in enumerate(arrays):
+            if arr.dtype == object:
+                arr = arr.astype(str)
+            path = os.path.join(self.chunk_dir, "c%d_%d.npy" % (i, len(self.chunks[i])))
+            np.save(path, arr)
+            self.chunks[i].append((path, arr.dtype, len(arr)))
+
+    def join(self, columns, path):
+        names = self.keys or columns
+        dtype = [(str(c), _column_dtype([d for _, d, _ in chunks])) for c, chunks in zip(names, self.chunks)]
+        if not dtype:
+            dtype = [(str(c), float) for c in names]
+        total = sum(n for _, _, n in self.chunks[0]) if self.chunks else 0
+        if total == 0:
+            np.save(path, np.empty(0, dtype = dtype))
+            return np.load(path)
+        out = np.lib.format.open_memmap(path, mode = 'w+', dtype = dtype, shape = (total, ))
+        for (name, _), chunks in zip(dtype, self.chunks):
+            offset = 0
+            for chunk_path, _, n in chunks:
+                out[name][offset:offset + n] = np.load(chunk_path, mmap_mode = 'r')
+                offset += n
+        out.flush()
+        del out
+        return np.load(path, mmap_mode = 'r')
+
+def _column_dtype(dtypes):
+    if any(d.kind in "US" for d in dtypes):
+        if all(d.kind in "US" for d in dtypes):
+            return np.dtype("U%d" % max(d.itemsize // np.dtype("U1").itemsize if d.kind == "U" else d.itemsize for d in dtypes))
+        widths = [d.itemsize // np.dtype("U1").itemsize if d.kind == "U" else d.itemsize for d in dtypes if d.kind in "US"]
+        return np.dtype("U%d" % max(widths + [SPILL_TEXT_WIDTH]))
+    return np.result_type(*dtypes)
@@ -0,0 +1,272 @@
+import io
+import grpc
+import pickle
+import asyncio
+import threading
+import concurrent.futures
+from concurrent.futures import ThreadPoolExecutor
+
+READ_BUFFER_SIZE = 1024*1024
+
+class CatalogStreamError(Exception):
+    ''' the server answered a catalog stream with success = false '''
+
+class ChunkReader(io.RawIOBase):
+    ''' read-only file over the records chunks of a server-streaming response
+
+    Chunks are pulled from the response iterator only when the reader runs dry,
+    so a consumer like pickle.Unpickler decodes while the rest is still in flight.
+    '''
+    def __init__(self, resps):
+        self.resps = iter(resps)
+        self.totalCount = 0
+        self._chunk = memoryview(b'')
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self._chunk:
+            try:
+                resp = next(self.resps)
+            except StopIteration:
+                return 0
+            if not resp.success:
+                raise CatalogStreamError(str(resp.error.detail))
+            self.totalCount = resp.totalCount
+            self._chunk = memoryview(resp.records)
+        n = min(len(b), len(self._chunk))
+        b[:n] = self._chunk[:n]
+        self._chunk = self._chunk[n:]
+        return n
+
+    def drain(self):
+        ''' read the responses left after the payload, for their totalCount and errors '''
+        for resp in self.resps:
+            if not resp.success:
+                raise CatalogStreamError(str(resp.error.detail))
+            self.totalCount = resp.totalCount
+
+def read_catalog(resps):
+    ''' decode a single pickled catalog payload straight from the response stream
+
+    Only the chunk in flight and a read buffer are held besides the decoded
+    object, the payload is never assembled in one piece.
+
+    :returns: (obj, totalCount); raises CatalogStreamError or grpc.RpcError
+    '''
+    reader = ChunkReader(resps)
+    obj = pickle.load(io.BufferedReader(reader, READ_BUFFER_SIZE))
+    reader.drain()
+    return obj, reader.totalCount
+
+class CatalogStream(object):
+    ''' iterate over the rows of a pickled catalog stream in batches
+
+    Every pickled object on the stream is decoded straight from the network,
+    without collecting the payload first, and handed out in slices of
+    batch_size rows.
+
+    Use it as a context manager or call cancel() to stop early: leaving the
+    with block, breaking out of the loop or an exception in it cancels the
+    call, so the server stops sending rows nobody reads.
+
+    :param resps: response iterator of FindCatalog or Gaia3Search
+    :param batch_size: number of rows per batch
+    :param columns: the column names if the payload carries rows only,
+        otherwise each object is (rows, columns)
+    '''
+    def __init__(self, resps, batch_size, columns = None):
+        self.resps = resps
+        self.batch_size = batch_size
+        self.columns = columns
+        self._with_columns = columns is None
+        self._reader = ChunkReader(resps)
+        self.finished = False
+        self.cancelled = False
+
+    @property
+    def totalCount(self):
+        return self._reader.totalCount
+
+    def cancel(self):
+        ''' cancel the call unless the stream was read to the end '''
+        if self.finished or self.cancelled:
+            return
+        self.cancelled = True
+        if hasattr(self.resps, "cancel"):
+            self.resps.cancel()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.cancel()
+        return False
+
+    def __iter__(self):
+        unpickler = pickle.Unpickler(io.BufferedReader(self._reader, READ_BUFFER_SIZE))
+        try:
+            while not self.cancelled:
+                try:
+                    obj = unpickler.load()
+                except EOFError:
+                    self.finished = True
+                    return
+                except grpc.RpcError:
+                    if self.cancelled:
+                        return
+                    raise
+                if self._with_columns:
+                    rows, self.columns = obj[0], obj[1]
+                else:
+                    rows = obj
+                for i in range(0, len(rows), self.batch_size):
+                    if self.cancelled:
+                        return
+                    yield rows[i:i + self.batch_size]
+                del rows, obj
+        finally:
+            self.cancel()
+
+def fan_out_catalog(open_call, groups, limit = 0, max_workers = 8, ordered = True, batch_size = 10000):
+    ''' run one catalog stream per group concurrently and merge the rows
+
+    open_call(group) starts the streaming call of a group. The rows are merged in
+    group order if ordered, otherwise in the order they arrive. Once limit rows
+    are certain all calls still running are cancelled.
+
+    :returns: (rows, columns, totalCount), totalCount summed over the groups;
+        raises CatalogStreamError or grpc.RpcError of the first failed group
+    '''
+    n = len(groups)
+    calls = [None] * n
+    rows = [[] for _ in range(n)]
+    arrived = []
+    done = [False] * n
+    counts = [0] * n
+    columns = []
+    lock = threading.Lock()
+    stop = threading.Event()
+
+    def enough():
+        if not limit:
+            return False
+        if not ordered:
+            return len(arrived) >= limit
+        total = 0
+        for i in range(n):
+            total += len(rows[i])
+            if total >= limit:
+                return True
+            if not done[i]:
+                return False
+        return False
+
+    def cancel_all():
+        stop.set()
+        with lock:
+            for call in calls:
+                if call is not None:
+                    call.cancel()
+
+    def run(i):
+        if stop.is_set():
+            return
+        call = open_call(groups[i])
+        with lock:
+            calls[i] = call
+        if stop.is_set():
+            call.cancel()
+            return
+        try:
+            with CatalogStream(call, batch_size) as stream:
+                for batch in stream:
+                    with lock:
+                        if not columns and stream.columns is not None:
+                            columns.extend(stream.columns)
+                        rows[i].extend(batch)
+                        arrived.extend(batch)
+                        hit = enough()
+                    if hit:
+                        cancel_all()
+                        return
+        except grpc.RpcError:
+            if stop.is_set():
+                return
+            raise
+        finally:
+            counts[i] = stream.totalCount
+        with lock:
+            # a group without rows still has the columns of its payload
+            if not columns and stream.columns is not None:
+                columns.extend(stream.columns)
+            done[i] = True
+            hit = enough()
+        if hit:
+            cancel_all()
+
+    with ThreadPoolExecutor(max_workers = max(1, min(max_workers, n))) as pool:
+        futures = [pool.submit(run, i) for i in range(n)]
+        try:
+            for f in futures:
+                f.result()
+        except Exception:
+            cancel_all()
+            raise
+    merged = [row for group_rows in rows for row in group_rows] if ordered else arrived
+    if limit:
+        merged = merged[:limit]
+    return merged, columns, sum(counts)
+
+class _CancelledError(grpc.RpcError):
+    ''' a bridged call was cancelled, as grpc raises it for a sync call '''
+    def code(self):
+        return grpc.StatusCode.CANCELLED
+
+    def details(self):
+        return "Locally cancelled by application!"
+
+class AioStreamStub(object):
+    ''' the server-streaming methods of a grpc.aio stub for blocking code on another thread
+
+    The async APIs run the catalog decoding of the sync APIs on an executor
+    thread through it, so unpickling never blocks the event loop: each call is
+    started on the loop and its responses are read through the loop, one at a
+    time, as the decoder pulls them. The calls behave like those of a sync
+    stub, iterate them for the responses and cancel() them.
+
+    :param stub: the grpc.aio stub, created in the running loop
+    '''
+    def __init__(self, stub):
+        self.stub = stub
+        self.loop = asyncio.get_running_loop()
+
+    def __getattr__(self, name):
+        method = getattr(self.stub, name)
+
+        def call(req, metadata = None):
+            async def start():
+                return method(req, metadata = metadata)
+            return _AioStreamCall(asyncio.run_coroutine_threadsafe(start(), self.loop).result(), self.loop)
+        return call
+
+class _AioStreamCall(object):
+    def __init__(self, call, loop):
+        self.call = call
+        self.loop = loop
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            resp = asyncio.run_coroutine_threadsafe(self.call.read(), self.loop).result()
+        except (asyncio.CancelledError, concurrent.futures.CancelledError):
+            raise _CancelledError()
+        if resp is grpc.aio.EOF:
+            raise StopIteration
+        return resp
+
+    def cancel(self):
+        self.loop.call_soon_threadsafe(self.call.cancel)
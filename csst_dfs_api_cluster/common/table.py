@@ -0,0 +1,98 @@
+import numpy as np
+from astropy.table import Table
+
+CATALOG_FORMATS = ("table", "numpy")
+
+def rows_to_arrays(rows, columns):
+    ''' transpose catalog rows into one numpy array per column
+
+    The dtype of each column is inferred once from the whole column,
+    None in a numeric column becomes nan.
+
+    :param rows: sequence of row tuples or dicts
+    :param columns: the column names
+    :returns: list of numpy arrays in the order of columns
+    '''
+    if len(rows) == 0:
+        return [np.array([], dtype=float) for _ in columns]
+    if isinstance(rows[0], dict):
+        values = [[row[c] for row in rows] for c in columns]
+    else:
+        values = list(zip(*rows))
+    return [_to_array(v) for v in values]
+
+def select_arrays(rows, columns, selected):
+    ''' numpy arrays of the selected columns only of catalog rows
+
+    :param rows: sequence of row tuples or dicts
+    :param columns: the column names of the rows
+    :param selected: the column names to convert
+    :returns: list of numpy arrays in the order of selected
+    '''
+    if len(rows) > 0 and isinstance(rows[0], dict):
+        return [_to_array([row[c] for row in rows]) for c in selected]
+    positions = [list(columns).index(c) for c in selected]
+    return [_to_array([row[i] for row in rows]) if len(rows) > 0 else np.array([], dtype=float) for i in positions]
+
+def project_rows(rows, columns, selected):
+    ''' the rows reduced to the selected columns, rows are returned as-is if nothing is dropped '''
+    if tuple(columns) == tuple(selected):
+        return list(rows)
+    if len(rows) > 0 and isinstance(rows[0], dict):
+        return [{c: row[c] for c in selected} for row in rows]
+    positions = [list(columns).index(c) for c in selected]
+    return [tuple(row[i] for i in positions) for row in rows]
+
+def proto_to_arrays(records, columns = None):
+    ''' one numpy array per field of a list of protobuf records
+
+    :param records: repeated protobuf messages
+    :param columns: the field names, default all fields of the message type
+    :returns: (arrays, columns)
+    '''
+    if columns is None:
+        if len(records) == 0:
+            return [], []
+        columns = [f.name for f in records[0].DESCRIPTOR.fields]
+    return [_to_array([getattr(r, c) for r in records]) for c in columns], list(columns)
+
+def _to_array(values):
+    arr = np.asarray(values)
+    if arr.dtype == object:
+        try:
+            arr = np.asarray(values, dtype=float)
+        except (TypeError, ValueError):
+            pass
+    return arr
+
+def to_structured(arrays, columns):
+    ''' build a numpy structured array from column arrays '''
+    n = len(arrays[0]) if arrays else 0
+    out = np.empty(n, dtype=[(str(c), a.dtype) for c, a in zip(columns, arrays)])
+    for c, a in zip(columns, arrays):
+        out[str(c)] = a
+    return out
+
+def to_table(arrays, columns):
+    ''' build an astropy Table from column arrays '''
+    return Table(arrays, names=[str(c) for c in columns], copy=False)
+
+def catalog_format(kwargs):
+    ''' the columnar format requested by as_table=True or format="table"/"numpy", None for rows
+    '''
+    fmt = kwargs.get("format")
+    if fmt is None and kwargs.get("as_table"):
+        fmt = "table"
+    if fmt is not None and fmt not in CATALOG_FORMATS:
+        raise ValueError("format must be one of %s" % (CATALOG_FORMATS, ))
+    return fmt
+
+def format_catalog(rows, columns, fmt):
+    ''' convert catalog rows into the requested columnar format, rows are returned as-is for fmt None
+    '''
+    if fmt is None:
+        return rows
+    arrays = rows_to_arrays(rows, columns)
+    if fmt == "numpy":
+        return to_structured(arrays, columns)
+    return to_table(arrays, columns)
@@ -0,0 +1,497 @@
+import io
+import os
+import json
+import time
+import queue
+import asyncio
+import logging
+import threading
+import grpc
+from concurrent.futures import ThreadPoolExecutor
+
+from csst_dfs_commons.models import Result
+from csst_dfs_commons.models.constants import UPLOAD_CHUNK_SIZE
+
+from . import retry
+from .utils import get_parameter, get_auth_headers, written_result
+from .dedup import content_digest, find_uploaded, remember_upload
+
+log = logging.getLogger('csst')
+
+ADAPTIVE_MIN_CHUNK_SIZE = 256 * 1024
+ADAPTIVE_SLOW_SECONDS = 0.5
+# chunks sent at a size before it is compared with its neighbours
+ADAPTIVE_SAMPLES = 8
+# weight of the latest chunk in the smoothed send time per byte of a size
+ADAPTIVE_SMOOTHING = 0.3
+# a neighbour must be this much faster to move to it
+ADAPTIVE_MIN_GAIN = 1.1
+ADAPTIVE_EXPLORE_CHUNKS = 128
+# bytes of a stream sent before its chunks are timed
+ADAPTIVE_WARMUP_BYTES = 16 * 1024 * 1024
+
+class UploadManager(object):
+    ''' upload many files at once through the write() of the data APIs
+
+    Every upload is its own Write stream, up to max_workers of them run
+    concurrently over the shared channel. An upload only starts when the sizes
+    of the files in flight stay within max_inflight_bytes; a file larger than
+    that runs alone.
+
+    :param max_workers: number of concurrent uploads, default CSST_DFS_UPLOAD_WORKERS or 4
+    :param max_inflight_bytes: cap on the total size of the files being uploaded,
+        default CSST_DFS_UPLOAD_MAX_INFLIGHT_BYTES or 1 GB
+    '''
+    def __init__(self, max_workers = None, max_inflight_bytes = None):
+        self.max_workers = max_workers or int(os.getenv("CSST_DFS_UPLOAD_WORKERS", 4))
+        self.max_inflight_bytes = max_inflight_bytes or int(os.getenv("CSST_DFS_UPLOAD_MAX_INFLIGHT_BYTES", 1024 ** 3))
+        self._inflight = 0
+        self._cond = threading.Condition()
+
+    def upload(self, specs):
+        ''' run the uploads and wait for all of them
+
+        :param specs: list of (api, kwargs), api is a data API such as
+            Level1DataApi or mbi.Level2DataApi and kwargs are passed to its write()
+        :returns: csst_dfs_common.models.Result, data is the list of the write()
+            Results in the order of specs, with totalBytes, elapsed in seconds,
+            throughput in bytes per second and failed, the number of failed uploads
+        '''
+        specs = list(specs)
+        sizes = [_file_size(kwargs) for _, kwargs in specs]
+        start = time.time()
+        with ThreadPoolExecutor(max_workers = max(1, min(self.max_workers, len(specs)))) as pool:
+            results = list(pool.map(self._write, specs, sizes))
+        elapsed = time.time() - start
+        done_bytes = sum(size for size, r in zip(sizes, results) if r.success)
+        failed = sum(1 for r in results if not r.success)
+        log.debug("uploaded %d files, %d bytes in %.1fs, %d failed", len(specs) - failed, done_bytes, elapsed, failed)
+        return Result.ok_data(data = results).append("totalBytes", done_bytes).append("elapsed", elapsed) \
+            .append("throughput", done_bytes / elapsed if elapsed > 0 else 0.0).append("failed", failed)
+
+    def _write(self, spec, size):
+        api, kwargs = spec
+        size = min(size, self.max_inflight_bytes)
+        with self._cond:
+            self._cond.wait_for(lambda: self._inflight == 0 or self._inflight + size <= self.max_inflight_bytes)
+            self._inflight += size
+        try:
+            return api.write(**kwargs)
+        except Exception as e:
+            return Result.error(message = str(e))
+        finally:
+            with self._cond:
+                self._inflight -= size
+                self._cond.notify_all()
+
+def _file_size(kwargs):
+    data = kwargs.get("data")
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        return len(data)
+    try:
+        return os.path.getsize(kwargs.get("file_path", ""))
+    except OSError:
+        return 0
+
+def file_chunks(file_path, chunk_size = None, offset = 0):
+    ''' the content of file_path from offset in chunks of chunk_size bytes
+
+    Every write() streams its file through here. Each chunk is a fresh bytes
+    object, protobuf bytes fields take nothing else and copy it into the
+    message anyway. Without chunk_size the size is UPLOAD_CHUNK_SIZE, or tuned
+    per chunk if CSST_DFS_UPLOAD_ADAPTIVE=1, see AdaptiveChunkSize.
+    '''
+    sizes = chunk_sizes(chunk_size)
+    try:
+        with open(file_path, 'rb') as f:
+            f.seek(offset)
+            for size in sizes:
+                data = f.read(size)
+                if not data:
+                    break
+                yield data
+    finally:
+        sizes.close()
+
+def data_chunks(data, chunk_size = None):
+    ''' the content of the data argument of write() in chunks of chunk_size bytes
+
+    data is bytes, a binary file-like object or an astropy HDUList. An HDUList
+    is written as FITS by a background thread straight into the chunks, at
+    most a few chunks ahead of the stream, so no temp file or full copy of the
+    serialized file is made.
+    '''
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        view = memoryview(data).cast("B")
+        sizes = chunk_sizes(chunk_size)
+        try:
+            i = 0
+            for size in sizes:
+                if i >= len(view):
+                    break
+                yield bytes(view[i:i + size])
+                i += size
+        finally:
+            sizes.close()
+    elif hasattr(data, "writeto"):
+        yield from _fits_chunks(data, chunk_size or UPLOAD_CHUNK_SIZE)
+    elif hasattr(data, "read"):
+        sizes = chunk_sizes(chunk_size)
+        try:
+            for size in sizes:
+                chunk = data.read(size)
+                if not chunk:
+                    break
+                yield bytes(chunk)
+        finally:
+            sizes.close()
+    else:
+        raise TypeError("data must be bytes, a binary file-like object or an HDUList, not %s" % (type(data).__name__, ))
+
+class _ChunkWriter(io.RawIOBase):
+    ''' write-only file object that passes what is written on in chunks through a bounded queue '''
+    def __init__(self, chunk_size, depth = 4):
+        self.chunk_size = chunk_size
+        self.chunks = queue.Queue(maxsize = depth)
+        self.buf = bytearray()
+        self.pos = 0
+        self.stopped = False
+
+    def writable(self):
+        return True
+
+    def tell(self):
+        return self.pos
+
+    def write(self, b):
+        if self.stopped:
+            raise IOError("the upload stream is closed")
+        n = len(memoryview(b).cast("B"))
+        self.buf += b
+        self.pos += n
+        while len(self.buf) >= self.chunk_size:
+            self.chunks.put(bytes(self.buf[:self.chunk_size]))
+            del self.buf[:self.chunk_size]
+        return n
+
+    def finish(self):
+        if self.buf:
+            self.chunks.put(bytes(self.buf))
+        self.chunks.put(None)
+
+def _fits_chunks(hdul, chunk_size):
+    writer = _ChunkWriter(chunk_size)
+    def run():
+        try:
+            hdul.writeto(writer)
+            writer.finish()
+        except BaseException as e:
+            writer.chunks.put(e)
+    thread = threading.Thread(target = run, daemon = True)
+    thread.start()
+    try:
+        while True:
+            chunk = writer.chunks.get()
+            if chunk is None:
+                break
+            if isinstance(chunk, BaseException):
+                raise chunk
+            yield chunk
+    finally:
+        # the stream stopped early: unblock the writer so the thread ends
+        writer.stopped = True
+        while thread.is_alive():
+            try:
+                writer.chunks.get(timeout = 0.1)
+            except queue.Empty:
+                pass
+
+def chunk_sizes(chunk_size = None):
+    ''' generator of the sizes of the chunks of one upload stream, chunk_size if it is given '''
+    if chunk_size is None:
+        if os.getenv("CSST_DFS_UPLOAD_ADAPTIVE", "0") == "1":
+            return adaptive_chunk_size().sizes()
+        chunk_size = UPLOAD_CHUNK_SIZE
+    return _fixed_sizes(chunk_size)
+
+def _fixed_sizes(chunk_size):
+    while True:
+        yield chunk_size
+
+class AdaptiveChunkSize(object):
+    ''' upload chunk size of a gateway, tuned to the time the chunks take to send
+
+    A client stream asks for its next message only when the previous one is
+    sent, so the time between two chunks is the send time of a chunk. The
+    throughput of each size is smoothed over ADAPTIVE_SAMPLES or more chunks,
+    single chunks often just land in the flow-control window. The size then
+    climbs to the faster of its halved and doubled neighbours, neither too
+    small, where per-message overhead dominates, nor too large, where the
+    messages stop pipelining; a size whose chunks take over
+    ADAPTIVE_SLOW_SECONDS is halved. The size stays within min_size and
+    max_size and is saved per gateway when a stream ends, so the next process
+    starts from it.
+
+    max_size must fit the max receive message size of the gateway.
+
+    :param gateway: default CSST_DFS_GATEWAY
+    :param min_size: default ADAPTIVE_MIN_CHUNK_SIZE
+    :param max_size: default CSST_DFS_UPLOAD_MAX_CHUNK_SIZE or 4 * UPLOAD_CHUNK_SIZE
+    :param path: the JSON file of the sizes, default ~/.csst_dfs/chunk_sizes.json
+    '''
+    def __init__(self, gateway = None, min_size = None, max_size = None, path = None):
+        self.gateway = gateway or os.getenv("CSST_DFS_GATEWAY", "")
+        self.min_size = min_size or ADAPTIVE_MIN_CHUNK_SIZE
+        self.max_size = max(self.min_size, max_size or int(os.getenv("CSST_DFS_UPLOAD_MAX_CHUNK_SIZE", 4 * UPLOAD_CHUNK_SIZE)))
+        self.path = path or os.path.expanduser("~/.csst_dfs/chunk_sizes.json")
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self.costs = {}
+        self.chunks = 0
+        self.size = self._clamp(self._load().get(self.gateway, UPLOAD_CHUNK_SIZE))
+
+    def _clamp(self, size):
+        return min(max(int(size), self.min_size), self.max_size)
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def save(self):
+        with self._save_lock:
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok = True)
+                sizes = self._load()
+                sizes[self.gateway] = self.size
+                tmp = "%s.%d.tmp" % (self.path, os.getpid())
+                with open(tmp, 'w') as f:
+                    json.dump(sizes, f)
+                os.replace(tmp, self.path)
+            except OSError as e:
+                log.warning("can't save the upload chunk size: %s", e)
+
+    def tune(self, size, seconds):
+        ''' adjust the size after a chunk of size bytes took seconds to send '''
+        with self._lock:
+            # smoothing the time per byte rather than the rate keeps chunks that
+            # only filled the window from counting for more than they took
+            cost = seconds / max(size, 1)
+            old, n = self.costs.get(size, (cost, 0))
+            self.costs[size] = ((1 - ADAPTIVE_SMOOTHING) * old + ADAPTIVE_SMOOTHING * cost, n + 1)
+            self.chunks += 1
+            if self.chunks % ADAPTIVE_EXPLORE_CHUNKS == 0:
+                # forget the neighbours now and then, the link may have changed
+                self.costs = {size: self.costs[size]}
+            self.size = self._next_size()
+
+    def _next_size(self):
+        size = self.size
+        cost, n = self.costs.get(size, (0, 0))
+        smaller, larger = self._clamp(size // 2), self._clamp(size * 2)
+        if n >= 2 and size * cost > ADAPTIVE_SLOW_SECONDS and smaller < size:
+            return smaller
+        if n < ADAPTIVE_SAMPLES:
+            return size
+        for other in (larger, smaller):
+            if other != size and other not in self.costs:
+                return other
+        best = size
+        for other in (smaller, larger):
+            if other in self.costs and other * self.costs[other][0] <= ADAPTIVE_SLOW_SECONDS \
+                    and self.costs[other][0] * ADAPTIVE_MIN_GAIN < self.costs[best][0]:
+                best = other
+        return best
+
+    def sizes(self):
+        ''' generator of the chunk sizes of one stream, each tuned by the time the one before took '''
+        last = None
+        sent = 0
+        try:
+            while True:
+                now = time.monotonic()
+                if last is not None:
+                    sent += size
+                    # the first chunks only fill the empty flow-control window
+                    if sent > ADAPTIVE_WARMUP_BYTES:
+                        self.tune(size, now - last)
+                size = self.size
+                last = now
+                yield size
+        finally:
+            if last is not None:
+                self.save()
+
+_adaptive = {}
+
+def adaptive_chunk_size():
+    ''' the AdaptiveChunkSize of the current gateway, shared by the streams of the process '''
+    gateway = os.getenv("CSST_DFS_GATEWAY", "")
+    if gateway not in _adaptive:
+        _adaptive[gateway] = AdaptiveChunkSize(gateway)
+    return _adaptive[gateway]
+
+def upload_requests(req_type, rec, chunks, record_once = None):
+    ''' the request messages of an upload stream
+
+    Every message carries the record by default, as the Write servers have
+    always read it. With record_once, or CSST_DFS_UPLOAD_RECORD_ONCE=1 if it is
+    None, only the first message carries it and the rest just the data, for
+    servers that take the record from the first message.
+
+    :param req_type: the request message class, like level1_pb2.WriteLevel1Req
+    :param rec: the record message
+    :param chunks: iterable of the data chunks
+    '''
+    if record_once is None:
+        record_once = os.getenv("CSST_DFS_UPLOAD_RECORD_ONCE", "0") == "1"
+    for i, data in enumerate(chunks):
+        if i == 0 or not record_once:
+            yield req_type(record = rec, data = data)
+        else:
+            yield req_type(data = data)
+
+_END = object()
+
+async def aio_requests(requests):
+    ''' the request messages of an upload stream as an async iterator, for the grpc.aio stubs
+
+    Every message is built on the default executor, so reading the file or
+    waiting for the FITS writer thread never blocks the event loop.
+
+    :param requests: iterator of the request messages, like upload_requests(...)
+    '''
+    loop = asyncio.get_running_loop()
+    it = iter(requests)
+    while True:
+        req = await loop.run_in_executor(None, next, it, _END)
+        if req is _END:
+            return
+        yield req
+
+UPLOAD_DOC = '''            data: [bytes|file|HDUList] the file content in memory instead of file_path, needs filename; not retried
+            retries: [int] retries of a file upload that broke off with a transient error before its last chunk, each sends the file from the start, default 0
+            record_once: [bool] send the record in the first message only, default CSST_DFS_UPLOAD_RECORD_ONCE or False
+'''
+UPLOAD_DEDUP_DOC = '''            dedup: [bool] skip the transfer if the same file was uploaded for the same product before, default False
+'''
+
+def with_upload_doc(dedup = False):
+    ''' method decorator adding the kwargs that write_upload handles to the
+    parameter kwargs of the docstring of a write() '''
+    def decorate(write):
+        head, sep, tail = write.__doc__.partition("\n        return ")
+        write.__doc__ = head.rstrip() + "\n" + UPLOAD_DOC + (UPLOAD_DEDUP_DOC if dedup else "") + "\n" + sep.lstrip("\n") + tail
+        return write
+    return decorate
+
+class _Upload(object):
+    ''' the steps of write_upload shared by the sync and the aio one '''
+    def __init__(self, kwargs, rec, req_type, kind, dedup_key):
+        self.rec = rec
+        self.req_type = req_type
+        self.kind = kind
+        self.dedup_key = dedup_key
+        self.data = get_parameter(kwargs, "data")
+        self.record_once = get_parameter(kwargs, "record_once")
+        self.retries = get_parameter(kwargs, "retries", 0) if self.data is None else 0
+        self.dedup = kind is not None and get_parameter(kwargs, "dedup", False)
+        self.digest = None
+
+    def check(self):
+        ''' the error Result if there is nothing to upload, fills in the filename of a file_path '''
+        rec = self.rec
+        if self.data is not None:
+            if not rec.filename:
+                return Result.error(message="filename is blank")
+            return None
+        if not rec.file_path:
+            return Result.error(message="file_path is blank")
+        if not os.path.exists(rec.file_path):
+            return Result.error(message="the file [%s] not existed" % (rec.file_path, ))
+        if not rec.filename:
+            rec.filename = os.path.basename(rec.file_path)
+        return None
+
+    def requests(self, chunks):
+        return upload_requests(self.req_type, self.rec, chunks, self.record_once)
+
+    def chunks(self):
+        if self.data is not None:
+            return data_chunks(self.data)
+        return file_chunks(self.rec.file_path)
+
+    def uploaded(self, get):
+        self.digest = content_digest(self.rec.file_path, self.data)
+        return find_uploaded(self.kind, self.digest, self.rec.filename, self.dedup_key, get)
+
+    def result(self, resp, model):
+        if resp.success:
+            remember_upload(self.kind, self.digest, self.rec.filename, self.dedup_key, resp.record.id)
+        return written_result(model, resp)
+
+def write_upload(write, kwargs, rec, req_type, model, get = None, kind = None, dedup_key = None):
+    ''' the upload of a write(): stream the file of rec or the data argument to the Write RPC
+
+    Takes data, retries, record_once and dedup from kwargs, see with_upload_doc.
+    With dedup the transfer is skipped if the same content was uploaded for
+    the same product before, see dedup.find_uploaded; a retried upload goes
+    through retry.retry_write.
+
+    :param write: the Write method of the stub
+    :param kwargs: the kwargs of write()
+    :param rec: the record message, its filename is filled in from file_path
+    :param req_type: the request message class, like level1_pb2.WriteLevel1Req
+    :param model: the model class of the record in the Result
+    :param get: get(id) of the data API, for dedup
+    :param kind: the data API in the upload index, like "level1", None if it doesn't dedup
+    :param dedup_key: the record fields that identify the product, like (level0_id, data_type)
+    :returns: csst_dfs_common.models.Result
+    '''
+    upload = _Upload(kwargs, rec, req_type, kind, dedup_key)
+    error = upload.check()
+    if error is not None:
+        return error
+    try:
+        if upload.dedup:
+            uploaded = upload.uploaded(get)
+            if uploaded is not None:
+                return uploaded
+        send = lambda reqs: write.with_call(reqs, metadata = get_auth_headers())[0]
+        if upload.retries:
+            resp = retry.retry_write(send, upload.requests, rec.file_path, retries = upload.retries)
+        else:
+            resp = send(upload.requests(upload.chunks()))
+        return upload.result(resp, model)
+    except grpc.RpcError as e:
+        return Result.error(message="%s:%s" % (e.code().value, e.details()))
+
+async def aio_write_upload(write, kwargs, rec, req_type, model, get = None, kind = None, dedup_key = None):
+    ''' write_upload for the grpc.aio stubs, get is a coroutine function
+
+    The hashing and the upload index of dedup run on the default executor,
+    the request messages are built there too, see aio_requests.
+    '''
+    upload = _Upload(kwargs, rec, req_type, kind, dedup_key)
+    error = upload.check()
+    if error is not None:
+        return error
+    loop = asyncio.get_running_loop()
+    try:
+        if upload.dedup:
+            uploaded = await loop.run_in_executor(None, upload.uploaded,
+                lambda id: asyncio.run_coroutine_threadsafe(get(id), loop).result())
+            if uploaded is not None:
+                return uploaded
+        send = lambda reqs: write(aio_requests(reqs), metadata = get_auth_headers())
+        if upload.retries:
+            resp = await retry.aio_retry_write(send, upload.requests, rec.file_path, retries = upload.retries)
+        else:
+            resp = await send(upload.requests(upload.chunks()))
+        if upload.digest is None:
+            return upload.result(resp, model)
+        return await loop.run_in_executor(None, upload.result, resp, model)
+    except grpc.RpcError as e:
+        return Result.error(message="%s:%s" % (e.code().value, e.details()))
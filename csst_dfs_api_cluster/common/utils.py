@@ -1,9 +1,13 @@
 import os
 from datetime import datetime
 import time
+import asyncio
 import grpc
+from concurrent.futures import ThreadPoolExecutor
 
 from csst_dfs_commons.models import Result
+from csst_dfs_commons.models.common import from_proto_model_list
+from csst_dfs_commons.models.errors import CSSTFatalException
 from csst_dfs_proto.common.misc import misc_pb2, misc_pb2_grpc
 from .service import ServiceProxy
 
@@ -56,6 +60,178 @@ def singleton(cls):
 def get_auth_headers():
     return (("csst_dfs_app",os.getenv("CSST_DFS_APP_ID")),("csst_dfs_token",os.getenv("CSST_DFS_APP_TOKEN")),)
 
+# requests and results shared by the sync APIs and their grpc.aio mirrors,
+# which only differ in how they make the call
+
+def status_req(req_type, kwargs):
+    ''' the request of an update_*_status method that takes id and status '''
+    return req_type(id = get_parameter(kwargs, "id"), status = get_parameter(kwargs, "status"))
+
+def records_result(model, resp, total = True):
+    ''' the Result of a find response, the records as a list of model, with totalCount if total '''
+    if not resp.success:
+        return Result.error(message = str(resp.error.detail))
+    result = Result.ok_data(data = from_proto_model_list(model, resp.records))
+    return result.append("totalCount", resp.totalCount) if total else result
+
+def record_result(model, record, not_found = "data not found"):
+    ''' the Result of a get response, record is the record message of the response '''
+    if record is None or record.id == 0:
+        return Result.error(message = not_found)
+    return Result.ok_data(data = model().from_proto_model(record))
+
+def written_result(model, resp):
+    ''' the Result of a write response, the record stored as a model '''
+    if not resp.success:
+        return Result.error(message = str(resp.error.detail))
+    return Result.ok_data(data = model().from_proto_model(resp.record))
+
+def status_result(resp):
+    ''' the Result of an update response '''
+    if not resp.success:
+        return Result.error(message = str(resp.error.detail))
+    return Result.ok_data()
+
+def iter_by_time(find, time_field, time_param, page_size, **kwargs):
+    ''' yield the records of find() page by page, keyset-paginated on a time column
+
+    find must return the records ordered by time ascending, a page that isn't
+    raises CSSTFatalException, as the server then ignored order_by. The next page
+    starts at the latest time of a page before its last one. That holds
+    whether the server takes the start of the window as inclusive or exclusive:
+    either way no record after that time is missed, and the ones refetched are
+    skipped by id. If a page doesn't get past its start, because one time
+    fills it, the next one is twice as long; the size is reset once past.
+
+    :param find: the find method of an API, called with order_by, limit and time_param
+    :param time_field: the record attribute holding the time, like 'create_time'
+    :param time_param: the find parameter of the (start, end) time window, like 'create_time'
+    :param page_size: number of records fetched per call, > 0
+    :param kwargs: the other find parameters, limit caps the total number of records
+    '''
+    if not isinstance(page_size, int) or page_size <= 0:
+        raise ValueError("page_size must be a positive int, not %r" % (page_size, ))
+    return _iter_by_time(find, time_field, time_param, page_size, **kwargs)
+
+def _iter_by_time(find, time_field, time_param, page_size, **kwargs):
+    start, end = get_parameter(kwargs, time_param, [None, None])
+    limit = get_parameter(kwargs, "limit", 0)
+    kwargs = {k: v for k, v in kwargs.items() if k not in (time_param, "limit", "order_by")}
+    size = page_size
+    # time of the records yielded at or after start, by id
+    seen = {}
+    count = 0
+    while True:
+        result = find(order_by = "%s asc" % (time_field, ), limit = size, **{time_param: (start, end)}, **kwargs)
+        if not result.success:
+            raise CSSTFatalException(result.message)
+        records = result.data
+        times = [getattr(rec, time_field) for rec in records]
+        if any(t < prev for prev, t in zip(times, times[1:])):
+            raise CSSTFatalException("the records are not ordered by %s, order_by isn't supported by the server" % (time_field, ))
+        for rec in records:
+            if rec.id in seen:
+                continue
+            seen[rec.id] = getattr(rec, time_field)
+            yield rec
+            count += 1
+            if limit and count >= limit:
+                return
+        if len(records) < size:
+            return
+        last = times[-1]
+        before = [t for t in times if t < last]
+        if before and max(before) != start:
+            start = max(before)
+            seen = {id: t for id, t in seen.items() if t >= start}
+            size = page_size
+        else:
+            size *= 2
+
+def _update_kwargs(item):
+    if isinstance(item, dict):
+        return item
+    id, status = item
+    return {"id": id, "status": status}
+
+def _update_many_result(results):
+    failed = sum(1 for r in results if not r.success)
+    return Result.ok_data(data = results).append("failed", failed)
+
+def update_many(update, items, max_workers = None):
+    ''' call a status update method for many records concurrently
+
+    The calls are unary RPCs multiplexed over the shared channel, so a batch
+    costs a few round trips instead of one per record.
+
+    :param update: the single-record method, like Level1DataApi().update_proc_status
+    :param items: (id, status) pairs, or dicts of the kwargs of update
+    :param max_workers: number of calls in flight, default CSST_DFS_UPDATE_WORKERS or 16
+    :returns: csst_dfs_common.models.Result, data is the list of the Results of
+        update in the order of items, with failed, the number of failed updates;
+        an exception of a call is the error Result of its item
+    '''
+    items = [_update_kwargs(item) for item in items]
+    if not items:
+        return _update_many_result([])
+    def call(kwargs):
+        try:
+            return update(**kwargs)
+        except Exception as e:
+            return Result.error(message = str(e))
+    max_workers = max_workers or int(os.getenv("CSST_DFS_UPDATE_WORKERS", 16))
+    try:
+        with ThreadPoolExecutor(max_workers = min(max_workers, len(items))) as pool:
+            results = list(pool.map(call, items))
+    except RuntimeError:
+        # no new pool threads once the interpreter exits, like for the
+        # StatusBuffer flush at exit: make the calls one after the other
+        results = [call(kwargs) for kwargs in items]
+    return _update_many_result(results)
+
+async def update_many_async(update, items, max_workers = None):
+    ''' update_many for the async APIs, update is a coroutine method '''
+    items = [_update_kwargs(item) for item in items]
+    sem = asyncio.Semaphore(max_workers or int(os.getenv("CSST_DFS_UPDATE_WORKERS", 16)))
+    async def call(kwargs):
+        async with sem:
+            try:
+                return await update(**kwargs)
+            except Exception as e:
+                return Result.error(message = str(e))
+    results = await asyncio.gather(*[call(kwargs) for kwargs in items])
+    return _update_many_result(list(results))
+
+UPDATE_MANY_DOC = ''' %s of many records concurrently
+
+        parameter items: list of (id, status), or of dicts of the kwargs of %s
+        parameter kwargs:
+            max_workers: [int] number of calls in flight, default CSST_DFS_UPDATE_WORKERS or 16
+
+        return csst_dfs_common.models.Result, data is the list of the Results per item
+        '''
+
+def with_update_many(cls):
+    ''' class decorator adding update_*_status_many(items, **kwargs) for every
+    update_*_status method of cls, through update_many or update_many_async '''
+    for name, update in list(vars(cls).items()):
+        if name.startswith("update_") and name.endswith("_status") and callable(update):
+            setattr(cls, name + "_many", _update_many_method(cls, name, update))
+    return cls
+
+def _update_many_method(cls, name, update):
+    if asyncio.iscoroutinefunction(update):
+        async def many(self, items, **kwargs):
+            return await update_many_async(getattr(self, name), items, get_parameter(kwargs, "max_workers"))
+    else:
+        def many(self, items, **kwargs):
+            return update_many(getattr(self, name), items, get_parameter(kwargs, "max_workers"))
+    many.__name__ = name + "_many"
+    many.__qualname__ = "%s.%s" % (cls.__qualname__, many.__name__)
+    summary = (update.__doc__ or name).strip().splitlines()[0].strip()
+    many.__doc__ = UPDATE_MANY_DOC % (summary, name)
+    return many
+
 def get_nextId_by_prefix(prefix):
     stub = misc_pb2_grpc.MiscSrvStub(ServiceProxy().channel())
     try:
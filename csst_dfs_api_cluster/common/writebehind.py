@@ -0,0 +1,320 @@
+import os
+import re
+import atexit
+import json
+import time
+import socket
+import inspect
+import logging
+import sqlite3
+import importlib
+import itertools
+import threading
+import weakref
+from datetime import date, datetime
+
+from csst_dfs_commons.models import Result
+
+from .utils import format_date, format_datetime, update_many
+
+log = logging.getLogger('csst')
+
+# the arguments that pick the record of an update, updates with the same ones are coalesced
+RECORD_KEYS = ("id", "level0_id", "obs_type", "obs_id", "data_type")
+WRITE_BEHIND_BATCH_SIZE = 500
+WRITE_BEHIND_MAX_ATTEMPTS = 5
+WRITE_BEHIND_BACKOFF = 1.0
+# seconds the buffers still open at exit get to send their updates, in all
+WRITE_BEHIND_EXIT_TIMEOUT = float(os.getenv("CSST_DFS_WRITE_BEHIND_EXIT_TIMEOUT", 10))
+
+# <host>-<pid>-<n>.db, and .adopt while the journal of a dead process is taken over
+_JOURNAL_NAME = re.compile(r"^(.+)-(\d+)-(\d+)\.db(\.adopt)?$")
+_journal_ids = itertools.count()
+_open_journals = set()
+_journals_lock = threading.Lock()
+_live_buffers = weakref.WeakSet()
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def _json_default(obj):
+    if isinstance(obj, datetime):
+        return format_datetime(obj)
+    if isinstance(obj, date):
+        return format_date(obj)
+    if hasattr(obj, "tolist"):
+        # numpy scalars and arrays
+        return obj.tolist()
+    raise TypeError("%s is not JSON serializable" % (type(obj).__name__, ))
+
+class StatusBuffer(object):
+    ''' write-behind queue of status updates, journaled in a local SQLite file
+
+    update() appends the call to the journal and returns at once; a background
+    thread sends the journal in batches every flush_interval seconds. Of the
+    updates of one record by one method only the latest is sent, as if they
+    had been sent one after the other. A failed update is retried with
+    exponential backoff, up to WRITE_BEHIND_MAX_ATTEMPTS times, and then
+    dropped; flush() reports it.
+
+        buf = StatusBuffer()
+        buf.update(Level1DataApi().update_proc_status, id = 1, status = 2)
+        ...
+        buf.flush()
+
+    Every buffer has a journal of its own in journal_dir, named after the host
+    and the pid. The journals of dead processes of the same host are taken
+    over and sent by the next buffer created there; journals of other hosts
+    are left to them, so journal_dir may be shared, but a local disk is
+    better, SQLite locking is not reliable on NFS.
+
+    The sending thread is a daemon, it doesn't keep the process alive. The
+    buffers not closed by then are flushed at exit, for at most
+    WRITE_BEHIND_EXIT_TIMEOUT seconds in all; what is not sent by then stays
+    in the journal, as after a crash. Call close() to wait for all of it.
+
+    The methods are called with keyword arguments only and must be reachable
+    from a fresh instance of their API class, which is how they are replayed.
+    datetime arguments are sent formatted, numpy values as Python ones.
+
+    :param journal_dir: default CSST_DFS_WRITE_BEHIND_DIR or ~/.csst_dfs/status
+    :param flush_interval: seconds between the sends, default 1
+    :param batch_size: updates sent per pass, default WRITE_BEHIND_BATCH_SIZE
+    :param max_workers: calls in flight while sending, see update_many
+    '''
+    def __init__(self, journal_dir = None, flush_interval = 1.0, batch_size = WRITE_BEHIND_BATCH_SIZE, max_workers = None):
+        self.journal_dir = journal_dir or os.getenv("CSST_DFS_WRITE_BEHIND_DIR", os.path.expanduser("~/.csst_dfs/status"))
+        os.makedirs(self.journal_dir, exist_ok = True)
+        self.host = socket.gethostname()
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_workers = max_workers
+        with _journals_lock:
+            self.path = os.path.join(self.journal_dir, "%s-%d-%d.db" % (self.host, os.getpid(), next(_journal_ids)))
+            _open_journals.add(self.path)
+            self._db = sqlite3.connect(self.path, timeout = 30, check_same_thread = False, isolation_level = None)
+            # no other connection ever opens the journal, so WAL can go without the shared memory file
+            self._db.execute("PRAGMA locking_mode=EXCLUSIVE")
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS updates (seq INTEGER PRIMARY KEY AUTOINCREMENT, "
+                "target TEXT, method TEXT, record TEXT, kwargs TEXT, attempts INTEGER DEFAULT 0, next_attempt REAL DEFAULT 0)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS updates_record ON updates (target, method, record)")
+            for orphan in self._orphans():
+                self._adopt(orphan)
+        self._lock = threading.Lock()
+        self._cond = threading.Condition()
+        self._wake = threading.Event()
+        self._closed = False
+        self._apis = {}
+        self._errors = []
+        self._thread = threading.Thread(target = self._run, name = "csst-dfs-write-behind", daemon = True)
+        self._thread.start()
+        _live_buffers.add(self)
+
+    def _orphans(self):
+        ''' the journals in journal_dir of the processes of this host that are gone '''
+        for name in sorted(os.listdir(self.journal_dir)):
+            m = _JOURNAL_NAME.match(name)
+            if not m or m.group(1) != self.host:
+                continue
+            path = os.path.join(self.journal_dir, name)
+            pid = int(m.group(2))
+            if pid == os.getpid():
+                # left by an earlier process with the same pid, unless a buffer of this one has it
+                own = path[:-len(".adopt")] if m.group(4) else path
+                if own not in _open_journals:
+                    yield path
+            elif not _alive(pid):
+                yield path
+
+    def _adopt(self, orphan):
+        ''' move the updates of the journal of a dead process into this one '''
+        claimed = self.path + ".adopt"
+        try:
+            # the rename is atomic, of the buffers started at the same time only one gets the journal
+            os.rename(orphan, claimed)
+        except OSError:
+            return
+        if os.path.exists(orphan + "-wal"):
+            os.replace(orphan + "-wal", claimed + "-wal")
+        try:
+            self._db.execute("ATTACH DATABASE ? AS orphan", (claimed, ))
+            try:
+                self._db.execute("BEGIN")
+                n = self._db.execute("INSERT INTO updates (target, method, record, kwargs, attempts) "
+                    "SELECT target, method, record, kwargs, attempts FROM orphan.updates ORDER BY seq").rowcount
+                self._db.execute("COMMIT")
+            except sqlite3.Error:
+                if self._db.in_transaction:
+                    self._db.execute("ROLLBACK")
+                raise
+            finally:
+                self._db.execute("DETACH DATABASE orphan")
+        except sqlite3.Error as e:
+            log.error("can't take over the status journal %s, left as %s: %s", orphan, claimed, e)
+            return
+        for f in (claimed, claimed + "-wal"):
+            if os.path.exists(f):
+                os.remove(f)
+        if n:
+            log.info("took over %d status updates of %s", n, orphan)
+
+    def update(self, method, **kwargs):
+        ''' journal a call of method(**kwargs), like Level1DataApi().update_proc_status
+
+        return csst_dfs_common.models.Result, ok once the update is journaled
+        '''
+        if not inspect.ismethod(method) or inspect.iscoroutinefunction(method):
+            return Result.error(message = "the status buffer takes the update methods of the API objects, not of the aio ones")
+        api = method.__self__
+        target = "%s:%s" % (type(api).__module__, type(api).__qualname__)
+        record = {k: kwargs[k] for k in RECORD_KEYS if k in kwargs}
+        try:
+            record = json.dumps(record, sort_keys = True, default = _json_default) if record else None
+            kwargs = json.dumps(kwargs, default = _json_default)
+        except (TypeError, ValueError) as e:
+            return Result.error(message = "can't journal the status update: %s" % (e, ))
+        with self._lock:
+            if self._closed:
+                return Result.error(message = "the status buffer is closed")
+            self._apis.setdefault(target, api)
+            self._db.execute("INSERT INTO updates (target, method, record, kwargs) VALUES (?, ?, ?, ?)",
+                (target, method.__name__, record, kwargs))
+        return Result.ok_data()
+
+    def pending(self):
+        ''' number of journaled updates not sent yet '''
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM updates").fetchone()[0]
+
+    def flush(self, timeout = None):
+        ''' send the updates journaled so far and wait for them
+
+        return csst_dfs_common.models.Result, an error listing the updates
+            dropped since the last flush, or if timeout seconds passed first
+        '''
+        with self._lock:
+            barrier = self._db.execute("SELECT MAX(seq) FROM updates").fetchone()[0] or 0
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._has_before(barrier):
+                self._wake.set()
+                wait = self.flush_interval if deadline is None else min(self.flush_interval, deadline - time.monotonic())
+                if wait <= 0:
+                    return Result.error(message = "flush timed out, %d status updates pending" % (self.pending(), ))
+                self._cond.wait(wait)
+            errors, self._errors = self._errors, []
+        if errors:
+            return Result.error(message = "%d status updates failed: %s" % (len(errors), errors[0][2])).append("failed", errors)
+        return Result.ok_data()
+
+    def close(self, timeout = None):
+        ''' flush and stop the background thread
+
+        What is left stays in the journal, for the next buffer on this host
+        once the process is gone; an empty journal is removed.
+        '''
+        _live_buffers.discard(self)
+        result = self.flush(timeout)
+        with self._lock:
+            self._closed = True
+        self._wake.set()
+        self._thread.join()
+        empty = self.pending() == 0
+        self._db.close()
+        if empty:
+            for f in (self.path, self.path + "-wal"):
+                if os.path.exists(f):
+                    os.remove(f)
+        with _journals_lock:
+            _open_journals.discard(self.path)
+        return result
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _has_before(self, seq):
+        with self._lock:
+            return self._db.execute("SELECT 1 FROM updates WHERE seq <= ? LIMIT 1", (seq, )).fetchone() is not None
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            with self._lock:
+                if self._closed:
+                    return
+            try:
+                while self._send_batch():
+                    pass
+            except Exception as e:
+                log.error("write-behind status flush failed: %s", e)
+            with self._cond:
+                self._cond.notify_all()
+
+    def _send_batch(self):
+        ''' send the latest update of up to batch_size records, True if there may be more '''
+        with self._lock:
+            # the latest update of each record, unless it waits for its retry
+            batch = self._db.execute("SELECT u.seq, u.target, u.method, u.record, u.kwargs, u.attempts FROM "
+                "(SELECT MAX(seq) AS seq, MIN(seq) AS first FROM updates GROUP BY target, method, IFNULL(record, seq)) AS latest "
+                "JOIN updates AS u ON u.seq = latest.seq WHERE u.next_attempt <= ? ORDER BY latest.first LIMIT ?",
+                (time.time(), self.batch_size)).fetchall()
+        if not batch:
+            return False
+        groups = {}
+        for row in batch:
+            groups.setdefault((row[1], row[2]), []).append(row)
+        for (target, method), rows in groups.items():
+            try:
+                update = getattr(self._api(target), method)
+                results = update_many(update, [json.loads(row[4]) for row in rows], self.max_workers).data
+            except Exception as e:
+                results = [Result.error(message = str(e))] * len(rows)
+            with self._lock:
+                for (seq, _, _, record, kwargs, attempts), result in zip(rows, results):
+                    if result.success or attempts + 1 >= WRITE_BEHIND_MAX_ATTEMPTS:
+                        if not result.success:
+                            log.error("dropped the status update %s.%s(%s): %s", target, method, kwargs, result.message)
+                            self._errors.append((method, json.loads(kwargs), result.message))
+                        # the older updates of the record are superseded by this one
+                        self._db.execute("DELETE FROM updates WHERE target = ? AND method = ? AND seq <= ? AND "
+                            "(record = ? OR seq = ?)", (target, method, seq, record, seq))
+                    else:
+                        self._db.execute("UPDATE updates SET attempts = ?, next_attempt = ? WHERE seq = ?",
+                            (attempts + 1, time.time() + WRITE_BEHIND_BACKOFF * 2 ** attempts, seq))
+        return len(batch) == self.batch_size
+
+    def _api(self, target):
+        if target not in self._apis:
+            module, cls = target.split(":")
+            self._apis[target] = getattr(importlib.import_module(module), cls)()
+        return self._apis[target]
+
+def _flush_at_exit():
+    # the sending threads are daemons, they are stopped as they are when the
+    # interpreter exits; give the open buffers a bounded time to finish, and
+    # close the ones that did, which removes their empty journals
+    deadline = time.monotonic() + WRITE_BEHIND_EXIT_TIMEOUT
+    for buf in list(_live_buffers):
+        result = buf.flush(max(0, deadline - time.monotonic()))
+        if result.success:
+            buf.close()
+        else:
+            log.warning("status updates of %s not sent at exit: %s", buf.path, result.message)
+
+# registered after service.close_channels, so it runs before the channels are closed
+atexit.register(_flush_at_exit)
+if hasattr(os, "register_at_fork"):
+    # the buffers of the parent have no sending thread in a forked child
+    os.register_at_fork(after_in_child = _live_buffers.clear)
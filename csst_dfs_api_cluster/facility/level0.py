@@ -1,7 +1,6 @@
 import grpc
 
 from csst_dfs_commons.models import Result
-from csst_dfs_commons.models.common import from_proto_model_list
 from csst_dfs_commons.models.facility import Level0Record
 
 from csst_dfs_proto.facility.level0 import level0_pb2, level0_pb2_grpc
@@ -9,6 +8,7 @@ from csst_dfs_proto.facility.level0 import level0_pb2, level0_pb2_grpc
 from ..common.service import ServiceProxy
 from ..common.utils import *
 
+@with_update_many
 class Level0DataApi(object):
     def __init__(self):
         self.stub = level0_pb2_grpc.Level0SrvStub(ServiceProxy().channel())
@@ -31,39 +31,29 @@ class Level0DataApi(object):
             radius: [float],
             object_name: [str],
             version: [str],
+            order_by: [str], like 'obs_time asc'
             limit: limits returns the number of records,default 0:no-limit
 
         return: csst_dfs_common.models.Result
         '''
         try:
-            resp, _ =  self.stub.Find.with_call(level0_pb2.FindLevel0DataReq(
-                obs_id = get_parameter(kwargs, "obs_id"),
-                detector_no = get_parameter(kwargs, "detector_no"),
-                module_id = get_parameter(kwargs, "module_id"),
-                obs_type = get_parameter(kwargs, "obs_type"),
-                exp_time_start = get_parameter(kwargs, "obs_time", [None, None])[0],
-                exp_time_end = get_parameter(kwargs, "obs_time", [None, None])[1],
-                qc0_status = get_parameter(kwargs, "qc0_status", 1024),
-                prc_status = get_parameter(kwargs, "prc_status", 1024),
-                file_name = get_parameter(kwargs, "file_name"),
-                ra_obj  = get_parameter(kwargs, "ra_obj", None),
-                dec_obj = get_parameter(kwargs, "dec_obj", None),
-                radius = get_parameter(kwargs, "radius", 0),
-                object_name = get_parameter(kwargs, "object_name", None),
-                version = get_parameter(kwargs, "version", None),
-                filter = get_parameter(kwargs, "filter", None),
-                limit = get_parameter(kwargs, "limit", 0),
-                other_conditions = {"test":"cnlab.test"}
-            ),metadata = get_auth_headers())
-
-            if resp.success:
-                return Result.ok_data(data=from_proto_model_list(Level0Record, resp.records)).append("totalCount", resp.totalCount)
-            else:
-                return Result.error(message = str(resp.error.detail))
-
+            resp, _ =  self.stub.Find.with_call(find_req(kwargs),metadata = get_auth_headers())
+            return records_result(Level0Record, resp)
         except grpc.RpcError as e:
             return Result.error(message="%s:%s" % (e.code().value, e.details()))
 
+    def iter_find(self, page_size = 1000, **kwargs):
+        ''' iterate over level0 records, fetched page by page in obs_time order
+
+        parameter kwargs: same as find, limit caps the total number of records
+            page_size: number of records per request, default 1000
+
+        return: generator of csst_dfs_common.models.facility.Level0Record,
+            raises CSSTFatalException when a page can't be fetched,
+            ValueError if page_size isn't a positive int
+        '''
+        return iter_by_time(self.find, "obs_time", "obs_time", page_size, **kwargs)
+
     def find_by_brick_ids(self, **kwargs):
         ''' retrieve level0 records by brick_ids like [1,2,3,4]
 
@@ -73,15 +63,8 @@ class Level0DataApi(object):
         return: csst_dfs_common.models.Result
         '''
         try:
-            resp, _ =  self.stub.FindByBrickIds.with_call(level0_pb2.FindByBrickIdsReq(
-                brick_ids = get_parameter(kwargs, "brick_ids", [])
-            ),metadata = get_auth_headers())
-
-            if resp.success:
-                return Result.ok_data(data=from_proto_model_list(Level0Record, resp.records))
-            else:
-                return Result.error(message = str(resp.error.detail))
-
+            resp, _ =  self.stub.FindByBrickIds.with_call(find_by_brick_ids_req(kwargs),metadata = get_auth_headers())
+            return records_result(Level0Record, resp, total = False)
         except grpc.RpcError as e:
             return Result.error(message="%s:%s" % (e.code().value, e.details()))
 
@@ -96,19 +79,10 @@ class Level0DataApi(object):
         return csst_dfs_common.models.Result
         '''
         try:
-            resp, _ =  self.stub.Get.with_call(level0_pb2.GetLevel0DataReq(
-                id = get_parameter(kwargs, "id"),
-                level0_id = get_parameter(kwargs, "level0_id"),
-                obs_type = get_parameter(kwargs, "obs_type")
-            ),metadata = get_auth_headers())
-
-            if resp.record is None or resp.record.id == 0:
-                return Result.error(message=f"not found")  
-
-            return Result.ok_data(data = Level0Record().from_proto_model(resp.record))
-           
+            resp, _ =  self.stub.Get.with_call(get_req(kwargs),metadata = get_auth_headers())
+            return record_result(Level0Record, resp.record, "not found")
         except grpc.RpcError as e:
-            return Result.error(message="%s:%s" % (e.code().value, e.details()))   
+            return Result.error(message="%s:%s" % (e.code().value, e.details()))
 
     def update_proc_status(self, **kwargs):
         ''' update the status of reduction
@@ -121,21 +95,9 @@ class Level0DataApi(object):
 
         return csst_dfs_common.models.Result
         '''
-        status = get_parameter(kwargs, "status")
         try:
-            resp,_ = self.stub.UpdateProcStatus.with_call(
-                level0_pb2.UpdateProcStatusReq(
-                    id = get_parameter(kwargs, "id"),
-                    level0_id = get_parameter(kwargs, "level0_id"),
-                    obs_type = get_parameter(kwargs, "obs_type"),
-                    status=get_parameter(kwargs, "status")
-                ),
-                metadata = get_auth_headers()
-            )
-            if resp.success:
-                return Result.ok_data()
-            else:
-                return Result.error(message = str(resp.error.detail))
+            resp,_ = self.stub.UpdateProcStatus.with_call(update_req(level0_pb2.UpdateProcStatusReq, kwargs), metadata = get_auth_headers())
+            return status_result(resp)
         except grpc.RpcError as e:
             return Result.error(message="%s:%s" % (e.code().value, e.details()))
 
@@ -150,19 +112,8 @@ class Level0DataApi(object):
         '''        
 
         try:
-            resp,_ = self.stub.UpdateQc0Status.with_call(
-                level0_pb2.UpdateQc0StatusReq( 
-                    id = get_parameter(kwargs, "id"),
-                    level0_id = get_parameter(kwargs, "level0_id"),
-                    obs_type = get_parameter(kwargs, "obs_type"),
-                    status=get_parameter(kwargs, "status")
-                ),
-                metadata = get_auth_headers()
-            )
-            if resp.success:
-                return Result.ok_data()
-            else:
-                return Result.error(message = str(resp.error.detail))
+            resp,_ = self.stub.UpdateQc0Status.with_call(update_req(level0_pb2.UpdateQc0StatusReq, kwargs), metadata = get_auth_headers())
+            return status_result(resp)
         except grpc.RpcError as e:
             return Result.error(message="%s:%s" % (e.code().value, e.details()))
 
@@ -180,26 +131,66 @@ class Level0DataApi(object):
             file_path = [str]
         return: csst_dfs_common.models.Result
         '''          
-        rec = level0_pb2.Level0Record(
-            obs_id = get_parameter(kwargs, "obs_id"),
-            detector_no = get_parameter(kwargs, "detector_no"),
-            obs_type = get_parameter(kwargs, "obs_type"),
-            obs_time = get_parameter(kwargs, "obs_time"),
-            exp_time = get_parameter(kwargs, "exp_time"),
-            qc0_status = get_parameter(kwargs, "qc0_status", 0),
-            detector_status_id = get_parameter(kwargs, "detector_status_id"),
-            filename = get_parameter(kwargs, "filename"),
-            file_path = get_parameter(kwargs, "file_path")
-        )
-        req = level0_pb2.WriteLevel0DataReq(record = rec)
         try:
-            resp,_ = self.stub.Write.with_call(req, metadata = get_auth_headers())
-            if resp.success:
-                return Result.ok_data(data = Level0Record().from_proto_model(resp.record))
-            else:
-                return Result.error(message = str(resp.error.detail))
-    
+            resp,_ = self.stub.Write.with_call(write_req(kwargs), metadata = get_auth_headers())
+            return written_result(Level0Record, resp)
         except grpc.RpcError as e:
             return Result.error(message="%s:%s" % (e.code().value, e.details()))
 
-
+# the requests of the methods, shared with aio.AsyncLevel0DataApi
+
+def find_req(kwargs):
+    other_conditions = {"test":"cnlab.test"}
+    if get_parameter(kwargs, "order_by"):
+        other_conditions["orderBy"] = get_parameter(kwargs, "order_by")
+    return level0_pb2.FindLevel0DataReq(
+        obs_id = get_parameter(kwargs, "obs_id"),
+        detector_no = get_parameter(kwargs, "detector_no"),
+        module_id = get_parameter(kwargs, "module_id"),
+        obs_type = get_parameter(kwargs, "obs_type"),
+        exp_time_start = get_parameter(kwargs, "obs_time", [None, None])[0],
+        exp_time_end = get_parameter(kwargs, "obs_time", [None, None])[1],
+        qc0_status = get_parameter(kwargs, "qc0_status", 1024),
+        prc_status = get_parameter(kwargs, "prc_status", 1024),
+        file_name = get_parameter(kwargs, "file_name"),
+        ra_obj  = get_parameter(kwargs, "ra_obj", None),
+        dec_obj = get_parameter(kwargs, "dec_obj", None),
+        radius = get_parameter(kwargs, "radius", 0),
+        object_name = get_parameter(kwargs, "object_name", None),
+        version = get_parameter(kwargs, "version", None),
+        filter = get_parameter(kwargs, "filter", None),
+        limit = get_parameter(kwargs, "limit", 0),
+        other_conditions = other_conditions
+    )
+
+def find_by_brick_ids_req(kwargs):
+    return level0_pb2.FindByBrickIdsReq(brick_ids = get_parameter(kwargs, "brick_ids", []))
+
+def get_req(kwargs):
+    return level0_pb2.GetLevel0DataReq(
+        id = get_parameter(kwargs, "id"),
+        level0_id = get_parameter(kwargs, "level0_id"),
+        obs_type = get_parameter(kwargs, "obs_type")
+    )
+
+def update_req(req_type, kwargs):
+    return req_type(
+        id = get_parameter(kwargs, "id"),
+        level0_id = get_parameter(kwargs, "level0_id"),
+        obs_type = get_parameter(kwargs, "obs_type"),
+        status = get_parameter(kwargs, "status")
+    )
+
+def write_req(kwargs):
+    rec = level0_pb2.Level0Record(
+        obs_id = get_parameter(kwargs, "obs_id"),
+        detector_no = get_parameter(kwargs, "detector_no"),
+        obs_type = get_parameter(kwargs, "obs_type"),
+        obs_time = get_parameter(kwargs, "obs_time"),
+        exp_time = get_parameter(kwargs, "exp_time"),
+        qc0_status = get_parameter(kwargs, "qc0_status", 0),
+        detector_status_id = get_parameter(kwargs, "detector_status_id"),
+        filename = get_parameter(kwargs, "filename"),
+        file_path = get_parameter(kwargs, "file_path")
+    )
+    return level0_pb2.WriteLevel0DataReq(record = rec)
@@ -10,7 +10,9 @@ from csst_dfs_proto.facility.level1 import level1_pb2, level1_pb2_grpc
 
 from ..common.service import ServiceProxy
 from ..common.utils import *
+from ..common.upload import write_upload, with_upload_doc
 
+@with_update_many
 class Level1DataApi(object):
     """
     Level1 Data Operation Class
@@ -29,41 +31,29 @@ class Level1DataApi(object):
             qc1_status : [int],
             prc_status : [int],
             filename: [str]
+            order_by: [str], like 'create_time asc'
             limit: limits returns the number of records,default 0:no-limit
 
         return: csst_dfs_common.models.Result
         '''
         try:
-            resp, _ =  self.stub.Find.with_call(level1_pb2.FindLevel1Req(
-                obs_id = get_parameter(kwargs, "obs_id"),
-                level0_id = get_parameter(kwargs, "level0_id"),
-                module_id = get_parameter(kwargs, "module_id"),
-                data_type = get_parameter(kwargs, "data_type"),
-                create_time_start = get_parameter(kwargs, "create_time", [None, None])[0],
-                create_time_end = get_parameter(kwargs, "create_time", [None, None])[1],
-                qc1_status = get_parameter(kwargs, "qc1_status", 1024),
-                prc_status = get_parameter(kwargs, "prc_status", 1024),
-                filename = get_parameter(kwargs, "filename"),
-                limit = get_parameter(kwargs, "limit", 0),
-                pipeline_id = get_parameter(kwargs, "pipeline_id", ""),
-                detector_no = get_parameter(kwargs, "detector_no", ""),
-                filter = get_parameter(kwargs, "filter", ""),
-                object_name = get_parameter(kwargs, "object_name", ""),
-                other_conditions = {
-                    "ra_cen": str(get_parameter(kwargs, "ra_cen", '')),
-                    "dec_cen": str(get_parameter(kwargs, "dec_cen", '')),
-                    "radius_cen": str(get_parameter(kwargs, "radius_cen", ''))
-                }
-            ),metadata = get_auth_headers())
-
-            if resp.success:
-                return Result.ok_data(data=from_proto_model_list(Level1Record, resp.records)).append("totalCount", resp.totalCount)
-            else:
-                return Result.error(message = str(resp.error.detail))
-
+            resp, _ =  self.stub.Find.with_call(find_req(kwargs),metadata = get_auth_headers())
+            return records_result(Level1Record, resp)
         except grpc.RpcError as e:
             return Result.error(message="%s:%s" % (e.code().value, e.details()))
 
+    def iter_find(self, page_size = 1000, **kwargs):
+        ''' iterate over level1 records, fetched page by page in create_time order
+
+        parameter kwargs: same as find, limit caps the total number of records
+            page_size: number of records per request, default 1000
+
+        return: generator of csst_dfs_common.models.facility.Level1Record,
+            raises CSSTFatalException when a page can't be fetched,
+            ValueError if page_size isn't a positive int
+        '''
+        return iter_by_time(self.find, "create_time", "create_time", page_size, **kwargs)
+
     def find_by_brick_ids(self, **kwargs):
         ''' retrieve level1 records by brick_ids like [1,2,3,4]
 
@@ -73,15 +63,8 @@ class Level1DataApi(object):
         return: csst_dfs_common.models.Result
         '''
         try:
-            resp, _ =  self.stub.FindByBrickIds.with_call(level1_pb2.FindByBrickIdsReq(
-                brick_ids = get_parameter(kwargs, "brick_ids", [])
-            ),metadata = get_auth_headers())
-
-            if resp.success:
-                return Result.ok_data(data=from_proto_model_list(Level1Record, resp.records))
-            else:
-                return Result.error(message = str(resp.error.detail))
-
+            resp, _ =  self.stub.FindByBrickIds.with_call(find_by_brick_ids_req(kwargs),metadata = get_auth_headers())
+            return records_result(Level1Record, resp, total = False)
         except grpc.RpcError as e:
             return Result.error(message="%s:%s" % (e.code().value, e.details()))
 
@@ -94,15 +77,8 @@ class Level1DataApi(object):
         return: csst_dfs_common.models.Result
         '''
         try:
-            resp, _ =  self.stub.FindByIds.with_call(level1_pb2.FindByIdsReq(
-                ids = get_parameter(kwargs, "ids", [])
-            ),metadata = get_auth_headers())
-
-            if resp.success:
-                return Result.ok_data(data=from_proto_model_list(Level1Record, resp.records))
-            else:
-                return Result.error(message = str(resp.error.detail))
-
+            resp, _ =  self.stub.FindByIds.with_call(find_by_ids_req(kwargs),metadata = get_auth_headers())
+            return records_result(Level1Record, resp, total = False)
         except grpc.RpcError as e:
             return Result.error(message="%s:%s" % (e.code().value, e.details()))
         
@@ -144,19 +120,10 @@ class Level1DataApi(object):
         return csst_dfs_common.models.Result
         '''
         try:
-            resp, _ =  self.stub.Get.with_call(level1_pb2.GetLevel1Req(
-                id = get_parameter(kwargs, "id"),
-                level0_id = get_parameter(kwargs, "level0_id"),
-                data_type = get_parameter(kwargs, "data_type") 
-            ),metadata = get_auth_headers())
-
-            if resp.record is None or resp.record.id == 0:
-                return Result.error(message=f"data not found")  
-
-            return Result.ok_data(data = Level1Record().from_proto_model(resp.record))
-
+            resp, _ =  self.stub.Get.with_call(get_req(kwargs),metadata = get_auth_headers())
+            return record_result(Level1Record, resp.record)
         except grpc.RpcError as e:
-            return Result.error(message="%s:%s" % (e.code().value, e.details()))   
+            return Result.error(message="%s:%s" % (e.code().value, e.details()))
 
     def update_proc_status(self, **kwargs):
         ''' update the status of reduction
@@ -167,17 +134,9 @@ class Level1DataApi(object):
 
         return csst_dfs_common.models.Result
         '''
-        fits_id = get_parameter(kwargs, "id")
-        status = get_parameter(kwargs, "status")
         try:
-            resp,_ = self.stub.UpdateProcStatus.with_call(
-                level1_pb2.UpdateProcStatusReq(id=fits_id, status=status),
-                metadata = get_auth_headers()
-            )
-            if resp.success:
-                return Result.ok_data()
-            else:
-                return Result.error(message = str(resp.error.detail))
+            resp,_ = self.stub.UpdateProcStatus.with_call(status_req(level1_pb2.UpdateProcStatusReq, kwargs), metadata = get_auth_headers())
+            return status_result(resp)
         except grpc.RpcError as e:
             return Result.error(message="%s:%s" % (e.code().value, e.details()))
 
@@ -188,20 +147,13 @@ class Level1DataApi(object):
             id : [int],
             status : [int]
         '''        
-        fits_id = get_parameter(kwargs, "id")
-        status = get_parameter(kwargs, "status")
         try:
-            resp,_ = self.stub.UpdateQc1Status.with_call(
-                level1_pb2.UpdateQc1StatusReq(id=fits_id, status=status),
-                metadata = get_auth_headers()
-            )
-            if resp.success:
-                return Result.ok_data()
-            else:
-                return Result.error(message = str(resp.error.detail))
+            resp,_ = self.stub.UpdateQc1Status.with_call(status_req(level1_pb2.UpdateQc1StatusReq, kwargs), metadata = get_auth_headers())
+            return status_result(resp)
         except grpc.RpcError as e:
             return Result.error(message="%s:%s" % (e.code().value, e.details()))
 
+    @with_upload_doc(dedup = True)
     def write(self, **kwargs):
         ''' insert a level1 record into database
 
@@ -211,7 +163,7 @@ class Level1DataApi(object):
             cor_sci_id : [int]
             prc_params : [str]
             filename : [str]
-            file_path : [str]            
+            file_path : [str]
             prc_status : [int]
             prc_time : [str]
             pipeline_id : [str]
@@ -220,40 +172,64 @@ class Level1DataApi(object):
         return csst_dfs_common.models.Result
         '''   
 
-        rec = level1_pb2.Level1Record(
-            id = 0,
-            level0_id = get_parameter(kwargs, "level0_id", ""),
-            module_id = get_parameter(kwargs, "module_id", ""),
-            data_type = get_parameter(kwargs, "data_type", ""),
-            cor_sci_id = get_parameter(kwargs, "cor_sci_id", 0),
-            prc_params = get_parameter(kwargs, "prc_params", ""),
-            filename = get_parameter(kwargs, "filename", ""),
-            file_path = get_parameter(kwargs, "file_path", ""),
-            qc1_status = get_parameter(kwargs, "qc1_status", 0),
-            prc_status = get_parameter(kwargs, "prc_status", 0),
-            prc_time = get_parameter(kwargs, "prc_time", format_datetime(datetime.now())),
-            pipeline_id = get_parameter(kwargs, "pipeline_id", ""),
-            refs = get_parameter(kwargs, "refs", {})
-        )
-        def stream(rec):
-            with open(rec.file_path, 'rb') as f:
-                while True:
-                    data = f.read(UPLOAD_CHUNK_SIZE)
-                    if not data:
-                        break
-                    yield level1_pb2.WriteLevel1Req(record = rec, data = data)
-        try:
-            if not rec.file_path:
-                return Result.error(message="file_path is blank")
-            if not os.path.exists(rec.file_path):
-                return Result.error(message="the file [%s] not existed" % (rec.file_path, ))
-            if not rec.filename:
-                rec.filename = os.path.basename(rec.file_path)
-
-            resp,_ = self.stub.Write.with_call(stream(rec),metadata = get_auth_headers())
-            if resp.success:
-                return Result.ok_data(data=Level1Record().from_proto_model(resp.record))
-            else:
-                return Result.error(message = str(resp.error.detail))
-        except grpc.RpcError as e:
-            return Result.error(message="%s:%s" % (e.code().value, e.details()))
+        rec = write_record(kwargs)
+        return write_upload(self.stub.Write, kwargs, rec, level1_pb2.WriteLevel1Req, Level1Record,
+            get = lambda id: self.get(id = id), kind = "level1", dedup_key = (rec.level0_id, rec.data_type))
+
+# the requests of the methods, shared with aio.AsyncLevel1DataApi
+
+def find_req(kwargs):
+    other_conditions = {
+        "ra_cen": str(get_parameter(kwargs, "ra_cen", '')),
+        "dec_cen": str(get_parameter(kwargs, "dec_cen", '')),
+        "radius_cen": str(get_parameter(kwargs, "radius_cen", ''))
+    }
+    if get_parameter(kwargs, "order_by"):
+        other_conditions["orderBy"] = get_parameter(kwargs, "order_by")
+    return level1_pb2.FindLevel1Req(
+        obs_id = get_parameter(kwargs, "obs_id"),
+        level0_id = get_parameter(kwargs, "level0_id"),
+        module_id = get_parameter(kwargs, "module_id"),
+        data_type = get_parameter(kwargs, "data_type"),
+        create_time_start = get_parameter(kwargs, "create_time", [None, None])[0],
+        create_time_end = get_parameter(kwargs, "create_time", [None, None])[1],
+        qc1_status = get_parameter(kwargs, "qc1_status", 1024),
+        prc_status = get_parameter(kwargs, "prc_status", 1024),
+        filename = get_parameter(kwargs, "filename"),
+        limit = get_parameter(kwargs, "limit", 0),
+        pipeline_id = get_parameter(kwargs, "pipeline_id", ""),
+        detector_no = get_parameter(kwargs, "detector_no", ""),
+        filter = get_parameter(kwargs, "filter", ""),
+        object_name = get_parameter(kwargs, "object_name", ""),
+        other_conditions = other_conditions
+    )
+
+def find_by_brick_ids_req(kwargs):
+    return level1_pb2.FindByBrickIdsReq(brick_ids = get_parameter(kwargs, "brick_ids", []))
+
+def find_by_ids_req(kwargs):
+    return level1_pb2.FindByIdsReq(ids = get_parameter(kwargs, "ids", []))
+
+def get_req(kwargs):
+    return level1_pb2.GetLevel1Req(
+        id = get_parameter(kwargs, "id"),
+        level0_id = get_parameter(kwargs, "level0_id"),
+        data_type = get_parameter(kwargs, "data_type")
+    )
+
+def write_record(kwargs):
+    return level1_pb2.Level1Record(
+        id = 0,
+        level0_id = get_parameter(kwargs, "level0_id", ""),
+        module_id = get_parameter(kwargs, "module_id", ""),
+        data_type = get_parameter(kwargs, "data_type", ""),
+        cor_sci_id = get_parameter(kwargs, "cor_sci_id", 0),
+        prc_params = get_parameter(kwargs, "prc_params", ""),
+        filename = get_parameter(kwargs, "filename", ""),
+        file_path = get_parameter(kwargs, "file_path", ""),
+        qc1_status = get_parameter(kwargs, "qc1_status", 0),
+        prc_status = get_parameter(kwargs, "prc_status", 0),
+        prc_time = get_parameter(kwargs, "prc_time", format_datetime(datetime.now())),
+        pipeline_id = get_parameter(kwargs, "pipeline_id", ""),
+        refs = get_parameter(kwargs, "refs", {})
+    )
@@ -7,20 +7,25 @@ import pickle
 from collections.abc import Iterable
 
 from csst_dfs_commons.models import Result
-from csst_dfs_commons.models.common import from_proto_model_list
 from csst_dfs_commons.models.level2 import Level2Record
 from csst_dfs_commons.models.constants import UPLOAD_CHUNK_SIZE
 from csst_dfs_proto.facility.level2 import level2_pb2, level2_pb2_grpc
 
 from ..common.service import ServiceProxy
 from ..common.utils import *
+from ..common.upload import write_upload, with_upload_doc
+from ..common.stream import CatalogStream, CatalogStreamError, read_catalog
+from ..common.table import catalog_format, format_catalog
 
+@with_update_many
 class Level2DataApi(object):
     """
     Level2 Data Operation Class
+
+    :param stub: the Level2Srv stub to call, by default one on the shared channel
     """    
-    def __init__(self):
-        self.stub = level2_pb2_grpc.Level2SrvStub(ServiceProxy().channel())
+    def __init__(self, stub = None):
+        self.stub = stub or level2_pb2_grpc.Level2SrvStub(ServiceProxy().channel())
 
     def find(self, **kwargs):
         ''' retrieve level2 records from database
@@ -41,27 +46,8 @@ class Level2DataApi(object):
         return: csst_dfs_common.models.Result
         '''
         try:
-            resp, _ =  self.stub.Find.with_call(level2_pb2.FindLevel2Req(
-                level0_id = get_parameter(kwargs, "level0_id"),
-                level1_id = get_parameter(kwargs, "level1_id"),
-                module_id = get_parameter(kwargs, "module_id"),
-                brick_id = get_parameter(kwargs, "brick_id"),
-                data_type = get_parameter(kwargs, "data_type"),
-                create_time_start = get_parameter(kwargs, "create_time", [None, None])[0],
-                create_time_end = get_parameter(kwargs, "create_time", [None, None])[1],
-                qc2_status = get_parameter(kwargs, "qc2_status", 1024),
-                prc_status = get_parameter(kwargs, "prc_status", 1024),
-                import_status = get_parameter(kwargs, "import_status", 1024),
-                filename = get_parameter(kwargs, "filename"),
-                limit = get_parameter(kwargs, "limit", 0),
-                other_conditions = {"test":"cnlab.test"}
-            ),metadata = get_auth_headers())
-
-            if resp.success:
-                return Result.ok_data(data=from_proto_model_list(Level2Record, resp.records)).append("totalCount", resp.totalCount)
-            else:
-                return Result.error(message = str(resp.error.detail))
-
+            resp, _ =  self.stub.Find.with_call(find_req(kwargs),metadata = get_auth_headers())
+            return records_result(Level2Record, resp)
         except grpc.RpcError as e:
             return Result.error(message="%s:%s" % (e.code().value, e.details()))
 
@@ -71,30 +57,41 @@ class Level2DataApi(object):
         parameter kwargs:
             sql: [str]
             limit: limits returns the number of records,default 0:no-limit
+            as_table: [bool] return the data as an astropy Table
+            format: [str] "table" for an astropy Table, "numpy" for a structured array
 
         return: csst_dfs_common.models.Result
         '''
+        fmt = catalog_format(kwargs)
         try:
-            datas = io.BytesIO()
-            totalCount = 0         
-            
-            resps =  self.stub.FindCatalog(level2_pb2.FindLevel2CatalogReq(
-                sql = get_parameter(kwargs, "sql", None),
-                limit = get_parameter(kwargs, "limit", 0)
-            ),metadata = get_auth_headers())
-            
-            for resp in resps:
-                if resp.success:
-                    datas.write(resp.records)
-                    totalCount = resp.totalCount
-                else:
-                    return Result.error(message = str(resp.error.detail))
-            datas.flush()
-            records = pickle.loads(datas.getvalue())
-            return Result.ok_data(data = records[0]).append("totalCount", totalCount).append("columns", records[1])
+            resps =  self.stub.FindCatalog(self._catalog_req(kwargs),metadata = get_auth_headers())
+            records, totalCount = read_catalog(resps)
+            return Result.ok_data(data = format_catalog(records[0], records[1], fmt)).append("totalCount", totalCount).append("columns", records[1])
+        except CatalogStreamError as e:
+            return Result.error(message = str(e))
         except grpc.RpcError as e:
             return Result.error(message="%s:%s" % (e.code().value, e.details()))
 
+    def catalog_query_iter(self, batch_size = 10000, **kwargs):
+        ''' retrieve level2catalog records in batches while the stream is still arriving
+
+        parameter kwargs: same as catalog_query
+            batch_size: number of rows per batch, default 10000
+
+        return: CatalogStream, iterate it for lists of rows, its columns and
+            totalCount are filled in as the stream is decoded;
+            raises CatalogStreamError or grpc.RpcError while iterating;
+            use it in a with block or call cancel() to stop the call early
+        '''
+        resps =  self.stub.FindCatalog(self._catalog_req(kwargs),metadata = get_auth_headers())
+        return CatalogStream(resps, batch_size)
+
+    def _catalog_req(self, kwargs):
+        return level2_pb2.FindLevel2CatalogReq(
+            sql = get_parameter(kwargs, "sql", None),
+            limit = get_parameter(kwargs, "limit", 0)
+        )
+
     def find_existed_brick_ids(self, **kwargs):
         ''' retrieve existed brick_ids in a single exposure catalog
 
@@ -124,17 +121,10 @@ class Level2DataApi(object):
         return csst_dfs_common.models.Result
         '''
         try:
-            resp, _ =  self.stub.Get.with_call(level2_pb2.GetLevel2Req(
-                id = get_parameter(kwargs, "id")
-            ),metadata = get_auth_headers())
-
-            if resp.record is None or resp.record.id == 0:
-                return Result.error(message=f"data not found")  
-
-            return Result.ok_data(data = Level2Record().from_proto_model(resp.record))
-
+            resp, _ =  self.stub.Get.with_call(get_req(kwargs),metadata = get_auth_headers())
+            return record_result(Level2Record, resp.record)
         except grpc.RpcError as e:
-            return Result.error(message="%s:%s" % (e.code().value, e.details()))   
+            return Result.error(message="%s:%s" % (e.code().value, e.details()))
 
     def update_proc_status(self, **kwargs):
         ''' update the status of reduction
@@ -145,17 +135,9 @@ class Level2DataApi(object):
 
         return csst_dfs_common.models.Result
         '''
-        fits_id = get_parameter(kwargs, "id")
-        status = get_parameter(kwargs, "status")
         try:
-            resp,_ = self.stub.UpdateProcStatus.with_call(
-                level2_pb2.UpdateProcStatusReq(id=fits_id, status=status),
-                metadata = get_auth_headers()
-            )
-            if resp.success:
-                return Result.ok_data()
-            else:
-                return Result.error(message = str(resp.error.detail))
+            resp,_ = self.stub.UpdateProcStatus.with_call(status_req(level2_pb2.UpdateProcStatusReq, kwargs), metadata = get_auth_headers())
+            return status_result(resp)
         except grpc.RpcError as e:
             return Result.error(message="%s:%s" % (e.code().value, e.details()))
 
@@ -166,20 +148,13 @@ class Level2DataApi(object):
             id : [int],
             status : [int]
         '''        
-        fits_id = get_parameter(kwargs, "id")
-        status = get_parameter(kwargs, "status")
         try:
-            resp,_ = self.stub.UpdateQc2Status.with_call(
-                level2_pb2.UpdateQc2StatusReq(id=fits_id, status=status),
-                metadata = get_auth_headers()
-            )
-            if resp.success:
-                return Result.ok_data()
-            else:
-                return Result.error(message = str(resp.error.detail))
+            resp,_ = self.stub.UpdateQc2Status.with_call(status_req(level2_pb2.UpdateQc2StatusReq, kwargs), metadata = get_auth_headers())
+            return status_result(resp)
         except grpc.RpcError as e:
             return Result.error(message="%s:%s" % (e.code().value, e.details()))
 
+    @with_upload_doc(dedup = True)
     def write(self, **kwargs):
         ''' insert a level2 record into database
 
@@ -190,7 +165,7 @@ class Level2DataApi(object):
             object_name: [str]
             data_type : [str]
             filename : [str]
-            file_path : [str]            
+            file_path : [str]
             prc_status : [int]
             prc_time : [str]
             pipeline_id : [str]
@@ -198,43 +173,50 @@ class Level2DataApi(object):
         return csst_dfs_common.models.Result
         '''   
 
-        rec = level2_pb2.Level2Record(
-            id = 0,
-            level1_id = get_parameter(kwargs, "level1_id", 0),
-            brick_id = get_parameter(kwargs, "brick_id", 0),
-            module_id = get_parameter(kwargs, "module_id", ""),
-            data_type = get_parameter(kwargs, "data_type", ""),
-            object_name = get_parameter(kwargs, "object_name", ""),
-            filename = get_parameter(kwargs, "filename", ""),
-            file_path = get_parameter(kwargs, "file_path", ""),
-            qc2_status = get_parameter(kwargs, "qc2_status", 0),
-            prc_status = get_parameter(kwargs, "prc_status", 0),
-            prc_time = get_parameter(kwargs, "prc_time", format_datetime(datetime.now())),
-            pipeline_id = get_parameter(kwargs, "pipeline_id", "")
-        )
-        def stream(rec):
-            with open(rec.file_path, 'rb') as f:
-                while True:
-                    data = f.read(UPLOAD_CHUNK_SIZE)
-                    if not data:
-                        break
-                    yield level2_pb2.WriteLevel2Req(record = rec, data = data)
-        try:
-            if not rec.module_id:
-                return Result.error(message="module_id is blank")
-            if not rec.data_type:
-                return Result.error(message="data_type is blank")
-            if not rec.file_path:
-                return Result.error(message="file_path is blank")
-            if not os.path.exists(rec.file_path):
-                return Result.error(message="the file [%s] not existed" % (rec.file_path, ))
-            if not rec.filename:
-                rec.filename = os.path.basename(rec.file_path)
-
-            resp,_ = self.stub.Write.with_call(stream(rec),metadata = get_auth_headers())
-            if resp.success:
-                return Result.ok_data(data=Level2Record().from_proto_model(resp.record))
-            else:
-                return Result.error(message = str(resp.error.detail))
-        except grpc.RpcError as e:
-            return Result.error(message="%s:%s" % (e.code().value, e.details()))
+        rec = write_record(kwargs)
+        if not rec.module_id:
+            return Result.error(message="module_id is blank")
+        if not rec.data_type:
+            return Result.error(message="data_type is blank")
+        return write_upload(self.stub.Write, kwargs, rec, level2_pb2.WriteLevel2Req, Level2Record,
+            get = lambda id: self.get(id = id), kind = "level2", dedup_key = (rec.level1_id, rec.brick_id, rec.data_type))
+
+# the requests of the methods, shared with aio.AsyncLevel2DataApi
+
+def find_req(kwargs):
+    return level2_pb2.FindLevel2Req(
+        level0_id = get_parameter(kwargs, "level0_id"),
+        level1_id = get_parameter(kwargs, "level1_id"),
+        module_id = get_parameter(kwargs, "module_id"),
+        brick_id = get_parameter(kwargs, "brick_id"),
+        data_type = get_parameter(kwargs, "data_type"),
+        create_time_start = get_parameter(kwargs, "create_time", [None, None])[0],
+        create_time_end = get_parameter(kwargs, "create_time", [None, None])[1],
+        qc2_status = get_parameter(kwargs, "qc2_status", 1024),
+        prc_status = get_parameter(kwargs, "prc_status", 1024),
+        import_status = get_parameter(kwargs, "import_status", 1024),
+        filename = get_parameter(kwargs, "filename"),
+        limit = get_parameter(kwargs, "limit", 0),
+        other_conditions = {"test":"cnlab.test"}
+    )
+
+def get_req(kwargs):
+    return level2_pb2.GetLevel2Req(
+        id = get_parameter(kwargs, "id")
+    )
+
+def write_record(kwargs):
+    return level2_pb2.Level2Record(
+        id = 0,
+        level1_id = get_parameter(kwargs, "level1_id", 0),
+        brick_id = get_parameter(kwargs, "brick_id", 0),
+        module_id = get_parameter(kwargs, "module_id", ""),
+        data_type = get_parameter(kwargs, "data_type", ""),
+        object_name = get_parameter(kwargs, "object_name", ""),
+        filename = get_parameter(kwargs, "filename", ""),
+        file_path = get_parameter(kwargs, "file_path", ""),
+        qc2_status = get_parameter(kwargs, "qc2_status", 0),
+        prc_status = get_parameter(kwargs, "prc_status", 0),
+        prc_time = get_parameter(kwargs, "prc_time", format_datetime(datetime.now())),
+        pipeline_id = get_parameter(kwargs, "pipeline_id", "")
+    )
@@ -14,6 +14,7 @@ from csst_dfs_proto.facility.level2type import level2type_pb2, level2type_pb2_gr
 
 from ..common.service import ServiceProxy
 from ..common.utils import *
+from ..common.upload import file_chunks, upload_requests
 
 class Level2TypeApi(object):
     """
@@ -112,6 +113,7 @@ class Level2TypeApi(object):
             demo_file_path : [str]    
             ra_column : [str]
             dec_column : [str]
+            record_once : [bool] send the record in the first message only, default CSST_DFS_UPLOAD_RECORD_ONCE or False
 
         return csst_dfs_common.models.Result
         '''   
@@ -126,13 +128,8 @@ class Level2TypeApi(object):
             ra_column = get_parameter(kwargs, "ra_column", ""),            
             dec_column = get_parameter(kwargs, "dec_column", "")
         )
-        def stream(rec):
-            with open(rec.demo_file_path, 'rb') as f:
-                while True:
-                    data = f.read(UPLOAD_CHUNK_SIZE)
-                    if not data:
-                        break
-                    yield level2type_pb2.WriteLevel2TypeReq(record = rec, data = data)
+        def stream(chunks):
+            return upload_requests(level2type_pb2.WriteLevel2TypeReq, rec, chunks, get_parameter(kwargs, "record_once"))
         try:
             if not rec.data_type:
                 return Result.error(message="data_type is blank")
@@ -143,7 +140,7 @@ class Level2TypeApi(object):
             if not rec.demo_filename:
                 rec.demo_filename = os.path.basename(rec.demo_file_path)
 
-            resp,_ = self.stub.Write.with_call(stream(rec),metadata = get_auth_headers())
+            resp,_ = self.stub.Write.with_call(stream(file_chunks(rec.demo_file_path)),metadata = get_auth_headers())
             if resp.success:
                 return Result.ok_data(data=Level2TypeRecord().from_proto_model(resp.record))
             else:
@@ -1,7 +1,6 @@
 import grpc
 
 from csst_dfs_commons.models import Result
-from csst_dfs_commons.models.common import from_proto_model_list
 from csst_dfs_commons.models.facility import Observation
 
 from csst_dfs_proto.facility.observation import observation_pb2, observation_pb2_grpc
@@ -10,6 +9,7 @@ from ..common.service import ServiceProxy
 from ..common.utils import *
 from ..common.constants import UPLOAD_CHUNK_SIZE
 
+@with_update_many
 class ObservationApi(object):
     """
     Observation Operation Class
@@ -31,22 +31,8 @@ class ObservationApi(object):
         return: csst_dfs_common.models.Result
         '''
         try:
-            resp, _ =  self.stub.Find.with_call(observation_pb2.FindObservationReq(
-                module_id = get_parameter(kwargs, "module_id"),
-                obs_type = get_parameter(kwargs, "obs_type"),
-                exp_time_start = get_parameter(kwargs, "obs_time", [None, None])[0],
-                exp_time_end = get_parameter(kwargs, "obs_time", [None, None])[1],
-                qc0_status = get_parameter(kwargs, "qc0_status"),
-                prc_status = get_parameter(kwargs, "prc_status"),
-                limit = get_parameter(kwargs, "limit", 0),
-                other_conditions = {"test":"cnlab.test"}
-            ),metadata = get_auth_headers())
-
-            if resp.success:
-                return Result.ok_data(data = from_proto_model_list(Observation, resp.records)).append("totalCount", resp.totalCount)
-            else:
-                return Result.error(message = str(resp.error.detail))
-
+            resp, _ =  self.stub.Find.with_call(find_req(kwargs),metadata = get_auth_headers())
+            return records_result(Observation, resp)
         except grpc.RpcError as e:
             return Result.error(message="%s:%s" % (e.code().value, e.details()))
 
@@ -60,20 +46,10 @@ class ObservationApi(object):
         return csst_dfs_common.models.Result
         '''
         try:
-            id = get_parameter(kwargs, "id")
-            obs_id = get_parameter(kwargs, "obs_id")
-            resp, _ =  self.stub.Get.with_call(observation_pb2.GetObservationReq(
-                id = id,
-                obs_id = obs_id
-            ),metadata = get_auth_headers())
-
-            if resp.observation is None or resp.observation.id == 0:
-                return Result.error(message=f"not found")  
-
-            return Result.ok_data(data=Observation().from_proto_model(resp.observation))
-           
+            resp, _ =  self.stub.Get.with_call(get_req(kwargs),metadata = get_auth_headers())
+            return record_result(Observation, resp.observation, "not found")
         except grpc.RpcError as e:
-            return Result.error(message="%s:%s" % (e.code().value, e.details()))        
+            return Result.error(message="%s:%s" % (e.code().value, e.details()))
 
     def update_proc_status(self, **kwargs):
         ''' update the status of reduction
@@ -85,21 +61,9 @@ class ObservationApi(object):
 
         return csst_dfs_common.models.Result
         '''
-        id = get_parameter(kwargs, "id")
-        obs_id = get_parameter(kwargs, "obs_id")
-        status = get_parameter(kwargs, "status")
         try:
-            resp,_ = self.stub.UpdateProcStatus.with_call(
-                observation_pb2.UpdateProcStatusReq(
-                    id = id,
-                    obs_id = obs_id,
-                    status = status),
-                metadata = get_auth_headers()
-            )
-            if resp.success:
-                return Result.ok_data()
-            else:
-                return Result.error(message = str(resp.error.detail))
+            resp,_ = self.stub.UpdateProcStatus.with_call(update_req(observation_pb2.UpdateProcStatusReq, kwargs), metadata = get_auth_headers())
+            return status_result(resp)
         except grpc.RpcError as e:
             return Result.error(message="%s:%s" % (e.code().value, e.details()))
 
@@ -111,21 +75,9 @@ class ObservationApi(object):
             obs_id = [str],
             status : [int]
         '''        
-        id = get_parameter(kwargs, "id")
-        obs_id = get_parameter(kwargs, "obs_id")
-        status = get_parameter(kwargs, "status")
         try:
-            resp,_ = self.stub.UpdateQc0Status.with_call(
-                observation_pb2.UpdateQc0StatusReq(
-                    id = id,
-                    obs_id = obs_id,
-                    status=status),
-                metadata = get_auth_headers()
-            )
-            if resp.success:
-                return Result.ok_data()
-            else:
-                return Result.error(message = str(resp.error.detail))
+            resp,_ = self.stub.UpdateQc0Status.with_call(update_req(observation_pb2.UpdateQc0StatusReq, kwargs), metadata = get_auth_headers())
+            return status_result(resp)
         except grpc.RpcError as e:
             return Result.error(message="%s:%s" % (e.code().value, e.details()))
 
@@ -144,26 +96,48 @@ class ObservationApi(object):
         return: csst_dfs_common.models.Result
         '''   
 
-        rec = observation_pb2.Observation(
-            id = get_parameter(kwargs, "id", 0),
-            obs_id = get_parameter(kwargs, "obs_id", ""),
-            obs_time = get_parameter(kwargs, "obs_time"),
-            exp_time = get_parameter(kwargs, "exp_time"),
-            module_id = get_parameter(kwargs, "module_id"),
-            obs_type = get_parameter(kwargs, "obs_type"),
-            facility_status_id = get_parameter(kwargs, "facility_status_id"),
-            module_status_id = get_parameter(kwargs, "module_status_id")
-        )
-        req = observation_pb2.WriteObservationReq(record = rec)
         try:
-            resp,_ = self.stub.Write.with_call(req,metadata = get_auth_headers())
-            if resp.success:
-                return Result.ok_data(data=Observation().from_proto_model(resp.record))
-            else:
-                return Result.error(message = str(resp.error.detail))
-    
+            resp,_ = self.stub.Write.with_call(write_req(kwargs), metadata = get_auth_headers())
+            return written_result(Observation, resp)
         except grpc.RpcError as e:
             return Result.error(message="%s:%s" % (e.code().value, e.details()))
 
-   
+# the requests of the methods, shared with aio.AsyncObservationApi
+
+def find_req(kwargs):
+    return observation_pb2.FindObservationReq(
+        module_id = get_parameter(kwargs, "module_id"),
+        obs_type = get_parameter(kwargs, "obs_type"),
+        exp_time_start = get_parameter(kwargs, "obs_time", [None, None])[0],
+        exp_time_end = get_parameter(kwargs, "obs_time", [None, None])[1],
+        qc0_status = get_parameter(kwargs, "qc0_status"),
+        prc_status = get_parameter(kwargs, "prc_status"),
+        limit = get_parameter(kwargs, "limit", 0),
+        other_conditions = {"test":"cnlab.test"}
+    )
+
+def get_req(kwargs):
+    return observation_pb2.GetObservationReq(
+        id = get_parameter(kwargs, "id"),
+        obs_id = get_parameter(kwargs, "obs_id")
+    )
 
+def update_req(req_type, kwargs):
+    return req_type(
+        id = get_parameter(kwargs, "id"),
+        obs_id = get_parameter(kwargs, "obs_id"),
+        status = get_parameter(kwargs, "status")
+    )
+
+def write_req(kwargs):
+    rec = observation_pb2.Observation(
+        id = get_parameter(kwargs, "id", 0),
+        obs_id = get_parameter(kwargs, "obs_id", ""),
+        obs_time = get_parameter(kwargs, "obs_time"),
+        exp_time = get_parameter(kwargs, "exp_time"),
+        module_id = get_parameter(kwargs, "module_id"),
+        obs_type = get_parameter(kwargs, "obs_type"),
+        facility_status_id = get_parameter(kwargs, "facility_status_id"),
+        module_status_id = get_parameter(kwargs, "module_status_id")
+    )
+    return observation_pb2.WriteObservationReq(record = rec)
@@ -14,13 +14,20 @@ from csst_dfs_proto.msc.level2 import level2_pb2, level2_pb2_grpc
 
 from ..common.service import ServiceProxy
 from ..common.utils import *
+from ..common.upload import write_upload, with_upload_doc
+from ..common.stream import CatalogStream, CatalogStreamError, fan_out_catalog, read_catalog
+from ..common.table import catalog_format, format_catalog, to_table
+from ..common.spill import spill_catalog
 
+@with_update_many
 class Level2DataApi(object):
     """
     Level2 Data Operation Class
+
+    :param stub: the Level2Srv stub to call, by default one on the shared channel
     """    
-    def __init__(self):
-        self.stub = level2_pb2_grpc.Level2SrvStub(ServiceProxy().channel())
+    def __init__(self, stub = None):
+        self.stub = stub or level2_pb2_grpc.Level2SrvStub(ServiceProxy().channel())
 
     def find(self, **kwargs):
         ''' retrieve level2 records from database
@@ -38,24 +45,8 @@ class Level2DataApi(object):
         return: csst_dfs_common.models.Result
         '''
         try:
-            resp, _ =  self.stub.Find.with_call(level2_pb2.FindLevel2Req(
-                level0_id = get_parameter(kwargs, "level0_id"),
-                level1_id = get_parameter(kwargs, "level1_id"),
-                data_type = get_parameter(kwargs, "data_type"),
-                create_time_start = get_parameter(kwargs, "create_time", [None, None])[0],
-                create_time_end = get_parameter(kwargs, "create_time", [None, None])[1],
-                qc2_status = get_parameter(kwargs, "qc2_status", 1024),
-                prc_status = get_parameter(kwargs, "prc_status", 1024),
-                filename = get_parameter(kwargs, "filename"),
-                limit = get_parameter(kwargs, "limit", 0),
-                other_conditions = {"test":"cnlab.test"}
-            ),metadata = get_auth_headers())
-
-            if resp.success:
-                return Result.ok_data(data=from_proto_model_list(Level2Record, resp.records)).append("totalCount", resp.totalCount)
-            else:
-                return Result.error(message = str(resp.error.detail))
-
+            resp, _ =  self.stub.Find.with_call(find_req(kwargs),metadata = get_auth_headers())
+            return records_result(Level2Record, resp)
         except grpc.RpcError as e:
             return Result.error(message="%s:%s" % (e.code().value, e.details()))
 
@@ -72,45 +63,102 @@ class Level2DataApi(object):
             radius:  [float] in deg   
             obs_time: (start, end),
             limit: limits returns the number of records,default 0:no-limit
+            as_table: [bool] return the data as an astropy Table
+            format: [str] "table" for an astropy Table, "numpy" for a structured array
+            brick_group_size: [int] query the brick_ids in groups of this size as
+                concurrent streams, default 0: one stream for all
+            max_workers: [int] number of concurrent group streams, default 8
+            ordered: [bool] merge the groups in brick_ids order, default True,
+                False merges the rows as they arrive
+            spill_dir: [str] decode the result into a .npy file in this directory and
+                return it memory-mapped, as a structured array or with format="table"
+                as an astropy Table over the mapped columns, for results larger than memory
 
         return: csst_dfs_common.models.Result
         '''
+        fmt = catalog_format(kwargs)
+        spill_dir = get_parameter(kwargs, "spill_dir")
+        if spill_dir:
+            return self._catalog_query_spill(kwargs, spill_dir, fmt)
+        brick_ids = get_parameter(kwargs, "brick_ids", [])
+        if not isinstance(brick_ids, Iterable):
+            brick_ids = [brick_ids]
+        group_size = get_parameter(kwargs, "brick_group_size", 0)
+        if group_size and len(brick_ids) > group_size:
+            return self._catalog_query_fan_out(kwargs, list(brick_ids), group_size, fmt)
         try:
-            datas = io.BytesIO()
-            totalCount = 0         
-            
-            brick_ids = get_parameter(kwargs, "brick_ids", [])
-            if not isinstance(brick_ids,Iterable):
-                brick_ids = [brick_ids]
+            resps =  self.stub.FindCatalog(self._catalog_req(kwargs),metadata = get_auth_headers())
+            records, totalCount = read_catalog(resps)
+            return Result.ok_data(data = format_catalog(records[0], records[1], fmt)).append("totalCount", totalCount).append("columns", records[1])
+        except CatalogStreamError as e:
+            return Result.error(message = str(e))
+        except grpc.RpcError as e:
+            return Result.error(message="%s:%s" % (e.code().value, e.details()))
 
-            resps =  self.stub.FindCatalog(level2_pb2.FindLevel2CatalogReq(
-                brick_ids = ",".join([str(i) for i in brick_ids]),
-                obs_id = get_parameter(kwargs, "obs_id", None),
-                detector_no = get_parameter(kwargs, "detector_no", None),
-                filter = get_parameter(kwargs, "filter", None),
-                obs_time_start = get_parameter(kwargs, "obs_time", [None, None])[0],
-                obs_time_end = get_parameter(kwargs, "obs_time", [None, None])[1],
-                ra = get_parameter(kwargs, "ra"),
-                dec = get_parameter(kwargs, "dec"),
-                radius = get_parameter(kwargs, "radius"),
-                minMag = get_parameter(kwargs, "min_mag"),
-                maxMag = get_parameter(kwargs, "max_mag"),
+    def _catalog_query_spill(self, kwargs, spill_dir, fmt):
+        try:
+            resps =  self.stub.FindCatalog(self._catalog_req(kwargs),metadata = get_auth_headers())
+            data, columns, totalCount = spill_catalog(resps, spill_dir)
+            spill_file = getattr(data, "filename", None)
+            if fmt == "table":
+                data = to_table([data[c] for c in data.dtype.names], data.dtype.names)
+            return Result.ok_data(data = data).append("totalCount", totalCount).append("columns", columns).append("spill_file", spill_file)
+        except CatalogStreamError as e:
+            return Result.error(message = str(e))
+        except grpc.RpcError as e:
+            return Result.error(message="%s:%s" % (e.code().value, e.details()))
+
+    def _catalog_query_fan_out(self, kwargs, brick_ids, group_size, fmt):
+        groups = [brick_ids[i:i + group_size] for i in range(0, len(brick_ids), group_size)]
+        try:
+            records, columns, totalCount = fan_out_catalog(
+                lambda group: self.stub.FindCatalog(self._catalog_req(dict(kwargs, brick_ids = group)), metadata = get_auth_headers()),
+                groups,
                 limit = get_parameter(kwargs, "limit", 0),
-                columns = ",".join(get_parameter(kwargs, "columns", "*"))
-            ),metadata = get_auth_headers())
-            
-            for resp in resps:
-                if resp.success:
-                    datas.write(resp.records)
-                    totalCount = resp.totalCount
-                else:
-                    return Result.error(message = str(resp.error.detail))
-            datas.flush()
-            records = pickle.loads(datas.getvalue())
-            return Result.ok_data(data = records[0]).append("totalCount", totalCount).append("columns", records[1])
+                max_workers = get_parameter(kwargs, "max_workers", 8),
+                ordered = get_parameter(kwargs, "ordered", True)
+            )
+            return Result.ok_data(data = format_catalog(records, columns, fmt)).append("totalCount", totalCount).append("columns", columns)
+        except CatalogStreamError as e:
+            return Result.error(message = str(e))
         except grpc.RpcError as e:
             return Result.error(message="%s:%s" % (e.code().value, e.details()))
 
+    def catalog_query_iter(self, batch_size = 10000, **kwargs):
+        ''' retrieve level2catalog records in batches while the stream is still arriving
+
+        parameter kwargs: same as catalog_query
+            batch_size: number of rows per batch, default 10000
+
+        return: CatalogStream, iterate it for lists of rows, its columns and
+            totalCount are filled in as the stream is decoded;
+            raises CatalogStreamError or grpc.RpcError while iterating;
+            use it in a with block or call cancel() to stop the call early
+        '''
+        resps =  self.stub.FindCatalog(self._catalog_req(kwargs),metadata = get_auth_headers())
+        return CatalogStream(resps, batch_size)
+
+    def _catalog_req(self, kwargs):
+        brick_ids = get_parameter(kwargs, "brick_ids", [])
+        if not isinstance(brick_ids,Iterable):
+            brick_ids = [brick_ids]
+
+        return level2_pb2.FindLevel2CatalogReq(
+            brick_ids = ",".join([str(i) for i in brick_ids]),
+            obs_id = get_parameter(kwargs, "obs_id", None),
+            detector_no = get_parameter(kwargs, "detector_no", None),
+            filter = get_parameter(kwargs, "filter", None),
+            obs_time_start = get_parameter(kwargs, "obs_time", [None, None])[0],
+            obs_time_end = get_parameter(kwargs, "obs_time", [None, None])[1],
+            ra = get_parameter(kwargs, "ra"),
+            dec = get_parameter(kwargs, "dec"),
+            radius = get_parameter(kwargs, "radius"),
+            minMag = get_parameter(kwargs, "min_mag"),
+            maxMag = get_parameter(kwargs, "max_mag"),
+            limit = get_parameter(kwargs, "limit", 0),
+            columns = ",".join(get_parameter(kwargs, "columns", "*"))
+        )
+
     def catalog_query_file(self, **kwargs):
         ''' retrieve level2catalog records from database
 
@@ -182,17 +230,10 @@ class Level2DataApi(object):
         return csst_dfs_common.models.Result
         '''
         try:
-            resp, _ =  self.stub.Get.with_call(level2_pb2.GetLevel2Req(
-                id = get_parameter(kwargs, "id")
-            ),metadata = get_auth_headers())
-
-            if resp.record is None or resp.record.id == 0:
-                return Result.error(message=f"data not found")  
-
-            return Result.ok_data(data = Level2Record().from_proto_model(resp.record))
-
+            resp, _ =  self.stub.Get.with_call(get_req(kwargs),metadata = get_auth_headers())
+            return record_result(Level2Record, resp.record)
         except grpc.RpcError as e:
-            return Result.error(message="%s:%s" % (e.code().value, e.details()))   
+            return Result.error(message="%s:%s" % (e.code().value, e.details()))
 
     def update_proc_status(self, **kwargs):
         ''' update the status of reduction
@@ -203,17 +244,9 @@ class Level2DataApi(object):
 
         return csst_dfs_common.models.Result
         '''
-        fits_id = get_parameter(kwargs, "id")
-        status = get_parameter(kwargs, "status")
         try:
-            resp,_ = self.stub.UpdateProcStatus.with_call(
-                level2_pb2.UpdateProcStatusReq(id=fits_id, status=status),
-                metadata = get_auth_headers()
-            )
-            if resp.success:
-                return Result.ok_data()
-            else:
-                return Result.error(message = str(resp.error.detail))
+            resp,_ = self.stub.UpdateProcStatus.with_call(status_req(level2_pb2.UpdateProcStatusReq, kwargs), metadata = get_auth_headers())
+            return status_result(resp)
         except grpc.RpcError as e:
             return Result.error(message="%s:%s" % (e.code().value, e.details()))
 
@@ -224,20 +257,13 @@ class Level2DataApi(object):
             id : [int],
             status : [int]
         '''        
-        fits_id = get_parameter(kwargs, "id")
-        status = get_parameter(kwargs, "status")
         try:
-            resp,_ = self.stub.UpdateQc2Status.with_call(
-                level2_pb2.UpdateQc2StatusReq(id=fits_id, status=status),
-                metadata = get_auth_headers()
-            )
-            if resp.success:
-                return Result.ok_data()
-            else:
-                return Result.error(message = str(resp.error.detail))
+            resp,_ = self.stub.UpdateQc2Status.with_call(status_req(level2_pb2.UpdateQc2StatusReq, kwargs), metadata = get_auth_headers())
+            return status_result(resp)
         except grpc.RpcError as e:
             return Result.error(message="%s:%s" % (e.code().value, e.details()))
 
+    @with_upload_doc(dedup = True)
     def write(self, **kwargs):
         ''' insert a level2 record into database
  
@@ -245,43 +271,47 @@ class Level2DataApi(object):
             level1_id : [int]
             data_type : [str]
             filename : [str]
-            file_path : [str]            
+            file_path : [str]
             prc_status : [int]
             prc_time : [str]
 
         return csst_dfs_common.models.Result
         '''   
 
-        rec = level2_pb2.Level2Record(
-            id = 0,
-            level1_id = get_parameter(kwargs, "level1_id"),
-            data_type = get_parameter(kwargs, "data_type"),
-            filename = get_parameter(kwargs, "filename", ""),
-            file_path = get_parameter(kwargs, "file_path", ""),
-            qc2_status = get_parameter(kwargs, "qc2_status", 0),
-            prc_status = get_parameter(kwargs, "prc_status", 0),
-            prc_time = get_parameter(kwargs, "prc_time", format_datetime(datetime.now())),
-            pipeline_id = get_parameter(kwargs, "pipeline_id", "")
-        )
-        def stream(rec):
-            with open(rec.file_path, 'rb') as f:
-                while True:
-                    data = f.read(UPLOAD_CHUNK_SIZE)
-                    if not data:
-                        break
-                    yield level2_pb2.WriteLevel2Req(record = rec, data = data)
-        try:
-            if not rec.file_path:
-                return Result.error(message="file_path is blank")
-            if not os.path.exists(rec.file_path):
-                return Result.error(message="the file [%s] not existed" % (rec.file_path, ))
-            if not rec.filename:
-                rec.filename = os.path.basename(rec.file_path)
-
-            resp,_ = self.stub.Write.with_call(stream(rec),metadata = get_auth_headers())
-            if resp.success:
-                return Result.ok_data(data=Level2Record().from_proto_model(resp.record))
-            else:
-                return Result.error(message = str(resp.error.detail))
-        except grpc.RpcError as e:
-            return Result.error(message="%s:%s" % (e.code().value, e.details()))
+        rec = write_record(kwargs)
+        return write_upload(self.stub.Write, kwargs, rec, level2_pb2.WriteLevel2Req, Level2Record,
+            get = lambda id: self.get(id = id), kind = "mbi.level2", dedup_key = (rec.level1_id, rec.data_type))
+
+# the requests of the methods, shared with aio.mbi.AsyncLevel2DataApi
+
+def find_req(kwargs):
+    return level2_pb2.FindLevel2Req(
+        level0_id = get_parameter(kwargs, "level0_id"),
+        level1_id = get_parameter(kwargs, "level1_id"),
+        data_type = get_parameter(kwargs, "data_type"),
+        create_time_start = get_parameter(kwargs, "create_time", [None, None])[0],
+        create_time_end = get_parameter(kwargs, "create_time", [None, None])[1],
+        qc2_status = get_parameter(kwargs, "qc2_status", 1024),
+        prc_status = get_parameter(kwargs, "prc_status", 1024),
+        filename = get_parameter(kwargs, "filename"),
+        limit = get_parameter(kwargs, "limit", 0),
+        other_conditions = {"test":"cnlab.test"}
+    )
+
+def get_req(kwargs):
+    return level2_pb2.GetLevel2Req(
+        id = get_parameter(kwargs, "id")
+    )
+
+def write_record(kwargs):
+    return level2_pb2.Level2Record(
+        id = 0,
+        level1_id = get_parameter(kwargs, "level1_id"),
+        data_type = get_parameter(kwargs, "data_type"),
+        filename = get_parameter(kwargs, "filename", ""),
+        file_path = get_parameter(kwargs, "file_path", ""),
+        qc2_status = get_parameter(kwargs, "qc2_status", 0),
+        prc_status = get_parameter(kwargs, "prc_status", 0),
+        prc_time = get_parameter(kwargs, "prc_time", format_datetime(datetime.now())),
+        pipeline_id = get_parameter(kwargs, "pipeline_id", "")
+    )
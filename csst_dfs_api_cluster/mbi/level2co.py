@@ -11,7 +11,10 @@ from csst_dfs_proto.msc.level2co import level2co_pb2, level2co_pb2_grpc
 
 from ..common.service import ServiceProxy
 from ..common.utils import *
+from ..common.upload import write_upload, with_upload_doc
+from ..common.table import catalog_format, proto_to_arrays, to_structured, to_table
 
+@with_update_many
 class Level2CoApi(object):
     """
     Level2 Merge Catalog Operation Class
@@ -65,9 +68,12 @@ class Level2CoApi(object):
             max_mag: [float]
             obs_time: (start, end),
             limit: limits returns the number of records,default 0:no-limit
+            as_table: [bool] return the data as an astropy Table
+            format: [str] "table" for an astropy Table, "numpy" for a structured array
 
         return: csst_dfs_common.models.Result
         '''
+        fmt = catalog_format(kwargs)
         try:
             resp, _ =  self.stub.FindCatalog.with_call(level2co_pb2.FindLevel2CoCatalogReq(
                 obs_id = get_parameter(kwargs, "obs_id"),
@@ -82,6 +88,10 @@ class Level2CoApi(object):
                 limit = get_parameter(kwargs, "limit", 0)
             ),metadata = get_auth_headers())
 
+            if resp.success and fmt is not None:
+                arrays, columns = proto_to_arrays(resp.records)
+                data = to_structured(arrays, columns) if fmt == "numpy" else to_table(arrays, columns)
+                return Result.ok_data(data=data).append("totalCount", resp.totalCount).append("columns", columns)
             if resp.success:
                 return Result.ok_data(data=from_proto_model_list(Level2CoCatalogRecord, resp.records)).append("totalCount", resp.totalCount)
             else:
@@ -155,13 +165,14 @@ class Level2CoApi(object):
         except grpc.RpcError as e:
             return Result.error(message="%s:%s" % (e.code().value, e.details()))
 
+    @with_upload_doc()
     def write(self, **kwargs):
         ''' insert a level2 record into database
 
         parameter kwargs:
             data_type : [str]
             filename : [str]
-            file_path : [str]            
+            file_path : [str]
             prc_status : [int]
             prc_time : [str]
 
@@ -178,25 +189,4 @@ class Level2CoApi(object):
             prc_time = get_parameter(kwargs, "prc_time", format_datetime(datetime.now())),
             pipeline_id = get_parameter(kwargs, "pipeline_id", "")
         )
-        def stream(rec):
-            with open(rec.file_path, 'rb') as f:
-                while True:
-                    data = f.read(UPLOAD_CHUNK_SIZE)
-                    if not data:
-                        break
-                    yield level2co_pb2.WriteLevel2CoReq(record = rec, data = data)
-        try:
-            if not rec.file_path:
-                return Result.error(message="file_path is blank")
-            if not os.path.exists(rec.file_path):
-                return Result.error(message="the file [%s] not existed" % (rec.file_path, ))
-            if not rec.filename:
-                rec.filename = os.path.basename(rec.file_path)
-
-            resp,_ = self.stub.Write.with_call(stream(rec),metadata = get_auth_headers())
-            if resp.success:
-                return Result.ok_data(data=Level2CoRecord().from_proto_model(resp.record))
-            else:
-                return Result.error(message = str(resp.error.detail))
-        except grpc.RpcError as e:
-            return Result.error(message="%s:%s" % (e.code().value, e.details()))
+        return write_upload(self.stub.Write, kwargs, rec, level2co_pb2.WriteLevel2CoReq, Level2CoRecord)
@@ -0,0 +1,30 @@
+import numpy as np
+import pytest
+
+from csst_dfs_api_cluster.common.sky import angular_distance, cone_tiles
+
+def _points_in_cone(rng, ra, dec, radius, n):
+    ''' points uniform on the sphere within radius of (ra, dec) '''
+    z = rng.uniform(np.cos(np.radians(radius)), 1, n)
+    phi = rng.uniform(0, 2 * np.pi, n)
+    x, y = np.sqrt(1 - z * z) * np.cos(phi), np.sqrt(1 - z * z) * np.sin(phi)
+    d0, a0 = np.radians(dec), np.radians(ra)
+    # rotate the cone around the pole onto (ra, dec)
+    X, Z = z * np.cos(d0) - x * np.sin(d0), z * np.sin(d0) + x * np.cos(d0)
+    X, Y = X * np.cos(a0) - y * np.sin(a0), X * np.sin(a0) + y * np.cos(a0)
+    return np.degrees(np.arctan2(Y, X)) % 360, np.degrees(np.arcsin(np.clip(Z, -1, 1)))
+
+CONES = [(10, 70, 19.5, 0.5), (10, 80, 9.99, 0.1), (350, -70, 19, 0.4), (0, 0, 5, 0.5),
+    (180, 89, 2, 0.3), (5, -85, 4, 1), (359.9, 45, 3, 0.2), (120, -30, 12, 1.5)]
+
+@pytest.mark.parametrize("ra,dec,radius,tile_radius", CONES)
+def test_cone_tiles_cover_the_cone(ra, dec, radius, tile_radius):
+    rng = np.random.default_rng(0)
+    pra, pdec = _points_in_cone(rng, ra, dec, radius, 5000)
+    assert np.all(angular_distance(ra, dec, pra, pdec) <= radius + 1e-9)
+    tiles = cone_tiles(ra, dec, radius, tile_radius)
+    covered = np.zeros(len(pra), dtype=bool)
+    for tile_ra, tile_dec, tile_r in tiles:
+        assert tile_r <= 2 * tile_radius + 1e-9 or abs(tile_dec) == 90
+        covered |= angular_distance(tile_ra, tile_dec, pra, pdec) <= tile_r
+    assert covered.all(), "%d points of the cone in no tile" % (np.count_nonzero(~covered), )